@@ -0,0 +1,189 @@
+import asyncio
+import bisect
+import logging
+import os
+import re
+import time
+import unicodedata
+from datetime import date
+
+import db
+
+
+logger = logging.getLogger(__name__)
+
+# โหลด index ใหม่ทั้งก้อนเป็นระยะ เผื่อมีการแก้ข้อมูลจาก worker อื่นหรือแก้ใน DB ตรงๆ (0 = ปิด)
+ACCESS_INDEX_REFRESH_SECONDS = float(os.getenv('ACCESS_INDEX_REFRESH_SECONDS', '600'))
+
+_PLATE_NOISE = re.compile(r'[\s\-.]+')
+
+
+def normalize_plate(plate):
+    """Canonical form of a license plate: NFC, no spaces/dashes/dots, upper case."""
+    return _PLATE_NOISE.sub('', unicodedata.normalize('NFC', plate or '')).upper()
+
+
+def normalize_province(province):
+    return ' '.join(unicodedata.normalize('NFC', province or '').split())
+
+
+class AccessIndex:
+    """In-memory answer to "may plate X pass gate Y today?".
+
+    Keeps (plate, province) -> vehicle_id and, per (vehicle_id, gate_id), the
+    AccessPermission date intervals sorted by start date, so a decision is two
+    dict lookups and a bisect instead of two queries. All mutation happens on
+    the event loop, so no locking is needed.
+    """
+
+    def __init__(self):
+        self._plates = {}
+        self._by_plate = {}
+        self._vehicles = {}
+        self._permissions = {}
+        self._intervals = {}
+        self.loaded = False
+        self.loaded_at = None
+
+    def upsert_vehicle(self, vehicle_id, license_plate, province, resident_id):
+        self.remove_vehicle(vehicle_id)
+        plate = normalize_plate(license_plate)
+        province = normalize_province(province)
+        self._vehicles[vehicle_id] = (plate, province, resident_id)
+        self._plates[(plate, province)] = vehicle_id
+        self._by_plate.setdefault(plate, set()).add(vehicle_id)
+
+    def remove_vehicle(self, vehicle_id):
+        entry = self._vehicles.pop(vehicle_id, None)
+        if entry is None:
+            return
+        plate, province, _ = entry
+        if self._plates.get((plate, province)) == vehicle_id:
+            del self._plates[(plate, province)]
+        ids = self._by_plate.get(plate)
+        if ids is not None:
+            ids.discard(vehicle_id)
+            if not ids:
+                del self._by_plate[plate]
+
+    def vehicle_resident(self, vehicle_id):
+        entry = self._vehicles.get(vehicle_id)
+        return entry[2] if entry else None
+
+    def upsert_permission(self, permission_id, vehicle_id, gate_id, start_date, end_date):
+        self.remove_permission(permission_id)
+        self._permissions[permission_id] = (vehicle_id, gate_id, start_date, end_date)
+        intervals = self._intervals.setdefault((vehicle_id, gate_id), [])
+        bisect.insort(intervals, (start_date, end_date, permission_id))
+
+    def remove_permission(self, permission_id):
+        entry = self._permissions.pop(permission_id, None)
+        if entry is None:
+            return
+        vehicle_id, gate_id, start_date, end_date = entry
+        intervals = self._intervals.get((vehicle_id, gate_id))
+        if intervals is not None:
+            intervals.remove((start_date, end_date, permission_id))
+            if not intervals:
+                del self._intervals[(vehicle_id, gate_id)]
+
+    def find_vehicle(self, license_plate, province=None):
+        """Return ``(vehicle_id, reason)``; ``vehicle_id`` is None when unknown or ambiguous."""
+        plate = normalize_plate(license_plate)
+        if province:
+            vehicle_id = self._plates.get((plate, normalize_province(province)))
+            return (vehicle_id, None) if vehicle_id is not None else (None, 'unknown_vehicle')
+        ids = self._by_plate.get(plate)
+        if not ids:
+            return None, 'unknown_vehicle'
+        if len(ids) > 1:
+            # ทะเบียนซ้ำกันคนละจังหวัด ต้องระบุ province
+            return None, 'ambiguous_plate'
+        return next(iter(ids)), None
+
+    def permission_for(self, vehicle_id, gate_id, day):
+        intervals = self._intervals.get((vehicle_id, gate_id))
+        if not intervals:
+            return None
+        # ช่วงที่เริ่มไม่เกิน day อยู่ด้านซ้ายของจุด bisect, ไล่หาช่วงที่ยังไม่หมดอายุ
+        position = bisect.bisect_right(intervals, day, key=lambda interval: interval[0])
+        for start_date, end_date, permission_id in reversed(intervals[:position]):
+            if end_date >= day:
+                return permission_id
+        return None
+
+    def authorize(self, license_plate, province, gate_id, day=None):
+        day = day or date.today()
+        vehicle_id, reason = self.find_vehicle(license_plate, province)
+        if vehicle_id is None:
+            return {'allowed': False, 'vehicle_id': None, 'permission_id': None, 'reason': reason}
+        permission_id = self.permission_for(vehicle_id, gate_id, day)
+        return {
+            'allowed': permission_id is not None,
+            'vehicle_id': vehicle_id,
+            'permission_id': permission_id,
+            'reason': None if permission_id is not None else 'no_permission',
+        }
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'loaded_at': self.loaded_at,
+            'vehicles': len(self._vehicles),
+            'permissions': len(self._permissions),
+        }
+
+
+async def build_index():
+    index = AccessIndex()
+    async for rows in db.stream('SELECT vehicle_id, license_plate, province, resident_id FROM Vehicle'):
+        for vehicle_id, license_plate, province, resident_id in rows:
+            index.upsert_vehicle(vehicle_id, license_plate, province, resident_id)
+    # สิทธิ์ที่หมดอายุไปแล้วไม่มีผลกับการตัดสินใจวันนี้หรืออนาคต ไม่ต้องเก็บ
+    async for rows in db.stream(
+        'SELECT permission_id, vehicle_id, allowed_gate_id, start_date, end_date FROM AccessPermission WHERE end_date >= %s',
+        (date.today(),),
+    ):
+        for permission_id, vehicle_id, gate_id, start_date, end_date in rows:
+            index.upsert_permission(permission_id, vehicle_id, gate_id, start_date, end_date)
+    index.loaded = True
+    index.loaded_at = time.time()
+    return index
+
+
+index = AccessIndex()
+_journal = None
+
+
+def apply(method, *args):
+    """Apply an incremental change, e.g. ``apply('upsert_vehicle', ...)``, to the live index."""
+    getattr(index, method)(*args)
+    if _journal is not None:
+        _journal.append((method, args))
+
+
+async def reload():
+    global index, _journal
+    # สร้าง index ใหม่แยกไว้แล้วค่อยสลับ ระหว่างโหลด request ยังใช้ตัวเดิมได้
+    # การแก้ไขที่เกิดระหว่างโหลดถูกจดไว้แล้วเล่นซ้ำกับ index ใหม่ก่อนสลับ
+    _journal = []
+    try:
+        new_index = await build_index()
+        for method, args in _journal:
+            getattr(new_index, method)(*args)
+        index = new_index
+    finally:
+        _journal = None
+    return index
+
+
+async def refresh_forever(interval):
+    while True:
+        if index.loaded and interval <= 0:
+            return
+        # ถ้ายังโหลดไม่สำเร็จ (เช่น DB ล่มตอน start) ลองใหม่เร็วๆ
+        await asyncio.sleep(interval if index.loaded else 5)
+        try:
+            await reload()
+        except Exception:
+            logger.exception("Loading the access index failed")
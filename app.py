@@ -1,20 +1,156 @@
-from datetime import date, datetime
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, EmailStr
-import mysql.connector
-from typing import List, Optional
-
-app = FastAPI()
-
-
-def get_db_connection():
-    cnx = mysql.connector.connect(
-        host='000.00.00.00',
-        user='00',
-        password='00000',
-        database='00'
-    )
-    return cnx
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, EmailStr, ValidationError
+from typing import Any, Dict, List, Literal, Optional
+
+import access_index
+import auth
+import batch
+import cache
+import db
+import etags
+import events
+import export
+import images
+import metrics
+import negotiation
+import occupancy
+import plate_search
+import replication
+import rollups
+import schema
+import serialization
+import slow_queries
+import write_behind
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, Keyset
+
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # สร้าง connection pool ครั้งเดียวตอน start แทนการ connect ใหม่ทุก request
+    global entry_exit_log_buffer
+    await db.init_database()
+    await slow_queries.log.start()
+    # SCHEMA_BOOTSTRAP=verify (default) และ migrate ไม่ยอม start ถ้า schema มีปัญหา warn แค่ log
+    await schema.bootstrap(HOT_QUERIES)
+    if write_behind.WRITE_BEHIND_ENABLED:
+        entry_exit_log_buffer = write_behind.create_buffer(flush_entry_exit_logs, after_commit=track_entry_exit_logs)
+        await entry_exit_log_buffer.start()
+    # โหลด index ใน memory (สิทธิ์ที่ไม้กั้น, ค้นหาทะเบียน, รถที่อยู่ในโครงการ) ถ้า DB ยังไม่พร้อม refresh task จะลองใหม่ให้
+    for index_module in (access_index, plate_search, occupancy):
+        try:
+            await index_module.reload()
+        except Exception:
+            logger.exception("Loading %s at startup failed", index_module.__name__)
+    refresh_tasks = [
+        asyncio.create_task(access_index.refresh_forever(access_index.ACCESS_INDEX_REFRESH_SECONDS)),
+        asyncio.create_task(plate_search.refresh_forever(plate_search.PLATE_INDEX_REFRESH_SECONDS)),
+        asyncio.create_task(occupancy.refresh_forever(occupancy.OCCUPANCY_RECONCILE_SECONDS)),
+    ]
+    yield
+    for task in refresh_tasks:
+        task.cancel()
+    # ปิด stream ของจอที่ต่ออยู่ ไม่อย่างนั้น server จะรอ response ที่ไม่มีวันจบ
+    events.broker.close()
+    if entry_exit_log_buffer is not None:
+        # ปิดแบบ graceful: flush event ที่ค้างในคิวให้หมดก่อนปิด pool
+        await entry_exit_log_buffer.stop()
+        entry_exit_log_buffer = None
+    await slow_queries.log.stop()
+    await db.close_database()
+
+# endpoint ที่คืน dict ก็ตอบ MessagePack ได้ตาม Accept เหมือน endpoint ที่คืน rows
+app = FastAPI(lifespan=lifespan, default_response_class=serialization.FastJSONResponse)
+
+# ต้องเพิ่มก่อน metrics: middleware ที่เพิ่มทีหลังอยู่ชั้นนอก เวลาบีบอัดและเวลาเลือก replica จึงนับรวมใน latency ด้วย
+app.add_middleware(replication.ReplicationMiddleware)
+app.add_middleware(negotiation.NegotiationMiddleware)
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    db.add_observer(metrics.observe_db)
+if slow_queries.SLOW_QUERY_THRESHOLD_MS > 0:
+    db.add_observer(slow_queries.log.observe)
+
+# สิทธิ์ตาม role (admin ผ่านทุกอัน): GATE = งานของ รปภ. ที่ป้อมยาม, ADMIN = จัดการข้อมูลหลัก ผู้ใช้ export และ debug
+GATE = [Depends(auth.require(*auth.GATE_ROLES))]
+ADMIN = [Depends(auth.require(*auth.ADMIN_ROLES))]
+# EventSource และ <img> ของ browser ใส่ header ไม่ได้ ให้ส่ง token ทาง ?access_token= แทน
+GATE_QUERY_TOKEN = [Depends(auth.require(*auth.GATE_ROLES, query_token=True))]
+
+
+@app.exception_handler(db.PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: db.PoolTimeoutError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(write_behind.QueueFullError)
+async def write_behind_full_handler(request: Request, exc: write_behind.QueueFullError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+# ไม่มี guard โดยตั้งใจ: Prometheus scrape ด้วย token ที่หมดอายุทุก 8 ชม. ไม่ได้ มีแค่ตัวนับ ไม่มีข้อมูลของใคร ให้กันที่ network แทน
+@app.get('/metrics', tags=["Debug"], summary="Prometheus Metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get('/debug/pool', tags=["Debug"], summary="Connection Pool Usage", dependencies=ADMIN)
+async def pool_stats():
+    return db.stats()
+
+@app.get('/debug/replication', tags=["Debug"], summary="Read Replica Routing", dependencies=ADMIN)
+async def replication_stats():
+    return replication.router.stats()
+
+@app.get('/debug/auth', tags=["Debug"], summary="Token Cache and Password Hashing", dependencies=ADMIN)
+async def auth_stats():
+    return {**auth.sessions.stats(), 'password_hashing': auth.hasher.stats()}
+
+@app.get('/debug/access-index', tags=["Debug"], summary="Access Decision Index Size", dependencies=ADMIN)
+async def access_index_stats():
+    return access_index.index.stats()
+
+@app.get('/debug/cache', tags=["Debug"], summary="Reference Table Cache Hit Rates", dependencies=ADMIN)
+async def cache_stats():
+    return cache.stats()
+
+@app.get('/debug/plate-index', tags=["Debug"], summary="Plate Search Index Size", dependencies=ADMIN)
+async def plate_index_stats():
+    return plate_search.index.stats()
+
+@app.get('/debug/events', tags=["Debug"], summary="Live Event Subscribers", dependencies=ADMIN)
+async def event_stats():
+    return events.broker.stats()
+
+@app.get('/debug/images', tags=["Debug"], summary="Image Store Writes and Thumbnails", dependencies=ADMIN)
+async def image_stats():
+    return images.store.stats()
+
+@app.get('/debug/occupancy', tags=["Debug"], summary="Occupancy Tracker Size and Drift", dependencies=ADMIN)
+async def occupancy_stats():
+    return occupancy.tracker.stats()
+
+@app.get('/debug/slow-queries', tags=["Debug"], summary="Slow Statements With EXPLAIN Plans", dependencies=ADMIN)
+async def slow_query_stats():
+    return slow_queries.log.stats()
+
+@app.delete('/debug/slow-queries', tags=["Debug"], summary="Reset Slow Query Log", dependencies=ADMIN)
+async def clear_slow_queries():
+    slow_queries.log.clear()
+    return {"message": "Slow query log cleared"}
+
+@app.get('/debug/write-behind', tags=["Debug"], summary="Write-Behind Buffer Throughput", dependencies=ADMIN)
+async def write_behind_stats():
+    if entry_exit_log_buffer is None:
+        return {"enabled": False}
+    return {"enabled": True, **entry_exit_log_buffer.stats()}
 
 class Vehicles(BaseModel):
     vehicle_id: Optional[int] = None  
@@ -27,6 +163,12 @@ class Vehicles(BaseModel):
     color: str
     brand: str
 
+class StoredImage(BaseModel):
+    hash: str
+    size: int
+    content_type: str
+    url: str
+
 class Visitor(BaseModel):
     visitor_id: Optional[int] = None
     name: str
@@ -55,6 +197,22 @@ class User(BaseModel):
     role: str
     created_at: datetime
     
+class LoginRequest(BaseModel):
+    username: str
+    password: str
+
+class AccessToken(BaseModel):
+    access_token: str
+    token_type: str = 'bearer'
+    expires_in: int
+    user_id: int
+    role: str
+
+class CurrentUser(BaseModel):
+    user_id: int
+    role: str
+    expires_at: datetime
+
 class AccessPermission(BaseModel):
     permission_id: Optional[int] = None
     vehicle_id: int
@@ -90,62 +248,232 @@ class EntryExitLog(BaseModel):
     exit_time: Optional[datetime] = None
     gate_id: int
 
-@app.get('/vehicle', response_model=List[Vehicles], tags=["Vehicle"], summary="Fetch All Vehicles Limit 10")
-@app.get('/vehicle/{vehicle_id}', response_model=Optional[Vehicles], tags=["Vehicle"], summary="Fetch Vehicle by ID")
-def fetch_vehicles(vehicle_id: Optional[int] = None):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
+class AccessDecision(BaseModel):
+    gate_id: int
+    allowed: bool
+    vehicle_id: Optional[int] = None
+    permission_id: Optional[int] = None
+    reason: Optional[str] = None
 
+class CheckIn(BaseModel):
+    plate: str
+    province: Optional[str] = None
+    timestamp: Optional[datetime] = None  # เวลาที่กล้องอ่านป้ายได้ ไม่ระบุใช้เวลาปัจจุบัน
+    security_staff_id: Optional[int] = None
+
+class CheckInResult(AccessDecision):
+    direction: str  # 'entry' หรือ 'exit' ตาม gate_type
+    timestamp: datetime
+    log_id: Optional[int] = None
+    incident_id: Optional[int] = None
+
+class PlateCandidate(BaseModel):
+    vehicle_id: int
+    license_plate: str
+    province: str
+    match: str  # 'exact', 'confusable', 'prefix' หรือ 'fuzzy'
+    distance: int
+
+class TrafficPoint(BaseModel):
+    bucket_start: datetime
+    gate_id: int
+    entries: int
+    exits: int
+
+class BulkItemError(BaseModel):
+    index: int
+    detail: str
+
+class BulkInsertResult(BaseModel):
+    inserted: int
+    log_ids: List[Optional[int]]
+    errors: List[BulkItemError]
+
+# Keyset pagination ของแต่ละ list endpoint (เรียงตาม primary key, log เรียงตาม entry_time ล่าสุดก่อน)
+VEHICLE_PAGES = Keyset('Vehicle', ('vehicle_id', 'province', 'license_plate_img', 'vehicle_img', 'resident_id', 'license_plate', 'vehicle_type', 'color', 'brand'), ('vehicle_id',))
+VISITOR_PAGES = Keyset('Visitor', ('visitor_id', 'name', 'phone', 'purpose', 'vehicle_id', 'resident_id'), ('visitor_id',))
+RESIDENT_PAGES = Keyset('Resident', ('resident_id', 'user_id', 'name', 'address', 'phone', 'prefix', 'lastname', 'citizen_id'), ('resident_id',))
+# ไม่มี password ใน list ที่อ่านออกไป hash มีแค่ใน LOGIN_QUERY
+USER_PAGES = Keyset('User', ('user_id', 'email', 'username', 'role', 'created_at'), ('user_id',))
+ACCESS_PERMISSION_PAGES = Keyset('AccessPermission', ('permission_id', 'vehicle_id', 'resident_id', 'allowed_gate_id', 'start_date', 'end_date'), ('permission_id',))
+INCIDENT_REPORT_PAGES = Keyset('IncidentReport', ('incident_id', 'description', 'incident_time', 'vehicle_id', 'security_staff_id', 'gate_id'), ('incident_id',))
+SECURITY_STAFF_PAGES = Keyset('SecurityStaff', ('staff_id', 'name', 'shift_time', 'phone', 'gate_id'), ('staff_id',))
+GATE_PAGES = Keyset('Gate', ('gate_id', 'location', 'gate_type'), ('gate_id',))
+ENTRY_EXIT_LOG_PAGES = Keyset(
+    'EntryExitLog',
+    ('log_id', 'vehicle_id', 'entry_time', 'exit_time', 'gate_id'),
+    ('entry_time', 'log_id'),
+    descending=True,
+    parsers=(datetime.fromisoformat, int),
+    where=('entry_time IS NOT NULL',),
+)
+
+# ตารางที่อ่านเป็นชุดด้วย ?ids= ได้ และ relation ที่ expand= ตามไปได้
+GATES = batch.Table(GATE_PAGES, 'gate_id', cache.gates)
+SECURITY_STAFF = batch.Table(SECURITY_STAFF_PAGES, 'staff_id', cache.security_staff)
+USERS = batch.Table(USER_PAGES, 'user_id')
+RESIDENTS = batch.Table(RESIDENT_PAGES, 'resident_id')
+VEHICLES = batch.Table(VEHICLE_PAGES, 'vehicle_id', relations={'resident': ('resident_id', RESIDENTS)})
+VISITORS = batch.Table(VISITOR_PAGES, 'visitor_id')
+ACCESS_PERMISSIONS = batch.Table(ACCESS_PERMISSION_PAGES, 'permission_id', relations={
+    'vehicle': ('vehicle_id', VEHICLES),
+    'resident': ('resident_id', RESIDENTS),
+    'gate': ('allowed_gate_id', GATES),
+})
+INCIDENT_REPORTS = batch.Table(INCIDENT_REPORT_PAGES, 'incident_id', relations={
+    'vehicle': ('vehicle_id', VEHICLES),
+    'gate': ('gate_id', GATES),
+    'security_staff': ('security_staff_id', SECURITY_STAFF),
+})
+ENTRY_EXIT_LOGS = batch.Table(ENTRY_EXIT_LOG_PAGES, 'log_id', relations={
+    'vehicle': ('vehicle_id', VEHICLES),
+    'gate': ('gate_id', GATES),
+})
+
+# SELECT ของ resource เดี่ยว ใช้ทั้งตอน GET และตอนคำนวณ ETag ใน PUT/DELETE คอลัมน์ต้องตรงกันเพื่อให้ ETag เท่ากัน
+VEHICLE_ROW = 'SELECT vehicle_id, province, license_plate_img, vehicle_img, resident_id, license_plate, vehicle_type, color, brand FROM Vehicle WHERE vehicle_id = %s'
+RESIDENT_ROW = 'SELECT resident_id, user_id, name, address, phone, prefix, lastname, citizen_id FROM Resident WHERE resident_id = %s'
+USER_ROW = 'SELECT user_id, email, username, role, created_at FROM User WHERE user_id = %s'
+LOGIN_QUERY = 'SELECT user_id, password, role FROM User WHERE username = %s'
+GATE_ROW = 'SELECT gate_id, location, gate_type FROM Gate WHERE gate_id = %s'
+# คอลัมน์ที่ rollups.log_deltas ใช้ ตามลำดับ argument
+ENTRY_EXIT_LOG_TRAFFIC = 'SELECT gate_id, entry_time, exit_time, exit_gate_id FROM EntryExitLog WHERE log_id = %s'
+
+# check-in ตัดสินสิทธิ์จาก DB ใน transaction เดียวกับที่เขียน log (index ใน memory ของ worker อื่นอาจยังไม่เห็นสิทธิ์ที่เพิ่งแก้)
+CHECKIN_PERMISSION = 'SELECT permission_id FROM AccessPermission WHERE vehicle_id = %s AND allowed_gate_id = %s AND end_date >= %s AND start_date <= %s ORDER BY start_date DESC LIMIT 1'
+CHECKIN_OPEN_LOG = 'SELECT log_id, gate_id, entry_time FROM EntryExitLog WHERE vehicle_id = %s AND exit_time IS NULL ORDER BY log_id DESC LIMIT 1'
+# รถของทะเบียนนี้ ใช้ idx_vehicle_plate (license_plate, province) ได้ทั้งสองแบบ ได้ 2 แถวแปลว่าทะเบียนซ้ำคนละจังหวัด
+CHECKIN_VEHICLE = 'SELECT vehicle_id FROM Vehicle WHERE license_plate = %s AND province = %s LIMIT 2'
+CHECKIN_VEHICLE_ANY_PROVINCE = 'SELECT vehicle_id FROM Vehicle WHERE license_plate = %s LIMIT 2'
+CHECKIN_VEHICLE_EXISTS = 'SELECT vehicle_id FROM Vehicle WHERE vehicle_id = %s'
+
+# query ที่วิ่งบ่อย schema.verify รัน EXPLAIN ทุกตัวตอน start แล้ว fail ถ้าตัวไหนต้อง scan ทั้งตาราง
+HOT_QUERIES = {
+    'vehicle by id': (VEHICLE_ROW, (1,)),
+    'vehicles by ids': VEHICLES.select((1, 2, 3)),
+    'vehicles of resident': VEHICLE_PAGES.query(filters=[('resident_id = %s', 1)]),
+    'vehicle by plate': ('SELECT vehicle_id FROM Vehicle WHERE license_plate = %s AND province = %s', ('กข 1234', 'กรุงเทพมหานคร')),
+    'resident by id': (RESIDENT_ROW, (1,)),
+    'residents of user': RESIDENT_PAGES.query(filters=[('user_id = %s', 1)]),
+    'user by id': (USER_ROW, (1,)),
+    'username taken': ('SELECT user_id FROM User WHERE username = %s AND user_id != %s', ('admin', 1)),
+    'login': (LOGIN_QUERY, ('admin',)),
+    'permissions of vehicle at gate': ACCESS_PERMISSION_PAGES.query(filters=[('vehicle_id = %s', 1), ('allowed_gate_id = %s', 1)]),
+    'active permissions': ('SELECT permission_id, vehicle_id, allowed_gate_id, start_date, end_date FROM AccessPermission WHERE end_date >= %s', (date.today(),)),
+    'logs newest first': ENTRY_EXIT_LOG_PAGES.query(),
+    'logs at gate': ENTRY_EXIT_LOG_PAGES.query(filters=[('gate_id = %s', 1)]),
+    'logs of vehicle': ENTRY_EXIT_LOG_PAGES.query(filters=[('vehicle_id = %s', 1)]),
+    'vehicle inside': ('SELECT log_id FROM EntryExitLog WHERE vehicle_id = %s AND exit_time IS NULL', (1,)),
+    'check-in permission': (CHECKIN_PERMISSION, (1, 1, date.today(), date.today())),
+    'check-in open log': (CHECKIN_OPEN_LOG, (1,)),
+    'check-in vehicle': (CHECKIN_VEHICLE, ('กข 1234', 'กรุงเทพมหานคร')),
+    'check-in vehicle, any province': (CHECKIN_VEHICLE_ANY_PROVINCE, ('กข 1234',)),
+    'open logs': ('SELECT log_id, vehicle_id, gate_id, entry_time FROM EntryExitLog WHERE exit_time IS NULL', ()),
+    'incidents at gate': INCIDENT_REPORT_PAGES.query(filters=[('gate_id = %s', 1)]),
+    'staff at gate': SECURITY_STAFF_PAGES.query(filters=[('gate_id = %s', 1)]),
+    'traffic rollups': (
+        'SELECT bucket_start, gate_id, direction, count FROM TrafficRollup WHERE bucket = %s AND bucket_start >= %s AND bucket_start < %s',
+        ('hour', datetime(2024, 1, 1), datetime(2024, 1, 2)),
+    ),
+}
+
+
+async def fetch_page(
+    keyset: Keyset,
+    response: Response,
+    cursor: Optional[str],
+    limit: int,
+    filters=(),
+    cached: Optional[cache.ReadThroughCache] = None,
+):
+    query, params = keyset.query(cursor, limit, filters)
+    rows, next_cursor = keyset.page(await (cached or db).fetch_all(query, params), limit)
+    if next_cursor:
+        # ส่ง cursor ของหน้าถัดไปทาง header เพื่อให้ body ยังเป็น list เหมือนเดิม
+        response.headers['X-Next-Cursor'] = next_cursor
+    return rows
+
+
+def export_response(name: str, table: str, columns, filters, fmt: str, compress: bool):
+    where = [clause for clause, value in filters if value is not None]
+    params = tuple(value for _, value in filters if value is not None)
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    # เรียงตาม primary key ให้ MySQL ส่งแถวออกมาได้ทันทีโดยไม่ต้อง sort ทั้งช่วงก่อน
+    query += f' ORDER BY {columns[0]}'
+
+    body = export.encode_rows(columns, db.stream(query, params, export.EXPORT_BATCH_SIZE), fmt)
+    filename = f'{name}.{fmt}'
+    media_type = export.MEDIA_TYPES[fmt]
+    if compress:
+        body = export.gzip_chunks(body)
+        filename += '.gz'
+        media_type = 'application/gzip'
+    return StreamingResponse(body, media_type=media_type, headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+async def store_vehicle_images(vehicle: Vehicles):
+    # รูปที่ส่งมาแบบ data: URI ย้ายเข้า image store แล้วเก็บแค่ hash ในแถว Vehicle
+    vehicle.license_plate_img = await images.store_inline(vehicle.license_plate_img)
+    vehicle.vehicle_img = await images.store_inline(vehicle.vehicle_img)
+
+def index_vehicle(vehicle_id: int, vehicle: Vehicles):
+    # อัปเดต index ใน memory หลังเขียน DB สำเร็จแล้วเท่านั้น
+    access_index.apply('upsert_vehicle', vehicle_id, vehicle.license_plate, vehicle.province, vehicle.resident_id)
+    plate_search.apply('upsert', vehicle_id, vehicle.license_plate, vehicle.province)
+
+def unindex_vehicle(vehicle_id: int):
+    access_index.apply('remove_vehicle', vehicle_id)
+    plate_search.apply('remove', vehicle_id)
+
+# ต้องประกาศก่อน /vehicle/{vehicle_id}
+@app.get('/vehicle/search', response_model=List[PlateCandidate], tags=["Vehicle"], summary="Search Vehicles by Plate (Prefix / OCR-Tolerant)", dependencies=GATE)
+async def search_vehicles(
+    plate: str = Query(..., min_length=1),
+    province: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50),
+    max_distance: Optional[int] = Query(None, ge=0, le=2),
+):
+    index = plate_search.index
+    if not index.loaded:
+        raise HTTPException(status_code=503, detail="Plate index is not loaded yet", headers={"Retry-After": "5"})
+    return index.search(plate, province, limit, max_distance)
+
+@app.get('/vehicle', response_model=List[Vehicles], tags=["Vehicle"], summary="Fetch Vehicles (Keyset Paginated)", dependencies=GATE)
+@app.get('/vehicle/{vehicle_id}', response_model=Optional[Vehicles], tags=["Vehicle"], summary="Fetch Vehicle by ID", dependencies=GATE)
+async def fetch_vehicles(
+    response: Response,
+    vehicle_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    resident_id: Optional[int] = None,
+    province: Optional[str] = None,
+    ids: Optional[str] = Query(None, description="Comma-separated ids to fetch in one query instead of a page, e.g. 1,2,3"),
+    if_none_match: Optional[str] = Header(None),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. vehicle_id,license_plate; keys are always included"),
+):
+    table = VEHICLES.project(fields)
     if vehicle_id:
-        query = 'SELECT vehicle_id, province, license_plate_img, vehicle_img, resident_id, license_plate, vehicle_type, color, brand FROM Vehicle WHERE vehicle_id = %s'
-        cursor.execute(query, (vehicle_id,))
-        row = cursor.fetchone()
+        row = await db.fetch_one(table.row_query, (vehicle_id,))
         if not row:
-            cursor.close()
-            cnx.close()
             raise HTTPException(status_code=404, detail="Vehicle not found")
-        vehicle = {
-            'vehicle_id': row[0],
-            'province': row[1],
-            'license_plate_img': row[2],
-            'vehicle_img': row[3],
-            'resident_id': row[4],
-            'license_plate': row[5],
-            'vehicle_type': row[6],
-            'color': row[7],
-            'brand': row[8]
-        }
-        cursor.close()
-        cnx.close()
-        return vehicle
+        # client มีข้อมูลล่าสุดอยู่แล้ว ไม่ต้องส่งรูปทั้งก้อนกลับไปอีก
+        etag = etags.row_etag(row, weak=table is not VEHICLES)
+        if etags.none_match(if_none_match, etag):
+            return etags.not_modified(etag)
+        response.headers['ETag'] = etag
+        return serialization.row_response(table.columns, row, response)
+    elif ids:
+        rows = await table.fetch_ids(batch.parse_ids(ids))
+        return serialization.rows_response(table.columns, rows, response)
     else:
-        query = 'SELECT vehicle_id, province, license_plate_img, vehicle_img, resident_id, license_plate, vehicle_type, color, brand FROM Vehicle LIMIT 10'
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        cursor.close()
-        cnx.close()
-        
-        vehicles_list = []
-        for row in rows:
-            vehicles_list.append({
-                'vehicle_id': row[0],
-                'province': row[1],
-                'license_plate_img': row[2],
-                'vehicle_img': row[3],
-                'resident_id': row[4],
-                'license_plate': row[5],
-                'vehicle_type': row[6],
-                'color': row[7],
-                'brand': row[8]
-            })
-        
-        return vehicles_list
-    
-@app.post('/vehicle', response_model=Vehicles, tags=["Vehicle"], summary="Create a New Vehicle")
-def create_vehicle(vehicle: Vehicles):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+        rows = await fetch_page(table.pages, response, cursor, limit, [('resident_id = %s', resident_id), ('province = %s', province)])
+    
+        return serialization.rows_response(table.columns, rows, response)
+    
+@app.post('/vehicle', response_model=Vehicles, tags=["Vehicle"], summary="Create a New Vehicle", dependencies=ADMIN)
+async def create_vehicle(vehicle: Vehicles):
+    await store_vehicle_images(vehicle)
     if vehicle.vehicle_id:
         query = '''
         INSERT INTO Vehicle (vehicle_id, province, license_plate_img, vehicle_img, resident_id, license_plate, vehicle_type, color, brand)
@@ -179,28 +507,24 @@ def create_vehicle(vehicle: Vehicles):
         )
 
     try:
-        cursor.execute(query, values)
-        cnx.commit()  
+        result = await db.execute(query, values)
         if not vehicle.vehicle_id:
-            vehicle_id = cursor.lastrowid  
+            vehicle_id = result.lastrowid  
         else:
             vehicle_id = vehicle.vehicle_id
-    except mysql.connector.Error as e:
-        cnx.rollback()  
-        cursor.close()
-        cnx.close()
+    except db.DatabaseError as e:
         raise HTTPException(status_code=400, detail=f"Failed to insert vehicle: {str(e)}")
 
-    cursor.close()
-    cnx.close()
-    
+    index_vehicle(vehicle_id, vehicle)
     return {**vehicle.dict(), "vehicle_id": vehicle_id}
 
-@app.put('/vehicle/{vehicle_id}', response_model=Vehicles, tags=["Vehicle"], summary="Update Vehicle Information")
-def update_vehicle(vehicle_id: int, vehicle: Vehicles):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.put('/vehicle/{vehicle_id}', response_model=Vehicles, tags=["Vehicle"], summary="Update Vehicle Information", dependencies=ADMIN)
+async def update_vehicle(
+    vehicle_id: int,
+    vehicle: Vehicles,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+):
     query = '''
     UPDATE Vehicle
     SET province = %s, license_plate_img = %s, vehicle_img = %s, resident_id = %s,
@@ -208,100 +532,94 @@ def update_vehicle(vehicle_id: int, vehicle: Vehicles):
     WHERE vehicle_id = %s
     '''
     
-    values = (
-        vehicle.province,
-        vehicle.license_plate_img,
-        vehicle.vehicle_img,
-        vehicle.resident_id,
-        vehicle.license_plate,
-        vehicle.vehicle_type,
-        vehicle.color,
-        vehicle.brand,
-        vehicle_id
-    )
-    
-    cursor.execute(query, values)
-    cnx.commit()  
-    
-    if cursor.rowcount == 0:
-        cnx.close()
-        raise HTTPException(status_code=404, detail="Vehicle not found")
-
-    cursor.close()
-    cnx.close()
+    async with db.transaction() as tx:
+        await etags.lock_and_check(tx, VEHICLE_ROW, vehicle_id, if_match, "Vehicle not found")
+        # เก็บรูปหลังผ่าน 404/412 แล้ว ไม่ให้เหลือไฟล์ที่ไม่มีแถวไหนอ้างถึง
+        await store_vehicle_images(vehicle)
+        values = (
+            vehicle.province,
+            vehicle.license_plate_img,
+            vehicle.vehicle_img,
+            vehicle.resident_id,
+            vehicle.license_plate,
+            vehicle.vehicle_type,
+            vehicle.color,
+            vehicle.brand,
+            vehicle_id
+        )
+        await tx.execute(query, values)
+        response.headers['ETag'] = etags.row_etag(await tx.fetch_one(VEHICLE_ROW, (vehicle_id,)))
 
+    index_vehicle(vehicle_id, vehicle)
     return {**vehicle.dict(), "vehicle_id": vehicle_id}
 
-@app.delete('/vehicle/{vehicle_id}', tags=["Vehicle"], summary="Delete Vehicle by ID")
-def delete_vehicle(vehicle_id: int):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.delete('/vehicle/{vehicle_id}', tags=["Vehicle"], summary="Delete Vehicle by ID", dependencies=ADMIN)
+async def delete_vehicle(vehicle_id: int, if_match: Optional[str] = Header(None)):
     query = 'DELETE FROM Vehicle WHERE vehicle_id = %s'
-    cursor.execute(query, (vehicle_id,))
-    
-    cnx.commit()  
-    
-    if cursor.rowcount == 0:
-        cnx.close()
-        raise HTTPException(status_code=404, detail="Vehicle not found")
-    
-    cursor.close()
-    cnx.close()
+    if if_match is not None:
+        async with db.transaction() as tx:
+            await etags.lock_and_check(tx, VEHICLE_ROW, vehicle_id, if_match, "Vehicle not found")
+            await tx.execute(query, (vehicle_id,))
+    else:
+        result = await db.execute(query, (vehicle_id,))
+        if result.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Vehicle not found")
     
+    unindex_vehicle(vehicle_id)
     return {"message": f"Vehicle with id {vehicle_id} has been deleted."}
 
-# Visitor Endpoints
-@app.get('/visitor', response_model=List[Visitor], tags=["Visitor"], summary="Fetch All Visitors Limit 10")
-@app.get('/visitor/{visitor_id}', response_model=Optional[Visitor], tags=["Visitor"], summary="Fetch Visitor by ID")
-def fetch_visitors(visitor_id: Optional[int] = None):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
+# Image Endpoints
+@app.post('/images', response_model=StoredImage, tags=["Images"], summary="Upload an Image (Raw Body, Deduplicated by Hash)", dependencies=GATE)
+async def upload_image(request: Request):
+    # อ่าน body ทีละ chunk เขียนลงดิสก์เลย ไม่โหลดทั้งไฟล์เข้า memory
+    digest, size, content_type = await images.store.save(request.stream())
+    return {'hash': digest, 'size': size, 'content_type': content_type, 'url': f'/images/{digest}'}
+
+@app.get('/images/{digest}', tags=["Images"], summary="Download an Image by Hash", dependencies=GATE_QUERY_TOKEN)
+async def download_image(digest: str, if_none_match: Optional[str] = Header(None)):
+    media_type = images.store.media_type(digest)
+    etag = f'"{digest}"'
+    if etags.none_match(if_none_match, etag):
+        return etags.not_modified(etag)
+    return FileResponse(images.store.path(digest), media_type=media_type, headers={'ETag': etag, 'Cache-Control': images.CACHE_CONTROL})
+
+@app.get('/images/{digest}/thumbnail', tags=["Images"], summary="Download a Cached JPEG Thumbnail", dependencies=GATE_QUERY_TOKEN)
+async def download_thumbnail(digest: str, size: int = 128, if_none_match: Optional[str] = Header(None)):
+    etag = f'"{digest}-{size}"'
+    if etags.none_match(if_none_match, etag):
+        return etags.not_modified(etag)
+    path = await images.store.thumbnail(digest, size)
+    return FileResponse(path, media_type='image/jpeg', headers={'ETag': etag, 'Cache-Control': images.CACHE_CONTROL})
 
+# Visitor Endpoints
+@app.get('/visitor', response_model=List[Visitor], tags=["Visitor"], summary="Fetch Visitors (Keyset Paginated)", dependencies=GATE)
+@app.get('/visitor/{visitor_id}', response_model=Optional[Visitor], tags=["Visitor"], summary="Fetch Visitor by ID", dependencies=GATE)
+async def fetch_visitors(
+    response: Response,
+    visitor_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    resident_id: Optional[int] = None,
+    vehicle_id: Optional[int] = None,
+    ids: Optional[str] = Query(None, description="Comma-separated ids to fetch in one query instead of a page, e.g. 1,2,3"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. vehicle_id,license_plate; keys are always included"),
+):
+    table = VISITORS.project(fields)
     if visitor_id:
-        query = 'SELECT visitor_id, name, phone, purpose, vehicle_id, resident_id FROM Visitor WHERE visitor_id = %s'
-        cursor.execute(query, (visitor_id,))
-        row = cursor.fetchone()
+        row = await db.fetch_one(table.row_query, (visitor_id,))
         if not row:
-            cursor.close()
-            cnx.close()
             raise HTTPException(status_code=404, detail="Visitor not found")
-        visitor = {
-            'visitor_id': row[0],
-            'name': row[1],
-            'phone': row[2],
-            'purpose': row[3],
-            'vehicle_id': row[4],
-            'resident_id': row[5]
-        }
-        cursor.close()
-        cnx.close()
-        return visitor
+        return serialization.row_response(table.columns, row, response)
+    elif ids:
+        rows = await table.fetch_ids(batch.parse_ids(ids))
+        return serialization.rows_response(table.columns, rows, response)
     else:
-        query = 'SELECT visitor_id, name, phone, purpose, vehicle_id, resident_id FROM Visitor LIMIT 10'
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        cursor.close()
-        cnx.close()
-        
-        visitors = []
-        for row in rows:
-            visitors.append({
-                'visitor_id': row[0],
-                'name': row[1],
-                'phone': row[2],
-                'purpose': row[3],
-                'vehicle_id': row[4],
-                'resident_id': row[5]
-            })
-        
-        return visitors
-
-@app.post('/visitor', response_model=Visitor, tags=["Visitor"], summary="Create a New Visitor")
-def create_visitor(visitor: Visitor):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
+        rows = await fetch_page(table.pages, response, cursor, limit, [('resident_id = %s', resident_id), ('vehicle_id = %s', vehicle_id)])
+    
+        return serialization.rows_response(table.columns, rows, response)
 
+@app.post('/visitor', response_model=Visitor, tags=["Visitor"], summary="Create a New Visitor", dependencies=GATE)
+async def create_visitor(visitor: Visitor):
     query = '''
     INSERT INTO Visitor (name, phone, purpose, vehicle_id, resident_id)
     VALUES (%s, %s, %s, %s, %s)
@@ -315,20 +633,14 @@ def create_visitor(visitor: Visitor):
         visitor.resident_id
     )
     
-    cursor.execute(query, values)
-    cnx.commit()
+    result = await db.execute(query, values)
     
-    visitor_id = cursor.lastrowid
-    cursor.close()
-    cnx.close()
+    visitor_id = result.lastrowid
     
     return {**visitor.dict(), "visitor_id": visitor_id}
 
-@app.put('/visitor/{visitor_id}', response_model=Visitor, tags=["Visitor"], summary="Update Visitor Information")
-def update_visitor(visitor_id: int, visitor: Visitor):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.put('/visitor/{visitor_id}', response_model=Visitor, tags=["Visitor"], summary="Update Visitor Information", dependencies=GATE)
+async def update_visitor(visitor_id: int, visitor: Visitor):
     query = '''
     UPDATE Visitor
     SET name = %s, phone = %s, purpose = %s, vehicle_id = %s, resident_id = %s
@@ -344,99 +656,64 @@ def update_visitor(visitor_id: int, visitor: Visitor):
         visitor_id
     )
     
-    cursor.execute(query, values)
-    cnx.commit()
+    result = await db.execute(query, values)
     
-    if cursor.rowcount == 0:
-        cnx.close()
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="ไม่พบผู้เยี่ยมเยียน")
     
-    cursor.close()
-    cnx.close()
-    
     return {**visitor.dict(), "visitor_id": visitor_id}
 
-@app.delete('/visitor/{visitor_id}', tags=["Visitor"], summary="Delete Visitor by ID")
-def delete_visitor(visitor_id: int):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.delete('/visitor/{visitor_id}', tags=["Visitor"], summary="Delete Visitor by ID", dependencies=ADMIN)
+async def delete_visitor(visitor_id: int):
     query = 'DELETE FROM Visitor WHERE visitor_id = %s'
-    cursor.execute(query, (visitor_id,))
-    
-    cnx.commit()
+    result = await db.execute(query, (visitor_id,))
     
-    if cursor.rowcount == 0:
-        cnx.close()
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="ไม่พบผู้เยี่ยมเยียน")
     
-    cursor.close()
-    cnx.close()
-    
     return {"message": f"ผู้เยี่ยมเยียนที่มี ID {visitor_id} ถูกลบแล้ว"}
 
 # ---------------------- Resident Endpoints ----------------------
 
-@app.get("/resident", response_model=List[Resident], tags=["Resident"], summary="Fetch All Residents Limit 10")
-def fetch_residents():
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
-    query = 'SELECT resident_id, user_id, name, address, phone, prefix, lastname, citizen_id FROM Resident LIMIT 10'
-    cursor.execute(query)
-    rows = cursor.fetchall()
-
-    residents = []
-    for row in rows:
-        residents.append({
-            'resident_id': row[0],
-            'user_id': row[1],
-            'name': row[2],
-            'address': row[3],
-            'phone': row[4],
-            'prefix': row[5],
-            'lastname': row[6],
-            'citizen_id': row[7]
-        })
-
-    cursor.close()
-    cnx.close()
-    return residents
-
-@app.get("/resident/{resident_id}", response_model=Resident, tags=["Resident"], summary="Fetch Resident by ID")
-def get_resident(resident_id: int):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
-    query = 'SELECT resident_id, user_id, name, address, phone, prefix, lastname, citizen_id FROM Resident WHERE resident_id = %s'
-    cursor.execute(query, (resident_id,))
-    row = cursor.fetchone()
+@app.get("/resident", response_model=List[Resident], tags=["Resident"], summary="Fetch Residents (Keyset Paginated)", dependencies=GATE)
+async def fetch_residents(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user_id: Optional[int] = None,
+    ids: Optional[str] = Query(None, description="Comma-separated ids to fetch in one query instead of a page, e.g. 1,2,3"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. vehicle_id,license_plate; keys are always included"),
+):
+    table = RESIDENTS.project(fields)
+    if ids:
+        rows = await table.fetch_ids(batch.parse_ids(ids))
+        return serialization.rows_response(table.columns, rows, response)
+    rows = await fetch_page(table.pages, response, cursor, limit, [('user_id = %s', user_id)])
+
+    return serialization.rows_response(table.columns, rows, response)
+
+@app.get("/resident/{resident_id}", response_model=Resident, tags=["Resident"], summary="Fetch Resident by ID", dependencies=GATE)
+async def get_resident(
+    resident_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. vehicle_id,license_plate; keys are always included"),
+):
+    table = RESIDENTS.project(fields)
+    row = await db.fetch_one(table.row_query, (resident_id,))
 
     if not row:
-        cursor.close()
-        cnx.close()
         raise HTTPException(status_code=404, detail="Resident not found")
 
-    resident = {
-        'resident_id': row[0],
-        'user_id': row[1],
-        'name': row[2],
-        'address': row[3],
-        'phone': row[4],
-        'prefix': row[5],
-        'lastname': row[6],
-        'citizen_id': row[7]
-    }
+    etag = etags.row_etag(row, weak=table is not RESIDENTS)
+    if etags.none_match(if_none_match, etag):
+        return etags.not_modified(etag)
+    response.headers['ETag'] = etag
 
-    cursor.close()
-    cnx.close()
-    return resident
-
-@app.post("/resident", response_model=Resident, tags=["Resident"], summary="Create a New Resident")
-def create_resident(resident: Resident):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
+    return serialization.row_response(table.columns, row, response)
 
+@app.post("/resident", response_model=Resident, tags=["Resident"], summary="Create a New Resident", dependencies=ADMIN)
+async def create_resident(resident: Resident):
     # Inserting the new resident with user_id as a foreign key
     query = '''
     INSERT INTO Resident (user_id, name, address, phone, prefix, lastname, citizen_id)
@@ -453,23 +730,20 @@ def create_resident(resident: Resident):
     )
 
     try:
-        cursor.execute(query, values)
-        cnx.commit()
-        resident_id = cursor.lastrowid
-    except mysql.connector.Error as e:
-        cnx.rollback()
+        result = await db.execute(query, values)
+        resident_id = result.lastrowid
+    except db.DatabaseError as e:
         raise HTTPException(status_code=400, detail=f"Error creating resident: {str(e)}")
-    finally:
-        cursor.close()
-        cnx.close()
 
     return {**resident.dict(), "resident_id": resident_id}
 
-@app.put("/resident/{resident_id}", response_model=Resident, tags=["Resident"], summary="Update Resident Information")
-def update_resident(resident_id: int, resident: Resident):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.put("/resident/{resident_id}", response_model=Resident, tags=["Resident"], summary="Update Resident Information", dependencies=ADMIN)
+async def update_resident(
+    resident_id: int,
+    resident: Resident,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+):
     query = '''
     UPDATE Resident
     SET user_id = %s, name = %s, address = %s, phone = %s, prefix = %s, lastname = %s, citizen_id = %s
@@ -486,234 +760,211 @@ def update_resident(resident_id: int, resident: Resident):
         resident_id
     )
 
-    cursor.execute(query, values)
-    cnx.commit()
-
-    if cursor.rowcount == 0:
-        cursor.close()
-        cnx.close()
-        raise HTTPException(status_code=404, detail="Resident not found")
-
-    cursor.close()
-    cnx.close()
+    async with db.transaction() as tx:
+        await etags.lock_and_check(tx, RESIDENT_ROW, resident_id, if_match, "Resident not found")
+        await tx.execute(query, values)
+        response.headers['ETag'] = etags.row_etag(await tx.fetch_one(RESIDENT_ROW, (resident_id,)))
 
     return {**resident.dict(), "resident_id": resident_id}
 
-@app.delete("/resident/{resident_id}", tags=["Resident"], summary="Delete Resident by ID")
-def delete_resident(resident_id: int):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.delete("/resident/{resident_id}", tags=["Resident"], summary="Delete Resident by ID", dependencies=ADMIN)
+async def delete_resident(resident_id: int, if_match: Optional[str] = Header(None)):
     query = 'DELETE FROM Resident WHERE resident_id = %s'
-    cursor.execute(query, (resident_id,))
-    cnx.commit()
-
-    if cursor.rowcount == 0:
-        cursor.close()
-        cnx.close()
-        raise HTTPException(status_code=404, detail="Resident not found")
+    if if_match is not None:
+        async with db.transaction() as tx:
+            await etags.lock_and_check(tx, RESIDENT_ROW, resident_id, if_match, "Resident not found")
+            await tx.execute(query, (resident_id,))
+    else:
+        result = await db.execute(query, (resident_id,))
+        if result.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Resident not found")
 
-    cursor.close()
-    cnx.close()
     return {"message": f"Resident with ID {resident_id} has been deleted."}
 
+# ---------------------- Auth Endpoints ----------------------
+@app.post('/auth/login', response_model=AccessToken, tags=["Auth"], summary="Log In and Get a Bearer Token")
+async def login(credentials: LoginRequest):
+    row = await db.fetch_one(LOGIN_QUERY, (credentials.username,))
+    if not await auth.hasher.check(credentials.password, row[1] if row else None):
+        raise HTTPException(status_code=401, detail="Incorrect username or password", headers={'WWW-Authenticate': 'Bearer'})
+    user_id, stored, role = row
+    if auth.needs_rehash(stored):
+        # รหัสผ่าน plain text เดิม หรือ iterations ที่ตั้งไว้เปลี่ยน: hash ใหม่ตอนที่มีรหัสผ่านจริงอยู่ในมือ
+        # WHERE ค่าเดิม กันทับรหัสผ่านที่ admin เพิ่งเปลี่ยนระหว่างทาง
+        await db.execute('UPDATE User SET password = %s WHERE user_id = %s AND password = %s', (await auth.hasher.hash(credentials.password), user_id, stored))
+    token, _ = auth.sessions.issue(user_id, role)
+    return {'access_token': token, 'token_type': 'bearer', 'expires_in': auth.AUTH_TOKEN_TTL_SECONDS, 'user_id': user_id, 'role': role}
+
+@app.post('/auth/logout', tags=["Auth"], summary="Revoke the Current Token")
+async def logout(session: Optional[auth.Session] = Depends(auth.require())):
+    if session is not None:
+        auth.sessions.revoke(session)
+    return {"message": "Logged out"}
+
+@app.get('/auth/me', response_model=CurrentUser, tags=["Auth"], summary="Who the Current Token Belongs To")
+async def current_user(session: Optional[auth.Session] = Depends(auth.require())):
+    if session is None:
+        raise HTTPException(status_code=404, detail="Authentication is disabled")
+    return {'user_id': session.user_id, 'role': session.role, 'expires_at': datetime.fromtimestamp(session.expires_at)}
+
 # ---------------------- User Endpoints ----------------------
-@app.get("/user", response_model=List[User], tags=["User"], summary="Fetch All Users Limit 10")
-def fetch_users():
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
-    query = 'SELECT user_id, email, username, password, role, created_at FROM User LIMIT 10'
-    cursor.execute(query)
-    rows = cursor.fetchall()
-
-    users = []
-    for row in rows:
-        users.append({
-            'user_id': row[0],
-            'email': row[1],
-            'username': row[2],
-            'password': row[3],  
-            'role': row[4],
-            'created_at': row[5]
-        })
-
-    cursor.close()
-    cnx.close()
-    return users
-
-@app.get("/user/{user_id}", response_model=User, tags=["User"], summary="Fetch User by ID")
-def get_user(user_id: int):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
-    query = 'SELECT user_id, email, username, password, role, created_at FROM User WHERE user_id = %s'
-    cursor.execute(query, (user_id,))
-    row = cursor.fetchone()
+@app.get("/user", response_model=List[User], response_model_exclude={'password'}, tags=["User"], summary="Fetch Users (Keyset Paginated)", dependencies=ADMIN)
+async def fetch_users(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    role: Optional[str] = None,
+    ids: Optional[str] = Query(None, description="Comma-separated ids to fetch in one query instead of a page, e.g. 1,2,3"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. vehicle_id,license_plate; keys are always included"),
+):
+    table = USERS.project(fields)
+    if ids:
+        rows = await table.fetch_ids(batch.parse_ids(ids))
+        return serialization.rows_response(table.columns, rows, response)
+    rows = await fetch_page(table.pages, response, cursor, limit, [('role = %s', role)])
+
+    return serialization.rows_response(table.columns, rows, response)
+
+@app.get("/user/{user_id}", response_model=User, response_model_exclude={'password'}, tags=["User"], summary="Fetch User by ID", dependencies=ADMIN)
+async def get_user(
+    user_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. vehicle_id,license_plate; keys are always included"),
+):
+    table = USERS.project(fields)
+    row = await db.fetch_one(table.row_query, (user_id,))
 
     if not row:
-        cursor.close()
-        cnx.close()
         raise HTTPException(status_code=404, detail="User not found")
 
-    user = {
-        'user_id': row[0],
-        'email': row[1],
-        'username': row[2],
-        'password': row[3],  
-        'role': row[4],
-        'created_at': row[5]
-    }
-
-    cursor.close()
-    cnx.close()
-    return user
+    etag = etags.row_etag(row, weak=table is not USERS)
+    if etags.none_match(if_none_match, etag):
+        return etags.not_modified(etag)
+    response.headers['ETag'] = etag
 
-@app.post("/user", response_model=User, tags=["User"], summary="Create a New User")
-def create_user(user: User):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
+    return serialization.row_response(table.columns, row, response)
 
+@app.post("/user", response_model=User, response_model_exclude={'password'}, tags=["User"], summary="Create a New User", dependencies=ADMIN)
+async def create_user(user: User):
     # Inserting the new user
     query = '''
     INSERT INTO User (username, password, role, email, created_at)
     VALUES (%s, %s, %s, %s, NOW())
     '''
-    values = (user.username, user.password, user.role, user.email)
+    password = await auth.hasher.for_storage(user.password)
+    values = (user.username, password, user.role, user.email)
 
     try:
-        cursor.execute(query, values)
-        cnx.commit()
-        user_id = cursor.lastrowid
-    except mysql.connector.Error as e:
-        cnx.rollback()
+        result = await db.execute(query, values)
+        user_id = result.lastrowid
+    except db.DatabaseError as e:
         raise HTTPException(status_code=400, detail=f"Error creating user: {str(e)}")
-    finally:
-        cursor.close()
-        cnx.close()
 
     return {**user.dict(), "user_id": user_id}
 
 from datetime import datetime
 
-@app.put("/user/{user_id}", response_model=User, tags=["User"], summary="Update User Information")
-def update_user(user_id: int, user: User):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.put("/user/{user_id}", response_model=User, response_model_exclude={'password'}, tags=["User"], summary="Update User Information", dependencies=ADMIN)
+async def update_user(
+    user_id: int,
+    user: User,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+):
+    # hash นอก transaction ไม่ให้ถือ lock แถวไว้หลายร้อย ms
+    password = await auth.hasher.for_storage(user.password)
     try:
-        # ตรวจสอบว่ามี username ซ้ำหรือไม่
-        query_check_username = '''
-        SELECT user_id FROM User WHERE username = %s AND user_id != %s
-        '''
-        cursor.execute(query_check_username, (user.username, user_id))
-        existing_user = cursor.fetchone()
+        async with db.transaction() as tx:
+            await etags.lock_and_check(tx, USER_ROW, user_id, if_match, "User not found")
 
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Username is already in use by another user")
+            # ตรวจสอบว่ามี username ซ้ำหรือไม่
+            query_check_username = '''
+            SELECT user_id FROM User WHERE username = %s AND user_id != %s
+            '''
+            existing_user = await tx.fetch_one(query_check_username, (user.username, user_id))
 
-        # SQL query สำหรับการอัปเดตข้อมูลผู้ใช้ โดยอัปเดต created_at เป็นเวลาปัจจุบัน
-        query = '''
-        UPDATE User
-        SET username = %s, password = %s, role = %s, email = %s, created_at = %s
-        WHERE user_id = %s
-        '''
-        
-        # ดึงเวลาปัจจุบัน
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            if existing_user:
+                raise HTTPException(status_code=400, detail="Username is already in use by another user")
 
-        values = (user.username, user.password, user.role, user.email, current_time, user_id)
+            # SQL query สำหรับการอัปเดตข้อมูลผู้ใช้ โดยอัปเดต created_at เป็นเวลาปัจจุบัน
+            # ไม่ส่ง password มาแปลว่าไม่เปลี่ยน (GET ไม่คืน password ให้ส่งกลับมาอยู่แล้ว)
+            query = f'''
+            UPDATE User
+            SET username = %s, {'password = %s, ' if password is not None else ''}role = %s, email = %s, created_at = %s
+            WHERE user_id = %s
+            '''
 
-        cursor.execute(query, values)
-        cnx.commit()
+            # ดึงเวลาปัจจุบัน
+            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        # ตรวจสอบว่ามีการอัปเดตแถวหรือไม่
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="User not found")
+            values = (user.username, *((password,) if password is not None else ()), user.role, user.email, current_time, user_id)
 
-    except mysql.connector.Error as e:
-        cnx.rollback()
+            await tx.execute(query, values)
+            response.headers['ETag'] = etags.row_etag(await tx.fetch_one(USER_ROW, (user_id,)))
+
+    except db.DatabaseError as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
-    finally:
-        cursor.close()
-        cnx.close()
+    # role หรือรหัสผ่านอาจเปลี่ยน token ที่ออกไปก่อนหน้านี้ใช้ไม่ได้อีก
+    auth.sessions.revoke_user(user_id)
 
     # คืนค่า response โดยอัปเดต created_at เป็นเวลาล่าสุด
     return {**user.dict(), "user_id": user_id, "created_at": current_time}
 
 
 
-@app.delete("/user/{user_id}", tags=["User"], summary="Delete User by ID")
-def delete_user(user_id: int):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.delete("/user/{user_id}", tags=["User"], summary="Delete User by ID", dependencies=ADMIN)
+async def delete_user(user_id: int, if_match: Optional[str] = Header(None)):
     query = 'DELETE FROM User WHERE user_id = %s'
-    cursor.execute(query, (user_id,))
-    cnx.commit()
-
-    if cursor.rowcount == 0:
-        cursor.close()
-        cnx.close()
-        raise HTTPException(status_code=404, detail="User not found")
+    if if_match is not None:
+        async with db.transaction() as tx:
+            await etags.lock_and_check(tx, USER_ROW, user_id, if_match, "User not found")
+            await tx.execute(query, (user_id,))
+    else:
+        result = await db.execute(query, (user_id,))
+        if result.rowcount == 0:
+            raise HTTPException(status_code=404, detail="User not found")
 
-    cursor.close()
-    cnx.close()
+    auth.sessions.revoke_user(user_id)
     return {"message": f"User with ID {user_id} has been deleted."}
 
 # AccessPermission Endpoints
-@app.get('/accesspermission', response_model=List[AccessPermission], tags=["AccessPermission"], summary="Fetch All Access Permissions Limit 10")
-@app.get('/accesspermission/{permission_id}', response_model=Optional[AccessPermission], tags=["AccessPermission"], summary="Fetch Access Permission by ID")
-def fetch_access_permissions(permission_id: Optional[int] = None):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.get('/accesspermission', response_model=List[AccessPermission], tags=["AccessPermission"], summary="Fetch Access Permissions (Keyset Paginated)", dependencies=GATE)
+@app.get('/accesspermission/{permission_id}', response_model=Optional[AccessPermission], tags=["AccessPermission"], summary="Fetch Access Permission by ID", dependencies=GATE)
+async def fetch_access_permissions(
+    response: Response,
+    permission_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    vehicle_id: Optional[int] = None,
+    resident_id: Optional[int] = None,
+    allowed_gate_id: Optional[int] = None,
+    ids: Optional[str] = Query(None, description="Comma-separated ids to fetch in one query instead of a page, e.g. 1,2,3"),
+    expand: Optional[str] = Query(None, description="Related rows to embed, e.g. vehicle,vehicle.resident,gate"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. vehicle_id,license_plate; keys are always included"),
+):
+    relations = batch.parse_expand(ACCESS_PERMISSIONS, expand)
+    table = ACCESS_PERMISSIONS.project(fields, relations)
     if permission_id:
-        query = 'SELECT permission_id, vehicle_id, resident_id, allowed_gate_id, start_date, end_date FROM AccessPermission WHERE permission_id = %s'
-        cursor.execute(query, (permission_id,))
-        row = cursor.fetchone()
+        row = await db.fetch_one(table.row_query, (permission_id,))
         if not row:
-            cursor.close()
-            cnx.close()
             raise HTTPException(status_code=404, detail="Access Permission not found")
-        access_permission = {
-            'permission_id': row[0],
-            'vehicle_id': row[1],
-            'resident_id': row[2],
-            'allowed_gate_id': row[3],
-            'start_date': row[4].strftime('%Y-%m-%d'),
-            'end_date': row[5].strftime('%Y-%m-%d')
-        }
-        cursor.close()
-        cnx.close()
-        return access_permission
+        return await batch.row_response(table, row, relations, response)
+    elif ids:
+        rows = await table.fetch_ids(batch.parse_ids(ids))
     else:
-        query = 'SELECT permission_id, vehicle_id, resident_id, allowed_gate_id, start_date, end_date FROM AccessPermission LIMIT 10'
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        cursor.close()
-        cnx.close()
-        
-        access_permissions = []
-        for row in rows:
-            access_permissions.append({
-                'permission_id': row[0],
-                'vehicle_id': row[1],
-                'resident_id': row[2],
-                'allowed_gate_id': row[3],
-                'start_date': row[4].strftime('%Y-%m-%d'),
-                'end_date': row[5].strftime('%Y-%m-%d')
-            })
-        
-        return access_permissions
+        rows = await fetch_page(table.pages, response, cursor, limit, [
+            ('vehicle_id = %s', vehicle_id),
+            ('resident_id = %s', resident_id),
+            ('allowed_gate_id = %s', allowed_gate_id),
+        ])
+    
+    return await batch.rows_response(table, rows, relations, response)
 
 # POST - สร้าง Access Permission ใหม่
-@app.post('/accesspermission', response_model=AccessPermission, tags=["AccessPermission"], summary="Create a New Access Permission")
-def create_access_permission(access_permission: AccessPermission):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.post('/accesspermission', response_model=AccessPermission, tags=["AccessPermission"], summary="Create a New Access Permission", dependencies=ADMIN)
+async def create_access_permission(access_permission: AccessPermission):
     query = '''
     INSERT INTO AccessPermission (vehicle_id, resident_id, allowed_gate_id, start_date, end_date)
     VALUES (%s, %s, %s, %s, %s)
@@ -727,21 +978,19 @@ def create_access_permission(access_permission: AccessPermission):
         access_permission.end_date  # รับค่าเป็น date ตรงๆ
     )
     
-    cursor.execute(query, values)
-    cnx.commit()
+    result = await db.execute(query, values)
     
-    permission_id = cursor.lastrowid
-    cursor.close()
-    cnx.close()
+    permission_id = result.lastrowid
     
+    access_index.apply(
+        'upsert_permission', permission_id, access_permission.vehicle_id, access_permission.allowed_gate_id,
+        access_permission.start_date, access_permission.end_date,
+    )
     return {**access_permission.dict(), "permission_id": permission_id}
 
 # PUT - อัปเดตข้อมูล Access Permission
-@app.put('/accesspermission/{permission_id}', response_model=AccessPermission, tags=["AccessPermission"], summary="Update Access Permission Information")
-def update_access_permission(permission_id: int, access_permission: AccessPermission):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.put('/accesspermission/{permission_id}', response_model=AccessPermission, tags=["AccessPermission"], summary="Update Access Permission Information", dependencies=ADMIN)
+async def update_access_permission(permission_id: int, access_permission: AccessPermission):
     query = '''
     UPDATE AccessPermission
     SET vehicle_id = %s, resident_id = %s, allowed_gate_id = %s, start_date = %s, end_date = %s
@@ -757,90 +1006,83 @@ def update_access_permission(permission_id: int, access_permission: AccessPermis
         permission_id
     )
     
-    cursor.execute(query, values)
-    cnx.commit()
+    result = await db.execute(query, values)
     
-    if cursor.rowcount == 0:
-        cnx.close()
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="ไม่พบ Access Permission")
     
-    cursor.close()
-    cnx.close()
-    
+    access_index.apply(
+        'upsert_permission', permission_id, access_permission.vehicle_id, access_permission.allowed_gate_id,
+        access_permission.start_date, access_permission.end_date,
+    )
     return {**access_permission.dict(), "permission_id": permission_id}
 
 # DELETE - ลบ Access Permission โดยใช้ permission_id
-@app.delete('/accesspermission/{permission_id}', tags=["AccessPermission"], summary="Delete Access Permission by ID")
-def delete_access_permission(permission_id: int):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.delete('/accesspermission/{permission_id}', tags=["AccessPermission"], summary="Delete Access Permission by ID", dependencies=ADMIN)
+async def delete_access_permission(permission_id: int):
     query = 'DELETE FROM AccessPermission WHERE permission_id = %s'
-    cursor.execute(query, (permission_id,))
-    
-    cnx.commit()
+    result = await db.execute(query, (permission_id,))
     
-    if cursor.rowcount == 0:
-        cnx.close()
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="ไม่พบ Access Permission")
     
-    cursor.close()
-    cnx.close()
-    
+    access_index.apply('remove_permission', permission_id)
     return {"message": f"Access Permission ที่มี ID {permission_id} ถูกลบแล้ว"}
 
 # IncidentReport Endpoints
-@app.get('/incidentreport', response_model=List[IncidentReport], tags=["IncidentReport"], summary="Fetch All Incident Reports Limit 10")
-@app.get('/incidentreport/{incident_id}', response_model=Optional[IncidentReport], tags=["IncidentReport"], summary="Fetch Incident Report by ID")
-def fetch_incident_reports(incident_id: Optional[int] = None):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.get('/incidentreport/export', tags=["IncidentReport"], summary="Export Incident Reports as NDJSON or CSV", dependencies=ADMIN)
+async def export_incident_reports(
+    from_time: Optional[datetime] = Query(None, alias='from'),
+    to_time: Optional[datetime] = Query(None, alias='to'),
+    gate_id: Optional[int] = None,
+    vehicle_id: Optional[int] = None,
+    fmt: Literal['ndjson', 'csv'] = Query('ndjson', alias='format'),
+    gzip: bool = False,
+):
+    return export_response('incidentreport', 'IncidentReport', INCIDENT_REPORT_PAGES.columns, [
+        ('incident_time >= %s', from_time),
+        ('incident_time < %s', to_time),
+        ('gate_id = %s', gate_id),
+        ('vehicle_id = %s', vehicle_id),
+    ], fmt, gzip)
+
+@app.get('/incidentreport', response_model=List[IncidentReport], tags=["IncidentReport"], summary="Fetch Incident Reports (Keyset Paginated)", dependencies=GATE)
+@app.get('/incidentreport/{incident_id}', response_model=Optional[IncidentReport], tags=["IncidentReport"], summary="Fetch Incident Report by ID", dependencies=GATE)
+async def fetch_incident_reports(
+    response: Response,
+    incident_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    gate_id: Optional[int] = None,
+    vehicle_id: Optional[int] = None,
+    from_time: Optional[datetime] = Query(None, alias='from'),
+    to_time: Optional[datetime] = Query(None, alias='to'),
+    ids: Optional[str] = Query(None, description="Comma-separated ids to fetch in one query instead of a page, e.g. 1,2,3"),
+    expand: Optional[str] = Query(None, description="Related rows to embed, e.g. vehicle,vehicle.resident,gate"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. vehicle_id,license_plate; keys are always included"),
+):
+    relations = batch.parse_expand(INCIDENT_REPORTS, expand)
+    table = INCIDENT_REPORTS.project(fields, relations)
     if incident_id:
-        query = 'SELECT incident_id, description, incident_time, vehicle_id, security_staff_id, gate_id FROM IncidentReport WHERE incident_id = %s'
-        cursor.execute(query, (incident_id,))
-        row = cursor.fetchone()
+        row = await db.fetch_one(table.row_query, (incident_id,))
         if not row:
-            cursor.close()
-            cnx.close()
             raise HTTPException(status_code=404, detail="Incident Report not found")
-        incident_report = {
-            'incident_id': row[0],
-            'description': row[1],
-            'incident_time': row[2].strftime('%Y-%m-%d %H:%M:%S') if row[2] else None,
-            'vehicle_id': row[3],
-            'security_staff_id': row[4],
-            'gate_id': row[5]
-        }
-        cursor.close()
-        cnx.close()
-        return incident_report
+        return await batch.row_response(table, row, relations, response)
+    elif ids:
+        rows = await table.fetch_ids(batch.parse_ids(ids))
     else:
-        query = 'SELECT incident_id, description, incident_time, vehicle_id, security_staff_id, gate_id FROM IncidentReport LIMIT 10'
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        cursor.close()
-        cnx.close()
-        
-        incident_reports = []
-        for row in rows:
-            incident_reports.append({
-                'incident_id': row[0],
-                'description': row[1],
-                'incident_time': row[2].strftime('%Y-%m-%d %H:%M:%S') if row[2] else None,
-                'vehicle_id': row[3],
-                'security_staff_id': row[4],
-                'gate_id': row[5]
-            })
-        
-        return incident_reports
+        rows = await fetch_page(table.pages, response, cursor, limit, [
+            ('gate_id = %s', gate_id),
+            ('vehicle_id = %s', vehicle_id),
+            ('incident_time >= %s', from_time),
+            ('incident_time < %s', to_time),
+        ])
+    
+    return await batch.rows_response(table, rows, relations, response)
 
 # POST - สร้าง Incident Report ใหม่
-@app.post('/incidentreport', response_model=IncidentReport, tags=["IncidentReport"], summary="Create a New Incident Report")
-def create_incident_report(incident_report: IncidentReport):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.post('/incidentreport', response_model=IncidentReport, tags=["IncidentReport"], summary="Create a New Incident Report", dependencies=GATE)
+async def create_incident_report(incident_report: IncidentReport):
     query = '''
     INSERT INTO IncidentReport (description, incident_time, vehicle_id, security_staff_id, gate_id)
     VALUES (%s, %s, %s, %s, %s)
@@ -854,21 +1096,16 @@ def create_incident_report(incident_report: IncidentReport):
         incident_report.gate_id
     )
     
-    cursor.execute(query, values)
-    cnx.commit()
+    result = await db.execute(query, values)
     
-    incident_id = cursor.lastrowid
-    cursor.close()
-    cnx.close()
+    incident_id = result.lastrowid
     
+    events.broker.publish('incidentreport.created', {**incident_report.dict(), "incident_time": values[1], "incident_id": incident_id}, incident_report.gate_id)
     return {**incident_report.dict(), "incident_id": incident_id}
 
 # PUT - อัปเดตข้อมูล Incident Report
-@app.put('/incidentreport/{incident_id}', response_model=IncidentReport, tags=["IncidentReport"], summary="Update Incident Report Information")
-def update_incident_report(incident_id: int, incident_report: IncidentReport):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.put('/incidentreport/{incident_id}', response_model=IncidentReport, tags=["IncidentReport"], summary="Update Incident Report Information", dependencies=GATE)
+async def update_incident_report(incident_id: int, incident_report: IncidentReport):
     query = '''
     UPDATE IncidentReport
     SET description = %s, incident_time = %s, vehicle_id = %s, security_staff_id = %s, gate_id = %s
@@ -884,87 +1121,52 @@ def update_incident_report(incident_id: int, incident_report: IncidentReport):
         incident_id
     )
     
-    cursor.execute(query, values)
-    cnx.commit()
+    result = await db.execute(query, values)
     
-    if cursor.rowcount == 0:
-        cnx.close()
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="ไม่พบ Incident Report")
     
-    cursor.close()
-    cnx.close()
-    
     return {**incident_report.dict(), "incident_id": incident_id}
 
 # DELETE - ลบ Incident Report โดยใช้ incident_id
-@app.delete('/incidentreport/{incident_id}', tags=["IncidentReport"], summary="Delete Incident Report by ID")
-def delete_incident_report(incident_id: int):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.delete('/incidentreport/{incident_id}', tags=["IncidentReport"], summary="Delete Incident Report by ID", dependencies=ADMIN)
+async def delete_incident_report(incident_id: int):
     query = 'DELETE FROM IncidentReport WHERE incident_id = %s'
-    cursor.execute(query, (incident_id,))
-    
-    cnx.commit()
+    result = await db.execute(query, (incident_id,))
     
-    if cursor.rowcount == 0:
-        cnx.close()
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="ไม่พบ Incident Report")
     
-    cursor.close()
-    cnx.close()
-    
     return {"message": f"Incident Report ที่มี ID {incident_id} ถูกลบแล้ว"}
 
-@app.get('/securitystaff', response_model=List[SecurityStaff], tags=["SecurityStaff"], summary="Fetch All Security Staff Limit 10")
-@app.get('/securitystaff/{staff_id}', response_model=Optional[SecurityStaff], tags=["SecurityStaff"], summary="Fetch Security Staff by ID")
-def fetch_security_staffs(staff_id: Optional[int] = None):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.get('/securitystaff', response_model=List[SecurityStaff], tags=["SecurityStaff"], summary="Fetch Security Staff (Keyset Paginated)", dependencies=GATE)
+@app.get('/securitystaff/{staff_id}', response_model=Optional[SecurityStaff], tags=["SecurityStaff"], summary="Fetch Security Staff by ID", dependencies=GATE)
+async def fetch_security_staffs(
+    response: Response,
+    staff_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    gate_id: Optional[int] = None,
+    ids: Optional[str] = Query(None, description="Comma-separated ids to fetch in one query instead of a page, e.g. 1,2,3"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. vehicle_id,license_plate; keys are always included"),
+):
+    table = SECURITY_STAFF.project(fields)
     if staff_id:
-        query = 'SELECT staff_id, name, shift_time, phone, gate_id FROM SecurityStaff WHERE staff_id = %s'
-        cursor.execute(query, (staff_id,))
-        row = cursor.fetchone()
+        row = await cache.security_staff.fetch_one(table.row_query, (staff_id,))
         if not row:
-            cursor.close()
-            cnx.close()
             raise HTTPException(status_code=404, detail="Security Staff not found")
-        security_staff = {
-            'staff_id': row[0],
-            'name': row[1],
-            'shift_time': row[2],
-            'phone': row[3],
-            'gate_id': row[4]
-        }
-        cursor.close()
-        cnx.close()
-        return security_staff
+        return serialization.row_response(table.columns, row, response)
+    elif ids:
+        rows = await table.fetch_ids(batch.parse_ids(ids))
+        return serialization.rows_response(table.columns, rows, response)
     else:
-        query = 'SELECT staff_id, name, shift_time, phone, gate_id FROM SecurityStaff LIMIT 10'
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        cursor.close()
-        cnx.close()
-        
-        security_staffs = []
-        for row in rows:
-            security_staffs.append({
-                'staff_id': row[0],
-                'name': row[1],
-                'shift_time': row[2],
-                'phone': row[3],
-                'gate_id': row[4]
-            })
-        
-        return security_staffs
+        rows = await fetch_page(table.pages, response, cursor, limit, [('gate_id = %s', gate_id)], cache.security_staff)
+    
+        return serialization.rows_response(table.columns, rows, response)
 
 # POST - สร้าง Security Staff ใหม่
-@app.post('/securitystaff', response_model=SecurityStaff, tags=["SecurityStaff"], summary="Create a New Security Staff")
-def create_security_staff(security_staff: SecurityStaff):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.post('/securitystaff', response_model=SecurityStaff, tags=["SecurityStaff"], summary="Create a New Security Staff", dependencies=ADMIN)
+async def create_security_staff(security_staff: SecurityStaff):
     query = '''
     INSERT INTO SecurityStaff (name, shift_time, phone, gate_id)
     VALUES (%s, %s, %s, %s)
@@ -977,21 +1179,16 @@ def create_security_staff(security_staff: SecurityStaff):
         security_staff.gate_id
     )
     
-    cursor.execute(query, values)
-    cnx.commit()
+    result = await db.execute(query, values)
+    cache.security_staff.invalidate()
     
-    staff_id = cursor.lastrowid
-    cursor.close()
-    cnx.close()
+    staff_id = result.lastrowid
     
     return {**security_staff.dict(), "staff_id": staff_id}
 
 # PUT - อัปเดตข้อมูล Security Staff
-@app.put('/securitystaff/{staff_id}', response_model=SecurityStaff, tags=["SecurityStaff"], summary="Update Security Staff Information")
-def update_security_staff(staff_id: int, security_staff: SecurityStaff):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.put('/securitystaff/{staff_id}', response_model=SecurityStaff, tags=["SecurityStaff"], summary="Update Security Staff Information", dependencies=ADMIN)
+async def update_security_staff(staff_id: int, security_staff: SecurityStaff):
     query = '''
     UPDATE SecurityStaff
     SET name = %s, shift_time = %s, phone = %s, gate_id = %s
@@ -1006,83 +1203,54 @@ def update_security_staff(staff_id: int, security_staff: SecurityStaff):
         staff_id
     )
     
-    cursor.execute(query, values)
-    cnx.commit()
+    result = await db.execute(query, values)
+    cache.security_staff.invalidate()
     
-    if cursor.rowcount == 0:
-        cnx.close()
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="ไม่พบ Security Staff")
     
-    cursor.close()
-    cnx.close()
-    
     return {**security_staff.dict(), "staff_id": staff_id}
 
 # DELETE - ลบ Security Staff โดยใช้ staff_id
-@app.delete('/securitystaff/{staff_id}', tags=["SecurityStaff"], summary="Delete Security Staff by ID")
-def delete_security_staff(staff_id: int):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.delete('/securitystaff/{staff_id}', tags=["SecurityStaff"], summary="Delete Security Staff by ID", dependencies=ADMIN)
+async def delete_security_staff(staff_id: int):
     query = 'DELETE FROM SecurityStaff WHERE staff_id = %s'
-    cursor.execute(query, (staff_id,))
+    result = await db.execute(query, (staff_id,))
+    cache.security_staff.invalidate()
     
-    cnx.commit()
-    
-    if cursor.rowcount == 0:
-        cnx.close()
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="ไม่พบ Security Staff")
     
-    cursor.close()
-    cnx.close()
-    
     return {"message": f"Security Staff ที่มี ID {staff_id} ถูกลบแล้ว"}
 
-@app.get('/gate', response_model=List[Gate], tags=["Gate"], summary="Fetch All Gates or Gate by ID")
-@app.get('/gate/{gate_id}', response_model=Optional[Gate], tags=["Gate"], summary="Fetch Gate by ID")
-def fetch_gates(gate_id: Optional[int] = None):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.get('/gate', response_model=List[Gate], tags=["Gate"], summary="Fetch Gates (Keyset Paginated)", dependencies=GATE)
+@app.get('/gate/{gate_id}', response_model=Optional[Gate], tags=["Gate"], summary="Fetch Gate by ID", dependencies=GATE)
+async def fetch_gates(
+    response: Response,
+    gate_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    gate_type: Optional[str] = None,
+    ids: Optional[str] = Query(None, description="Comma-separated ids to fetch in one query instead of a page, e.g. 1,2,3"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. vehicle_id,license_plate; keys are always included"),
+):
+    table = GATES.project(fields)
     if gate_id:
-        query = 'SELECT gate_id, location, gate_type FROM Gate WHERE gate_id = %s'
-        cursor.execute(query, (gate_id,))
-        row = cursor.fetchone()
+        row = await cache.gates.fetch_one(table.row_query, (gate_id,))
         if not row:
-            cursor.close()
-            cnx.close()
             raise HTTPException(status_code=404, detail="Gate not found")
-        gate = {
-            'gate_id': row[0],
-            'location': row[1],
-            'gate_type': row[2]
-        }
-        cursor.close()
-        cnx.close()
-        return gate
+        return serialization.row_response(table.columns, row, response)
+    elif ids:
+        rows = await table.fetch_ids(batch.parse_ids(ids))
+        return serialization.rows_response(table.columns, rows, response)
     else:
-        query = 'SELECT gate_id, location, gate_type FROM Gate LIMIT 10'
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        cursor.close()
-        cnx.close()
-        
-        gates = []
-        for row in rows:
-            gates.append({
-                'gate_id': row[0],
-                'location': row[1],
-                'gate_type': row[2]
-            })
-        
-        return gates
+        rows = await fetch_page(table.pages, response, cursor, limit, [('gate_type = %s', gate_type)], cache.gates)
+    
+        return serialization.rows_response(table.columns, rows, response)
 
 # POST - สร้าง Gate ใหม่
-@app.post('/gate', response_model=Gate, tags=["Gate"], summary="Create a New Gate")
-def create_gate(gate: Gate):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.post('/gate', response_model=Gate, tags=["Gate"], summary="Create a New Gate", dependencies=ADMIN)
+async def create_gate(gate: Gate):
     query = '''
     INSERT INTO Gate (location, gate_type)
     VALUES (%s, %s)
@@ -1093,21 +1261,16 @@ def create_gate(gate: Gate):
         gate.gate_type
     )
     
-    cursor.execute(query, values)
-    cnx.commit()
+    result = await db.execute(query, values)
+    cache.gates.invalidate()
     
-    gate_id = cursor.lastrowid
-    cursor.close()
-    cnx.close()
+    gate_id = result.lastrowid
     
     return {**gate.dict(), "gate_id": gate_id}
 
 # PUT - อัปเดตข้อมูล Gate
-@app.put('/gate/{gate_id}', response_model=Gate, tags=["Gate"], summary="Update Gate Information")
-def update_gate(gate_id: int, gate: Gate):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.put('/gate/{gate_id}', response_model=Gate, tags=["Gate"], summary="Update Gate Information", dependencies=ADMIN)
+async def update_gate(gate_id: int, gate: Gate):
     query = '''
     UPDATE Gate
     SET location = %s, gate_type = %s
@@ -1120,89 +1283,211 @@ def update_gate(gate_id: int, gate: Gate):
         gate_id
     )
     
-    cursor.execute(query, values)
-    cnx.commit()
+    result = await db.execute(query, values)
+    cache.gates.invalidate()
     
-    if cursor.rowcount == 0:
-        cnx.close()
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="ไม่พบ Gate")
     
-    cursor.close()
-    cnx.close()
-    
     return {**gate.dict(), "gate_id": gate_id}
 
 # DELETE - ลบ Gate โดยใช้ gate_id
-@app.delete('/gate/{gate_id}', tags=["Gate"], summary="Delete Gate by ID")
-def delete_gate(gate_id: int):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.delete('/gate/{gate_id}', tags=["Gate"], summary="Delete Gate by ID", dependencies=ADMIN)
+async def delete_gate(gate_id: int):
     query = 'DELETE FROM Gate WHERE gate_id = %s'
-    cursor.execute(query, (gate_id,))
-    
-    cnx.commit()
+    result = await db.execute(query, (gate_id,))
+    cache.gates.invalidate()
+    # foreign key จาก SecurityStaff อาจ cascade ตาม
+    cache.security_staff.invalidate()
     
-    if cursor.rowcount == 0:
-        cnx.close()
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="ไม่พบ Gate")
     
-    cursor.close()
-    cnx.close()
-    
     return {"message": f"Gate ที่มี ID {gate_id} ถูกลบแล้ว"}
 
-# GET - Fetch all Entry Exit Logs or fetch by specific ID
-@app.get('/entryexitlog', response_model=List[EntryExitLog], tags=["EntryExitLog"], summary="Fetch All  Exit Logs Limit 10")
-@app.get('/entryexitlog/{log_id}', response_model=Optional[EntryExitLog], tags=["EntryExitLog"], summary="Fetch Exit Log by ID")
-def fetch_entry_exit_logs(log_id: Optional[int] = None):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
+# GET - ตรวจสิทธิ์ทะเบียนรถที่ไม้กั้นจาก index ใน memory (ไม่ query DB)
+@app.get('/gate/{gate_id}/authorize', response_model=AccessDecision, tags=["Gate"], summary="Authorize a Plate at a Gate", dependencies=GATE)
+async def authorize_plate(gate_id: int, plate: str, province: Optional[str] = None):
+    index = access_index.index
+    if not index.loaded:
+        raise HTTPException(status_code=503, detail="Access index is not loaded yet", headers={"Retry-After": "5"})
+    return {"gate_id": gate_id, **index.authorize(plate, province, gate_id)}
+
+CHECKIN_BUDGET_MS = float(os.getenv('CHECKIN_BUDGET_MS', '150'))
+
+async def find_checkin_vehicle(tx, plate, province):
+    """``(vehicle_id, reason)`` for a plate, read inside the check-in transaction."""
+    plate = plate.strip()
+    if province:
+        rows = await tx.fetch_all(CHECKIN_VEHICLE, (plate, province.strip()))
+    else:
+        rows = await tx.fetch_all(CHECKIN_VEHICLE_ANY_PROVINCE, (plate,))
+    if len(rows) > 1:
+        # ทะเบียนซ้ำกันคนละจังหวัด ต้องระบุ province
+        return None, 'ambiguous_plate'
+    if rows:
+        return rows[0][0], None
+    # กล้องอ่านได้ "กข1234" แต่ในตารางเก็บ "กข 1234" ให้ index ที่ตัดช่องว่าง/ขีดแล้วช่วยหา แล้วยืนยันกับ DB อีกที
+    index = access_index.index
+    if not index.loaded:
+        return None, 'unknown_vehicle'
+    vehicle_id, reason = index.find_vehicle(plate, province)
+    if vehicle_id is not None and not await tx.fetch_one(CHECKIN_VEHICLE_EXISTS, (vehicle_id,)):
+        return None, 'unknown_vehicle'
+    return vehicle_id, reason
+
+@app.post('/gate/{gate_id}/checkin', response_model=CheckInResult, tags=["Gate"], summary="Check a Plate In or Out at a Gate (One Transaction)", dependencies=GATE)
+async def checkin(gate_id: int, checkin: CheckIn, response: Response):
+    """Decide and record one barrier event in a single request.
+
+    The plate lookup, the permission check, the EntryExitLog write (a new log
+    at an entry gate, closing the vehicle's open log at an exit gate) and,
+    when denied, the IncidentReport all run in one transaction on one
+    connection. A vehicle with an open log may always leave.
+    """
+    start = time.perf_counter()
+    gate = await cache.gates.fetch_one(GATE_ROW, (gate_id,))
+    if not gate:
+        raise HTTPException(status_code=404, detail="Gate not found")
+    direction = 'exit' if gate[2] == 'ออก' else 'entry'
+    timestamp = checkin.timestamp or datetime.now()
+    day = timestamp.date()
+    permission_id = log_id = incident_id = None
+    open_log = None
+
+    async with db.transaction() as tx:
+        vehicle_id, reason = await find_checkin_vehicle(tx, checkin.plate, checkin.province)
+        if vehicle_id is not None and direction == 'exit':
+            open_log = await tx.fetch_one(CHECKIN_OPEN_LOG + ' FOR UPDATE', (vehicle_id,))
+        if open_log is None and vehicle_id is not None:
+            row = await tx.fetch_one(CHECKIN_PERMISSION, (vehicle_id, gate_id, day, day))
+            permission_id = row[0] if row else None
+            reason = None if row else 'no_permission'
+        # รถที่อยู่ข้างในออกได้เสมอ สิทธิ์อาจหมดอายุระหว่างที่จอดอยู่ ไม่ให้ติดอยู่ในโครงการ
+        allowed = open_log is not None or permission_id is not None
+        if not allowed:
+            description = f"Check-in denied: {reason} (plate {checkin.plate})"
+            result = await tx.execute(
+                'INSERT INTO IncidentReport (description, incident_time, vehicle_id, security_staff_id, gate_id) VALUES (%s, %s, %s, %s, %s)',
+                (description, timestamp, vehicle_id, checkin.security_staff_id, gate_id),
+            )
+            incident_id = result.lastrowid
+        elif direction == 'entry':
+            result = await tx.execute(
+                'INSERT INTO EntryExitLog (vehicle_id, entry_time, exit_time, gate_id) VALUES (%s, %s, %s, %s)',
+                (vehicle_id, timestamp, None, gate_id),
+            )
+            log_id = result.lastrowid
+            await rollups.record(tx, rollups.log_deltas(gate_id, timestamp, None))
+        elif open_log is not None:
+            log_id = open_log[0]
+            # เก็บไม้กั้นที่รถออกไว้ใน log ด้วย rollup ตอนแก้/ลบ/backfill จะได้นับขาออกที่ประตูเดียวกัน
+            await tx.execute('UPDATE EntryExitLog SET exit_time = %s, exit_gate_id = %s WHERE log_id = %s', (timestamp, gate_id, log_id))
+            await rollups.record(tx, rollups.log_deltas(open_log[1], None, timestamp, gate_id))
+        # ออกโดยไม่มี log ขาเข้า (เช่นเข้ามาตอนระบบล่ม) แต่มีสิทธิ์ ปล่อยผ่านแต่ไม่มี log ให้ปิด
+
+    # หลัง commit เท่านั้น เหมือน endpoint อื่นที่เขียน EntryExitLog
+    if incident_id is not None:
+        events.broker.publish('incidentreport.created', {
+            'incident_id': incident_id, 'description': description, 'incident_time': timestamp,
+            'vehicle_id': vehicle_id, 'security_staff_id': checkin.security_staff_id, 'gate_id': gate_id,
+        }, gate_id)
+    elif log_id is not None and direction == 'entry':
+        occupancy.apply('upsert_log', log_id, vehicle_id, gate_id, timestamp, None)
+        events.broker.publish('entryexitlog.created', {
+            'log_id': log_id, 'vehicle_id': vehicle_id, 'entry_time': timestamp, 'exit_time': None, 'gate_id': gate_id,
+        }, gate_id)
+    elif log_id is not None:
+        occupancy.apply('upsert_log', log_id, vehicle_id, open_log[1], open_log[2], timestamp)
+        # ส่งไปจอของไม้กั้นที่รถออก ตัว log ยังเป็นของประตูที่เข้ามา
+        events.broker.publish('entryexitlog.updated', {
+            'log_id': log_id, 'vehicle_id': vehicle_id, 'entry_time': open_log[2], 'exit_time': timestamp, 'gate_id': open_log[1],
+        }, gate_id)
+
+    elapsed = time.perf_counter() - start
+    metrics.GATE_CHECKINS.observe(elapsed, direction, 'allowed' if allowed else 'denied')
+    if elapsed * 1000 > CHECKIN_BUDGET_MS:
+        metrics.GATE_CHECKINS_OVER_BUDGET.inc(direction)
+        logger.warning("Check-in at gate %s took %.1f ms (budget %.0f ms)", gate_id, elapsed * 1000, CHECKIN_BUDGET_MS)
+    response.headers['Server-Timing'] = f'checkin;dur={elapsed * 1000:.1f}'
+    return serialization.json_response({
+        'gate_id': gate_id,
+        'allowed': allowed,
+        'vehicle_id': vehicle_id,
+        'permission_id': permission_id,
+        'reason': reason,
+        'direction': direction,
+        'timestamp': timestamp,
+        'log_id': log_id,
+        'incident_id': incident_id,
+    }, response)
+
+# GET - Export Entry Exit Logs ทั้งช่วงเวลาแบบ stream (ต้องประกาศก่อน /entryexitlog/{log_id})
+@app.get('/entryexitlog/export', tags=["EntryExitLog"], summary="Export Entry Exit Logs as NDJSON or CSV", dependencies=ADMIN)
+async def export_entry_exit_logs(
+    from_time: Optional[datetime] = Query(None, alias='from'),
+    to_time: Optional[datetime] = Query(None, alias='to'),
+    gate_id: Optional[int] = None,
+    vehicle_id: Optional[int] = None,
+    fmt: Literal['ndjson', 'csv'] = Query('ndjson', alias='format'),
+    gzip: bool = False,
+):
+    return export_response('entryexitlog', 'EntryExitLog', ENTRY_EXIT_LOG_PAGES.columns, [
+        ('entry_time >= %s', from_time),
+        ('entry_time < %s', to_time),
+        ('gate_id = %s', gate_id),
+        ('vehicle_id = %s', vehicle_id),
+    ], fmt, gzip)
 
+# GET - Fetch all Entry Exit Logs or fetch by specific ID
+@app.get('/entryexitlog', response_model=List[EntryExitLog], tags=["EntryExitLog"], summary="Fetch Entry Exit Logs (Keyset Paginated, Newest First)", dependencies=GATE)
+@app.get('/entryexitlog/{log_id}', response_model=Optional[EntryExitLog], tags=["EntryExitLog"], summary="Fetch Exit Log by ID", dependencies=GATE)
+async def fetch_entry_exit_logs(
+    response: Response,
+    log_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    gate_id: Optional[int] = None,
+    vehicle_id: Optional[int] = None,
+    from_time: Optional[datetime] = Query(None, alias='from'),
+    to_time: Optional[datetime] = Query(None, alias='to'),
+    ids: Optional[str] = Query(None, description="Comma-separated ids to fetch in one query instead of a page, e.g. 1,2,3"),
+    expand: Optional[str] = Query(None, description="Related rows to embed, e.g. vehicle,vehicle.resident,gate"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. vehicle_id,license_plate; keys are always included"),
+):
+    relations = batch.parse_expand(ENTRY_EXIT_LOGS, expand)
+    table = ENTRY_EXIT_LOGS.project(fields, relations)
     if log_id:
         # Fetch log by specific log_id
-        query = 'SELECT log_id, vehicle_id, entry_time, exit_time, gate_id FROM EntryExitLog WHERE log_id = %s'
-        cursor.execute(query, (log_id,))
-        row = cursor.fetchone()
+        row = await db.fetch_one(table.row_query, (log_id,))
         if not row:
-            cursor.close()
-            cnx.close()
             raise HTTPException(status_code=404, detail="Entry Exit Log not found")
-        entry_exit_log = {
-            'log_id': row[0],
-            'vehicle_id': row[1],
-            'entry_time': row[2].strftime('%Y-%m-%d %H:%M:%S') if row[2] else None,
-            'exit_time': row[3].strftime('%Y-%m-%d %H:%M:%S') if row[3] else None,
-            'gate_id': row[4]
-        }
-        cursor.close()
-        cnx.close()
-        return entry_exit_log
+        return await batch.row_response(table, row, relations, response)
+    elif ids:
+        rows = await table.fetch_ids(batch.parse_ids(ids))
     else:
-        # Fetch all logs with a limit of 10
-        query = 'SELECT log_id, vehicle_id, entry_time, exit_time, gate_id FROM EntryExitLog LIMIT 10'
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        cursor.close()
-        cnx.close()
-        
-        entry_exit_logs = []
-        for row in rows:
-            entry_exit_logs.append({
-                'log_id': row[0],
-                'vehicle_id': row[1],
-                'entry_time': row[2].strftime('%Y-%m-%d %H:%M:%S') if row[2] else None,
-                'exit_time': row[3].strftime('%Y-%m-%d %H:%M:%S') if row[3] else None,
-                'gate_id': row[4]
-            })
-        
-        return entry_exit_logs
+        # Fetch one page of logs, newest entry first
+        rows = await fetch_page(table.pages, response, cursor, limit, [
+            ('gate_id = %s', gate_id),
+            ('vehicle_id = %s', vehicle_id),
+            ('entry_time >= %s', from_time),
+            ('entry_time < %s', to_time),
+        ])
+    
+    return await batch.rows_response(table, rows, relations, response)
     
 # POST - สร้าง EntryExitLog ใหม่
-@app.post('/entryexitlog', response_model=EntryExitLog, tags=["EntryExitLog"], summary="Create a New Entry Exit Log")
-def create_entry_exit_log(entry_exit_log: EntryExitLog):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
+@app.post('/entryexitlog', response_model=EntryExitLog, tags=["EntryExitLog"], summary="Create a New Entry Exit Log", dependencies=GATE)
+async def create_entry_exit_log(entry_exit_log: EntryExitLog, response: Response):
+    # ใช้เวลาปัจจุบันถ้าไม่ระบุ entry_time
+    if not entry_exit_log.entry_time:
+        entry_exit_log.entry_time = datetime.now()
+    if entry_exit_log_buffer is not None:
+        # write-behind: ตอบ 202 พร้อม provisional id ทันที แล้วให้ background task commit เป็นกลุ่ม
+        provisional_id = await entry_exit_log_buffer.submit(entry_exit_log)
+        response.status_code = 202
+        response.headers['X-Provisional-Id'] = provisional_id
+        return entry_exit_log.dict()
 
     query = '''
     INSERT INTO EntryExitLog (vehicle_id, entry_time, exit_time, gate_id)
@@ -1211,26 +1496,148 @@ def create_entry_exit_log(entry_exit_log: EntryExitLog):
     
     values = (
         entry_exit_log.vehicle_id,
-        entry_exit_log.entry_time if entry_exit_log.entry_time else datetime.now(),  # ใช้เวลาปัจจุบันถ้าไม่ระบุ entry_time
+        entry_exit_log.entry_time,
         entry_exit_log.exit_time,
         entry_exit_log.gate_id
     )
     
-    cursor.execute(query, values)
-    cnx.commit()
+    async with db.transaction() as tx:
+        result = await tx.execute(query, values)
+        await rollups.record(tx, rollups.log_deltas(entry_exit_log.gate_id, entry_exit_log.entry_time, entry_exit_log.exit_time))
     
-    log_id = cursor.lastrowid
-    cursor.close()
-    cnx.close()
+    log_id = result.lastrowid
     
+    occupancy.apply('upsert_log', log_id, entry_exit_log.vehicle_id, entry_exit_log.gate_id, entry_exit_log.entry_time, entry_exit_log.exit_time)
+    events.broker.publish('entryexitlog.created', {**entry_exit_log.dict(), "log_id": log_id}, entry_exit_log.gate_id)
     return {**entry_exit_log.dict(), "log_id": log_id}
 
-# PUT - อัปเดตข้อมูล EntryExitLog
-@app.put('/entryexitlog/{log_id}', response_model=EntryExitLog, tags=["EntryExitLog"], summary="Update Entry Exit Log Information")
-def update_entry_exit_log(log_id: int, entry_exit_log: EntryExitLog):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', '10000'))
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', '500'))
+
+
+async def insert_entry_exit_logs(tx, logs: List[EntryExitLog]):
+    """Insert ``logs`` in multi-row chunks inside ``tx``.
+
+    Returns ``(log_ids, errors)`` aligned with ``logs``: ``log_ids[i]`` is
+    ``None`` for rows that failed, ``errors`` maps index to message. A chunk
+    that fails is rolled back to its savepoint and retried row by row, so one
+    bad row (e.g. an unknown gate_id) does not sink the rest of the batch.
+    """
+    log_ids: List[Optional[int]] = [None] * len(logs)
+    errors: Dict[int, str] = {}
+    # id ของ multi-row INSERT เดียวกันเรียงต่อกันตาม auto_increment_increment
+    step = (await tx.fetch_one('SELECT @@auto_increment_increment'))[0]
+    now = datetime.now()
+    for log in logs:
+        if not log.entry_time:
+            log.entry_time = now
+
+    def row_values(log):
+        return (log.vehicle_id, log.entry_time, log.exit_time, log.gate_id)
+
+    for start in range(0, len(logs), BULK_CHUNK_SIZE):
+        chunk = logs[start:start + BULK_CHUNK_SIZE]
+        query = 'INSERT INTO EntryExitLog (vehicle_id, entry_time, exit_time, gate_id) VALUES ' + ', '.join(['(%s, %s, %s, %s)'] * len(chunk))
+        params = tuple(value for log in chunk for value in row_values(log))
+        await tx.execute('SAVEPOINT bulk_chunk')
+        try:
+            result = await tx.execute(query, params)
+        except db.DatabaseError:
+            await tx.execute('ROLLBACK TO SAVEPOINT bulk_chunk')
+        else:
+            await tx.execute('RELEASE SAVEPOINT bulk_chunk')
+            for offset in range(len(chunk)):
+                log_ids[start + offset] = result.lastrowid + offset * step
+            continue
+
+        for offset, log in enumerate(chunk):
+            await tx.execute('SAVEPOINT bulk_row')
+            try:
+                result = await tx.execute('INSERT INTO EntryExitLog (vehicle_id, entry_time, exit_time, gate_id) VALUES (%s, %s, %s, %s)', row_values(log))
+            except db.DatabaseError as e:
+                await tx.execute('ROLLBACK TO SAVEPOINT bulk_row')
+                errors[start + offset] = str(e)
+            else:
+                await tx.execute('RELEASE SAVEPOINT bulk_row')
+                log_ids[start + offset] = result.lastrowid
+
+    deltas = Counter()
+    for log, log_id in zip(logs, log_ids):
+        if log_id is not None:
+            deltas.update(rollups.log_deltas(log.gate_id, log.entry_time, log.exit_time))
+    await rollups.record(tx, deltas)
+    return log_ids, errors
+
+# write-behind buffer ของ create_entry_exit_log (เปิดด้วย ENTRYEXITLOG_WRITE_BEHIND=1)
+entry_exit_log_buffer: Optional[write_behind.WriteBehindBuffer] = None
+
+
+def track_entry_exit_logs(logs: List[EntryExitLog], log_ids: List[Optional[int]]):
+    # เรียกหลัง commit แล้วเท่านั้น แถวที่ rollback ไปต้องไม่โผล่ใน occupancy หรือบนจอป้อมยาม
+    for log, log_id in zip(logs, log_ids):
+        if log_id is not None:
+            occupancy.apply('upsert_log', log_id, log.vehicle_id, log.gate_id, log.entry_time, log.exit_time)
+            events.broker.publish('entryexitlog.created', {**log.dict(), "log_id": log_id}, log.gate_id)
+
+
+async def flush_entry_exit_logs(logs: List[EntryExitLog]):
+    # write-behind retry ฟังก์ชันนี้ทั้งก้อน track_entry_exit_logs จึงส่งเป็น after_commit แยกต่างหาก
+    async with db.transaction() as tx:
+        return await insert_entry_exit_logs(tx, logs)
+
+@app.get('/entryexitlog/pending/{provisional_id}', tags=["EntryExitLog"], summary="Resolve a Write-Behind Provisional ID", dependencies=GATE)
+async def resolve_entry_exit_log(provisional_id: str):
+    if entry_exit_log_buffer is None:
+        raise HTTPException(status_code=404, detail="Write-behind mode is disabled")
+    result = entry_exit_log_buffer.resolve(provisional_id)
+    if result is None:
+        return {"provisional_id": provisional_id, "status": "pending", "log_id": None, "detail": None}
+    log_id, error = result
+    return {"provisional_id": provisional_id, "status": "failed" if error else "committed", "log_id": log_id, "detail": error}
+
+# POST - บันทึก EntryExitLog หลายรายการใน transaction เดียว (ใช้ตอน gate controller ส่ง event ที่ค้างไว้)
+@app.post('/entryexitlog/bulk', response_model=BulkInsertResult, tags=["EntryExitLog"], summary="Bulk Create Entry Exit Logs", dependencies=GATE)
+async def create_entry_exit_logs_bulk(entries: List[Dict[str, Any]] = Body(...)):
+    if len(entries) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ITEMS} items per request")
+
+    # validate ทีละรายการ เพื่อรายงาน error เป็นราย item แทนการ reject ทั้ง request
+    errors: Dict[int, str] = {}
+    valid_indexes = []
+    valid_logs = []
+    for index, entry in enumerate(entries):
+        try:
+            log = EntryExitLog.parse_obj(entry)
+            # ไม่ระบุ entry_time ใช้เวลาปัจจุบัน เหมือน POST /entryexitlog
+            if not log.entry_time:
+                log.entry_time = datetime.now()
+            valid_logs.append(log)
+            valid_indexes.append(index)
+        except ValidationError as e:
+            errors[index] = '; '.join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+
+    log_ids: List[Optional[int]] = [None] * len(entries)
+    if valid_logs:
+        async with db.transaction() as tx:
+            inserted_ids, insert_errors = await insert_entry_exit_logs(tx, valid_logs)
+        track_entry_exit_logs(valid_logs, inserted_ids)
+        for position, index in enumerate(valid_indexes):
+            log_ids[index] = inserted_ids[position]
+            if position in insert_errors:
+                errors[index] = insert_errors[position]
+
+    return {
+        "inserted": sum(1 for log_id in log_ids if log_id is not None),
+        "log_ids": log_ids,
+        "errors": [{"index": index, "detail": detail} for index, detail in sorted(errors.items())],
+    }
 
+# PUT - อัปเดตข้อมูล EntryExitLog
+@app.put('/entryexitlog/{log_id}', response_model=EntryExitLog, tags=["EntryExitLog"], summary="Update Entry Exit Log Information", dependencies=GATE)
+async def update_entry_exit_log(log_id: int, entry_exit_log: EntryExitLog):
+    # แถวที่ entry_time เป็น NULL จะหายจาก GET /entryexitlog ที่เรียงตาม entry_time
+    if entry_exit_log.entry_time is None:
+        raise HTTPException(status_code=400, detail="entry_time is required")
     query = '''
     UPDATE EntryExitLog
     SET vehicle_id = %s, entry_time = %s, exit_time = %s, gate_id = %s
@@ -1245,35 +1652,107 @@ def update_entry_exit_log(log_id: int, entry_exit_log: EntryExitLog):
         log_id
     )
     
-    cursor.execute(query, values)
-    cnx.commit()
-    
-    if cursor.rowcount == 0:
-        cnx.close()
-        raise HTTPException(status_code=404, detail="ไม่พบ Entry Exit Log")
-    
-    cursor.close()
-    cnx.close()
-    
+    async with db.transaction() as tx:
+        # ค่าเดิมต้องถูกหักออกจาก rollup ก่อนบวกค่าใหม่
+        old = await tx.fetch_one(ENTRY_EXIT_LOG_TRAFFIC + ' FOR UPDATE', (log_id,))
+        if not old:
+            raise HTTPException(status_code=404, detail="ไม่พบ Entry Exit Log")
+        await tx.execute(query, values)
+        deltas = rollups.log_deltas(*old, sign=-1)
+        # PUT ไม่แก้ exit_gate_id ขาออกยังนับที่ประตูเดิมที่บันทึกไว้
+        deltas.update(rollups.log_deltas(entry_exit_log.gate_id, entry_exit_log.entry_time, entry_exit_log.exit_time, old[3]))
+        await rollups.record(tx, deltas)
+    
+    occupancy.apply('upsert_log', log_id, entry_exit_log.vehicle_id, entry_exit_log.gate_id, entry_exit_log.entry_time, entry_exit_log.exit_time)
+    events.broker.publish('entryexitlog.updated', {**entry_exit_log.dict(), "log_id": log_id}, entry_exit_log.gate_id)
     return {**entry_exit_log.dict(), "log_id": log_id}
 
 # DELETE - ลบ EntryExitLog โดยใช้ log_id
-@app.delete('/entryexitlog/{log_id}', tags=["EntryExitLog"], summary="Delete Entry Exit Log by ID")
-def delete_entry_exit_log(log_id: int):
-    cnx = get_db_connection()
-    cursor = cnx.cursor()
-
+@app.delete('/entryexitlog/{log_id}', tags=["EntryExitLog"], summary="Delete Entry Exit Log by ID", dependencies=ADMIN)
+async def delete_entry_exit_log(log_id: int):
     query = 'DELETE FROM EntryExitLog WHERE log_id = %s'
-    cursor.execute(query, (log_id,))
-    
-    cnx.commit()
-    
-    if cursor.rowcount == 0:
-        cnx.close()
-        raise HTTPException(status_code=404, detail="ไม่พบ Entry Exit Log")
-    
-    cursor.close()
-    cnx.close()
-    
+    async with db.transaction() as tx:
+        old = await tx.fetch_one(ENTRY_EXIT_LOG_TRAFFIC + ' FOR UPDATE', (log_id,))
+        if not old:
+            raise HTTPException(status_code=404, detail="ไม่พบ Entry Exit Log")
+        await tx.execute(query, (log_id,))
+        await rollups.record(tx, rollups.log_deltas(*old, sign=-1))
+    
+    occupancy.apply('remove_log', log_id)
+    events.broker.publish('entryexitlog.deleted', {"log_id": log_id}, old[0])
     return {"message": f"Entry Exit Log ที่มี ID {log_id} ถูกลบแล้ว"}
 
+# GET - event สดของ EntryExitLog / IncidentReport สำหรับจอป้อมยาม แทนการ poll /entryexitlog ทุกวินาที
+@app.get('/events', tags=["Events"], summary="Live Entry/Exit and Incident Events (Server-Sent Events)", dependencies=GATE_QUERY_TOKEN)
+async def stream_events(
+    gate_id: Optional[List[int]] = Query(None),
+    last_event_id: Optional[int] = Header(None),
+):
+    subscriber = events.broker.subscribe(gate_id, last_event_id)
+    return StreamingResponse(
+        events.sse_stream(subscriber),
+        media_type='text/event-stream',
+        # X-Accel-Buffering: ให้ nginx ส่งต่อทันทีไม่ buffer
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.websocket('/ws/events')
+async def websocket_events(websocket: WebSocket, gate_id: Optional[List[int]] = Query(None), last_event_id: Optional[int] = None):
+    if auth.AUTH_ENABLED:
+        try:
+            auth.authorize(auth.websocket_token(websocket), auth.GATE_ROLES)
+        except HTTPException as e:
+            # 1008 = policy violation: ไม่มี token หรือ role ไม่มีสิทธิ์
+            await websocket.close(code=1008, reason=e.detail)
+            return
+    await websocket.accept()
+    subscriber = events.broker.subscribe(gate_id, last_event_id)
+    try:
+        while True:
+            try:
+                event = await subscriber.get(events.EVENTS_HEARTBEAT_SECONDS)
+            except EOFError:
+                break
+            # ไม่มี event นานเกินไปก็ส่ง heartbeat กัน proxy ตัด และให้รู้ว่า client หลุดไปแล้วตอนส่งไม่ออก
+            await websocket.send_text(event.message().decode() if event is not None else events.WEBSOCKET_HEARTBEAT)
+    except WebSocketDisconnect:
+        # ส่งไม่ได้ (Starlette แปลง OSError ตอนส่งเป็น WebSocketDisconnect) finally ด้านล่างเลิก subscribe ให้
+        return
+    finally:
+        events.broker.unsubscribe(subscriber)
+    # 1013 = try again later: ถูกตัดเพราะรับไม่ทัน ให้ต่อใหม่พร้อม last_event_id
+    await websocket.close(code=1013 if subscriber.dropped else 1001)
+
+# GET - รถที่อยู่ในโครงการตอนนี้ (EntryExitLog ที่ยังไม่มี exit_time) ตอบจาก memory ไม่ต้อง scan log
+@app.get('/occupancy', tags=["EntryExitLog"], summary="Vehicles Currently Inside (Total, Per Gate, Per Resident)", dependencies=GATE)
+async def fetch_occupancy(gate_id: Optional[int] = None, resident_id: Optional[int] = None, include_vehicles: bool = True):
+    tracker = occupancy.tracker
+    if not tracker.loaded:
+        raise HTTPException(status_code=503, detail="Occupancy is not loaded yet", headers={"Retry-After": "5"})
+    if not include_vehicles and gate_id is None and resident_id is None:
+        # แค่ตัวเลขรวมกับรายประตู O(จำนวนประตู) ไม่ต้องไล่รถทุกคัน
+        return tracker.summary()
+    return serialization.FastJSONResponse(tracker.snapshot(gate_id, resident_id, include_vehicles))
+
+# ช่วงเวลาสูงสุดต่อ request ของ /stats/traffic และช่วง default ถ้าไม่ระบุ from
+TRAFFIC_MAX_RANGE = {'hour': timedelta(days=31), 'day': timedelta(days=366)}
+TRAFFIC_DEFAULT_RANGE = {'hour': timedelta(days=1), 'day': timedelta(days=30)}
+
+# GET - จำนวนรถเข้า/ออกต่อประตูต่อชั่วโมงหรือต่อวัน อ่านจาก TrafficRollup ไม่ GROUP BY บน EntryExitLog
+@app.get('/stats/traffic', response_model=List[TrafficPoint], tags=["EntryExitLog"], summary="Entries and Exits per Gate per Hour or Day", dependencies=GATE)
+async def fetch_traffic_stats(
+    gate_id: Optional[int] = None,
+    from_time: Optional[datetime] = Query(None, alias='from'),
+    to_time: Optional[datetime] = Query(None, alias='to'),
+    bucket: Literal['hour', 'day'] = 'hour',
+):
+    if not rollups.TRAFFIC_ROLLUPS_ENABLED:
+        raise HTTPException(status_code=404, detail="Traffic rollups are disabled")
+    to_time = to_time or datetime.now()
+    from_time = from_time or to_time - TRAFFIC_DEFAULT_RANGE[bucket]
+    if from_time >= to_time:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+    if to_time - from_time > TRAFFIC_MAX_RANGE[bucket]:
+        raise HTTPException(status_code=400, detail=f"At most {TRAFFIC_MAX_RANGE[bucket].days} days per request with bucket={bucket}")
+    return serialization.FastJSONResponse(await rollups.fetch(bucket, from_time, to_time, gate_id))
+
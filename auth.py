@@ -0,0 +1,316 @@
+"""Password hashing, signed access tokens and role guards.
+
+Passwords are stored as ``pbkdf2_sha256$<iterations>$<salt>$<hash>``. Rows
+still holding a plain-text password can log in once and are re-hashed on
+that login, as are hashes made with a different iteration count.
+
+``POST /auth/login`` issues an HS256 JWT signed with ``AUTH_SECRET`` that
+carries the user id, role, expiry and a session id, so checking it needs no
+query. Tokens already verified are kept in an LRU, so a repeat request costs
+a dict lookup rather than an HMAC. Logout and changes to a user revoke
+sessions in memory, per process, like the event fan-out in ``events.py``.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from starlette.concurrency import run_in_threadpool
+
+import serialization
+
+
+logger = logging.getLogger(__name__)
+
+AUTH_ENABLED = os.getenv('AUTH_ENABLED', '1') == '1'
+AUTH_TOKEN_TTL_SECONDS = int(os.getenv('AUTH_TOKEN_TTL_SECONDS', str(8 * 3600)))
+# token ที่ตรวจลายเซ็นแล้วเก็บไว้กี่ใบ ควรมากกว่าจำนวนอุปกรณ์และผู้ใช้ที่ login พร้อมกัน
+AUTH_SESSION_CACHE_SIZE = int(os.getenv('AUTH_SESSION_CACHE_SIZE', '10000'))
+# ค่าแนะนำของ OWASP สำหรับ PBKDF2-HMAC-SHA256 ดูเวลาต่อครั้งบนเครื่องจริงด้วย benchmarks/auth_bench.py
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', '600000'))
+# hash ครั้งละหลายร้อย ms จำกัดจำนวนที่ทำพร้อมกัน ไม่ให้ login รัว ๆ กิน threadpool ที่ DB ใช้อยู่ด้วย
+PASSWORD_HASH_CONCURRENCY = int(os.getenv('PASSWORD_HASH_CONCURRENCY', '2'))
+
+ADMIN_ROLES = frozenset(role.strip() for role in os.getenv('AUTH_ADMIN_ROLES', 'admin').split(',') if role.strip())
+GATE_ROLES = frozenset(role.strip() for role in os.getenv('AUTH_GATE_ROLES', 'security').split(',') if role.strip())
+
+AUTH_SECRET = os.getenv('AUTH_SECRET', '').encode()
+if AUTH_ENABLED and not AUTH_SECRET:
+    # ไม่ตั้ง secret ก็ยังใช้ได้ แต่ token ใช้ได้แค่ใน process นี้และหายเมื่อ restart
+    AUTH_SECRET = secrets.token_bytes(32)
+    logger.warning("AUTH_SECRET is not set; using a random key, so tokens are lost on restart and not shared between workers")
+
+ALGORITHM = 'pbkdf2_sha256'
+
+_TOKEN_HEADER = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b'=')
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+# ---------------------- passwords ----------------------
+
+def hash_password(password, iterations=None):
+    iterations = iterations or PASSWORD_HASH_ITERATIONS
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f'{ALGORITHM}${iterations}${_b64encode(salt)}${_b64encode(digest)}'
+
+
+def is_hashed(stored):
+    return bool(stored) and stored.startswith(ALGORITHM + '$')
+
+
+def check_password(password, stored):
+    """Whether ``password`` matches ``stored``, a hash from ``hash_password`` or a legacy plain-text value."""
+    if not stored:
+        # ไม่มี user ก็ hash ให้เสียเวลาเท่ากัน ไม่ให้เดาจากเวลาตอบได้ว่า username ไหนมีอยู่จริง
+        hash_password(password)
+        return False
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode(), stored.encode())
+    try:
+        _, iterations, salt, digest = stored.split('$')
+        expected = _b64decode(digest)
+        actual = hashlib.pbkdf2_hmac('sha256', password.encode(), _b64decode(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def needs_rehash(stored):
+    return not is_hashed(stored) or stored.split('$')[1] != str(PASSWORD_HASH_ITERATIONS)
+
+
+class PasswordHasher:
+    """Runs hashing in the threadpool, at most ``concurrency`` at a time."""
+
+    def __init__(self, concurrency=PASSWORD_HASH_CONCURRENCY):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._count = 0
+        self._seconds = 0.0
+
+    async def _run(self, function, *args):
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                return await run_in_threadpool(function, *args)
+            finally:
+                self._count += 1
+                self._seconds += time.perf_counter() - start
+
+    async def hash(self, password):
+        return await self._run(hash_password, password)
+
+    async def check(self, password, stored):
+        return await self._run(check_password, password, stored)
+
+    async def for_storage(self, password):
+        """Value to write to ``User.password``: always a fresh hash, ``None`` when no password was given."""
+        # ค่าที่หน้าตาเหมือน hash ก็ hash ซ้ำ ไม่อย่างนั้น client ตั้ง hash ที่ตัวเองรู้รหัสให้ user ไหนก็ได้
+        if password is None:
+            return None
+        return await self.hash(password)
+
+    def stats(self):
+        return {
+            'algorithm': ALGORITHM,
+            'iterations': PASSWORD_HASH_ITERATIONS,
+            'concurrency': PASSWORD_HASH_CONCURRENCY,
+            'hashes': self._count,
+            'seconds_avg': round(self._seconds / self._count, 6) if self._count else 0.0,
+        }
+
+
+# ---------------------- tokens ----------------------
+
+class InvalidToken(ValueError):
+    pass
+
+
+class Session(NamedTuple):
+    user_id: int
+    role: str
+    session_id: str
+    issued_at: float
+    expires_at: float
+
+
+def sign(session, secret=None):
+    payload = serialization.dumps({
+        'sub': str(session.user_id), 'role': session.role, 'sid': session.session_id,
+        'iat': session.issued_at, 'exp': session.expires_at,
+    })
+    signing_input = _TOKEN_HEADER + b'.' + base64.urlsafe_b64encode(payload).rstrip(b'=')
+    signature = hmac.new(secret or AUTH_SECRET, signing_input, hashlib.sha256).digest()
+    return signing_input.decode('ascii') + '.' + _b64encode(signature)
+
+
+def decode(token, secret=None):
+    """Session from a token made by ``sign``; raises ``InvalidToken`` if it is malformed or its signature is wrong."""
+    signing_input, _, signature = token.rpartition('.')
+    header, _, payload = signing_input.partition('.')
+    if header.encode() != _TOKEN_HEADER:
+        raise InvalidToken("Unsupported token")
+    expected = hmac.new(secret or AUTH_SECRET, signing_input.encode(), hashlib.sha256).digest()
+    try:
+        valid = hmac.compare_digest(_b64decode(signature), expected)
+    except ValueError:
+        valid = False
+    if not valid:
+        raise InvalidToken("Invalid token signature")
+    try:
+        claims = json.loads(_b64decode(payload))
+        return Session(int(claims['sub']), claims['role'], claims['sid'], claims['iat'], claims['exp'])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidToken("Malformed token") from e
+
+
+class SessionCache:
+    """Verified tokens (bounded LRU) and revoked sessions, in memory.
+
+    Revoked session ids are kept until their tokens would have expired
+    anyway, so that set is bounded by the logouts of one token lifetime.
+    """
+
+    def __init__(self, max_entries=AUTH_SESSION_CACHE_SIZE, ttl=AUTH_TOKEN_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._verified = OrderedDict()
+        self._revoked = OrderedDict()
+        self._revoked_users = {}
+        self._issued = 0
+        self._hits = 0
+        self._misses = 0
+        self._rejected = 0
+
+    def issue(self, user_id, role):
+        """``(token, session)`` for a user who has just logged in."""
+        now = round(time.time(), 3)
+        session = Session(user_id, role, secrets.token_urlsafe(12), now, now + self.ttl)
+        self._issued += 1
+        return sign(session), session
+
+    def verify(self, token):
+        session = self._verified.get(token)
+        if session is None:
+            self._misses += 1
+            try:
+                session = decode(token)
+            except InvalidToken:
+                self._rejected += 1
+                raise
+            self._verified[token] = session
+            while len(self._verified) > self.max_entries:
+                self._verified.popitem(last=False)
+        else:
+            self._hits += 1
+            self._verified.move_to_end(token)
+        if session.expires_at <= time.time():
+            self._verified.pop(token, None)
+            self._rejected += 1
+            raise InvalidToken("Token has expired")
+        if session.session_id in self._revoked or session.issued_at < self._revoked_users.get(session.user_id, 0):
+            self._rejected += 1
+            raise InvalidToken("Token has been revoked")
+        return session
+
+    def revoke(self, session):
+        self._purge()
+        self._revoked[session.session_id] = session.expires_at
+
+    def revoke_user(self, user_id):
+        """Revoke every token issued to ``user_id`` so far, e.g. after its role or password changed."""
+        self._purge()
+        self._revoked_users[user_id] = time.time()
+
+    def _purge(self):
+        now = time.time()
+        # TTL เท่ากันทุกใบ ลำดับที่ถูก revoke จึงเป็นลำดับที่หมดอายุด้วย
+        while self._revoked and next(iter(self._revoked.values())) <= now:
+            self._revoked.popitem(last=False)
+        for user_id, revoked_at in list(self._revoked_users.items()):
+            if revoked_at <= now - self.ttl:
+                del self._revoked_users[user_id]
+
+    def stats(self):
+        lookups = self._hits + self._misses
+        return {
+            'enabled': AUTH_ENABLED,
+            'token_ttl_seconds': self.ttl,
+            'issued': self._issued,
+            'cached': len(self._verified),
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_ratio': round(self._hits / lookups, 4) if lookups else 0.0,
+            'rejected': self._rejected,
+            'revoked_sessions': len(self._revoked),
+            'revoked_users': len(self._revoked_users),
+        }
+
+
+hasher = PasswordHasher()
+sessions = SessionCache()
+
+
+# ---------------------- guards ----------------------
+
+_bearer = HTTPBearer(auto_error=False)
+
+
+def _unauthorized(detail):
+    return HTTPException(status_code=401, detail=detail, headers={'WWW-Authenticate': 'Bearer'})
+
+
+def authorize(token, roles=None):
+    """Session for ``token``; 401 without a valid token, 403 if its role is not in ``roles`` (admins always pass)."""
+    if not token:
+        raise _unauthorized("Not authenticated")
+    try:
+        session = sessions.verify(token)
+    except InvalidToken as e:
+        raise _unauthorized(str(e))
+    if roles and session.role not in roles and session.role not in ADMIN_ROLES:
+        raise HTTPException(status_code=403, detail=f"Role '{session.role}' is not allowed to use this endpoint")
+    return session
+
+
+def require(*roles, query_token=False):
+    """Dependency that returns the caller's ``Session``, or ``None`` when ``AUTH_ENABLED=0``.
+
+    With no ``roles`` any logged-in user passes. ``query_token`` also accepts
+    ``?access_token=`` for clients that cannot set headers, like ``EventSource``.
+    """
+    roles = frozenset(roles)
+
+    async def guard(request: Request, credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)):
+        if not AUTH_ENABLED:
+            return None
+        token = credentials.credentials if credentials else None
+        if token is None and query_token:
+            token = request.query_params.get('access_token')
+        return authorize(token, roles)
+
+    return guard
+
+
+def websocket_token(websocket):
+    """Bearer token of a WebSocket handshake, from the header or ``?access_token=``."""
+    scheme, _, token = websocket.headers.get('authorization', '').partition(' ')
+    if scheme.lower() == 'bearer' and token:
+        return token.strip()
+    return websocket.query_params.get('access_token')
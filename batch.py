@@ -0,0 +1,131 @@
+from fastapi import HTTPException
+
+import db
+import serialization
+from pagination import MAX_PAGE_SIZE
+
+
+class Table:
+    """A resource table addressable by primary key, for ``?ids=``, ``expand=`` and ``fields=``.
+
+    ``relations`` maps an expand name to ``(column, table)``: the foreign key
+    column on this table's rows and the table it points at. Expanding walks
+    these one level at a time with one ``WHERE key IN (...)`` per relation,
+    so a page of 100 logs with ``expand=vehicle.resident,gate`` costs three
+    queries rather than up to 300.
+    """
+
+    def __init__(self, keyset, key, cached=None, relations=None):
+        self.pages = keyset
+        self.name = keyset.table
+        self.columns = keyset.columns
+        self.key = key
+        self.cached = cached
+        self.relations = relations or {}
+        self.row_query = f"SELECT {', '.join(self.columns)} FROM {self.name} WHERE {key} = %s"
+        self._position = self.columns.index(key)
+        self._projections = {}
+
+    def project(self, fields, tree=None):
+        """This table narrowed to ``?fields=`` (``"vehicle_id,license_plate"``), or itself when not given.
+
+        The primary key and pagination keys are always selected, as are the
+        foreign keys that the relations in ``tree`` are expanded from.
+        """
+        if not fields:
+            return self
+        names = {name.strip() for name in fields.split(',') if name.strip()}
+        unknown = names.difference(self.columns)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields for {self.name}: {', '.join(sorted(unknown))} (allowed: {', '.join(self.columns)})")
+        names.update(self.pages.keys, (self.key,), (self.relations[name][0] for name in tree or ()))
+        # คงลำดับคอลัมน์ตามตาราง ชุด field เดียวกันจะได้ SQL เดียวกันไม่ว่า client เรียงมายังไง
+        columns = tuple(column for column in self.columns if column in names)
+        if columns == self.columns:
+            return self
+        table = self._projections.get(columns)
+        if table is None:
+            table = self._projections[columns] = Table(self.pages.project(columns), self.key, self.cached, self.relations)
+        return table
+
+    def select(self, ids):
+        """``(sql, params)`` for the rows with primary key in ``ids``."""
+        # เรียง id ก่อน ชุด id เดียวกันจะได้ query/params เดียวกัน (ใช้ cache และ slow-query log รวมกันได้)
+        ids = sorted(ids)
+        sql = f"SELECT {', '.join(self.columns)} FROM {self.name} WHERE {self.key} IN ({', '.join(['%s'] * len(ids))})"
+        return sql, tuple(ids)
+
+    async def fetch(self, ids):
+        """Rows keyed by primary key; ids that do not exist are left out."""
+        if not ids:
+            return {}
+        rows = await (self.cached or db).fetch_all(*self.select(ids))
+        return {row[self._position]: row for row in rows}
+
+    async def fetch_ids(self, ids):
+        """Rows for ``ids`` in the order requested."""
+        rows = await self.fetch(ids)
+        return [rows[row_id] for row_id in ids if row_id in rows]
+
+
+def parse_ids(raw, limit=MAX_PAGE_SIZE):
+    """``"1,2,3"`` to ``[1, 2, 3]``, duplicates dropped, at most ``limit`` ids."""
+    try:
+        ids = list(dict.fromkeys(int(part) for part in raw.split(',') if part.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+    if not ids:
+        raise HTTPException(status_code=400, detail="ids must not be empty")
+    if len(ids) > limit:
+        raise HTTPException(status_code=400, detail=f"At most {limit} ids per request")
+    return ids
+
+
+def parse_expand(table, raw):
+    """``"vehicle.resident,gate"`` to ``{'vehicle': {'resident': {}}, 'gate': {}}``, checked against ``table``."""
+    tree = {}
+    if not raw:
+        return tree
+    for path in raw.split(','):
+        path = path.strip()
+        if not path:
+            continue
+        node, current = tree, table
+        for name in path.split('.'):
+            relation = current.relations.get(name)
+            if relation is None:
+                allowed = ', '.join(sorted(current.relations)) or 'none'
+                raise HTTPException(status_code=400, detail=f"Cannot expand '{path}' on {table.name} (expandable from {current.name}: {allowed})")
+            node = node.setdefault(name, {})
+            current = relation[1]
+    return tree
+
+
+async def expand(table, objects, tree):
+    """Attach related rows to ``objects`` (dicts of ``table`` rows) in place, following ``tree``."""
+    for name, subtree in tree.items():
+        column, target = table.relations[name]
+        related = await target.fetch({obj[column] for obj in objects if obj[column] is not None})
+        related = {key: dict(zip(target.columns, row)) for key, row in related.items()}
+        if subtree:
+            # expand ชั้นถัดไปจากแถวที่ไม่ซ้ำกัน ไม่ใช่ทีละแถวของ parent
+            await expand(target, list(related.values()), subtree)
+        for obj in objects:
+            obj[name] = related.get(obj[column])
+
+
+async def rows_response(table, rows, tree, response=None):
+    """Like ``serialization.rows_response``, with the relations in ``tree`` expanded."""
+    if not tree:
+        return serialization.rows_response(table.columns, rows, response)
+    objects = [dict(zip(table.columns, row)) for row in rows]
+    await expand(table, objects, tree)
+    return serialization.json_response(objects, response)
+
+
+async def row_response(table, row, tree, response=None):
+    if not tree:
+        return serialization.row_response(table.columns, row, response)
+    obj = dict(zip(table.columns, row))
+    await expand(table, [obj], tree)
+    return serialization.json_response(obj, response)
@@ -0,0 +1,58 @@
+"""Cost of password hashing and of checking a bearer token.
+
+    python benchmarks/auth_bench.py --iterations 100000,300000,600000,1000000
+
+The first table is the time of one ``auth.hash_password`` (the same as one
+login) per PBKDF2 iteration count. Pick the largest count whose time you
+accept per login and set it as ``PASSWORD_HASH_ITERATIONS``; existing hashes
+are upgraded as users log in. The second table is per request: signing a
+token at login, verifying one the first time it is seen (HMAC and JSON), a
+repeat that hits the session cache, and the whole role guard through
+``auth.authorize``. No database is needed.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth  # noqa: E402
+
+
+def seconds_per_call(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', default='100000,300000,600000,1000000', help="comma-separated PBKDF2 iteration counts")
+    parser.add_argument('--hashes', type=int, default=5, help="hashes timed per iteration count")
+    parser.add_argument('--tokens', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{auth.ALGORITHM}, PASSWORD_HASH_ITERATIONS={auth.PASSWORD_HASH_ITERATIONS}")
+    for iterations in sorted(int(value) for value in args.iterations.split(',')):
+        seconds = seconds_per_call(lambda: auth.hash_password('correct horse battery staple', iterations), args.hashes)
+        # semaphore ของ PasswordHasher จำกัดจำนวน login ที่ hash พร้อมกัน
+        print(f"{iterations:>10,d} iterations  {seconds * 1000:8.1f} ms/login  {auth.PASSWORD_HASH_CONCURRENCY / seconds:8.1f} logins/s at concurrency {auth.PASSWORD_HASH_CONCURRENCY}")
+
+    sessions = auth.SessionCache(max_entries=args.tokens * 2)
+    tokens = [sessions.issue(user_id, 'security')[0] for user_id in range(args.tokens)]
+    print()
+    cases = [
+        ('sign (login)', lambda: sessions.issue(1, 'security')),
+        ('verify, first time', lambda: auth.decode(tokens[0])),
+        ('verify, cached', lambda: sessions.verify(tokens[0])),
+        ('role guard, cached', lambda: auth.authorize(tokens[0], auth.GATE_ROLES)),
+    ]
+    for name, function in cases:
+        seconds = seconds_per_call(function, args.tokens)
+        print(f"{name:20} {seconds * 1e6:8.2f} us")
+
+
+if __name__ == '__main__':
+    main()
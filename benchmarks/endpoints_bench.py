@@ -0,0 +1,472 @@
+"""Drive app.py routes concurrently and report throughput and latency per route.
+
+    python benchmarks/endpoints_bench.py --mix gate --requests 20000 --concurrency 32 \\
+        --output bench-$(git rev-parse --short HEAD).json --compare bench-baseline.json
+
+The app runs in-process (httpx ASGITransport) on the SQLite stand-in from
+``sqlite_backend.py``, seeded with a synthetic estate, so the numbers cover
+routing, validation, handlers, the db layer and serialization but not the
+network or MySQL itself. Requests carry the bearer token of a seeded admin,
+so every route pays its role check. Mixes:
+
+    gate   gate traffic: ~80% entry/exit logging and gate lookups, the rest admin reads
+    admin  list and by-id reads across all tables, with some edits
+    full   every route in app.py, including writes, deletes, exports and bulk ingest
+
+Environment switches such as ENTRYEXITLOG_WRITE_BEHIND=1 or DB_POOL_SIZE apply
+as they do to the real service. User writes and logins in ``full`` hash at
+PASSWORD_HASH_ITERATIONS and queue behind PASSWORD_HASH_CONCURRENCY; lower
+the iterations when those routes should not dominate the run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+from fastapi.routing import APIRoute  # noqa: E402
+
+import auth  # noqa: E402
+import db  # noqa: E402
+import rollups  # noqa: E402
+import schema  # noqa: E402
+import sqlite_backend  # noqa: E402
+from plate_search_bench import PROVINCES, random_plate  # noqa: E402
+
+
+GATES = 8
+BENCH_USERNAME, BENCH_PASSWORD = 'bench-admin', 'bench-password'
+ID_FIELDS = {
+    'vehicle': 'vehicle_id', 'visitor': 'visitor_id', 'resident': 'resident_id', 'user': 'user_id',
+    'accesspermission': 'permission_id', 'incidentreport': 'incident_id', 'securitystaff': 'staff_id',
+    'gate': 'gate_id', 'entryexitlog': 'log_id',
+}
+
+
+def seed(path, rng, vehicles, logs):
+    """Fill the stand-in with a plausible estate: one resident per user, a few vehicles per resident."""
+    residents = max(1, vehicles // 2)
+    now = datetime.now().replace(microsecond=0)
+    cnx = sqlite3.connect(path)
+    cnx.executemany('INSERT INTO User VALUES (?, ?, ?, ?, ?, ?)', [
+        (i, f'user{i}@example.com', f'user{i}', 'secret', 'resident', (now - timedelta(days=i % 900)).isoformat(' '))
+        for i in range(1, residents + 1)
+    ])
+    cnx.execute('INSERT INTO User VALUES (?, ?, ?, ?, ?, ?)', (
+        residents + 1, 'bench-admin@example.com', BENCH_USERNAME, auth.hash_password(BENCH_PASSWORD), 'admin', now.isoformat(' '),
+    ))
+    cnx.executemany('INSERT INTO Resident VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+        (i, i, f'ชื่อ{i}', f'{i} หมู่บ้าน', f'08{i:08d}', 'นาย', f'นามสกุล{i}', f'{i:013d}')
+        for i in range(1, residents + 1)
+    ])
+    plates = {}
+    while len(plates) < vehicles:
+        plates[(random_plate(rng), rng.choice(PROVINCES))] = None
+    cnx.executemany('INSERT INTO Vehicle VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+        (i, province, f'/img/plate/{i}.jpg', f'/img/vehicle/{i}.jpg', rng.randint(1, residents), plate, 'car', 'white', 'Toyota')
+        for i, (plate, province) in enumerate(plates, 1)
+    ])
+    cnx.executemany('INSERT INTO Gate VALUES (?, ?, ?)', [
+        (i, f'ประตู {i}', 'เข้า' if i % 2 else 'ออก') for i in range(1, GATES + 1)
+    ])
+    cnx.executemany('INSERT INTO SecurityStaff VALUES (?, ?, ?, ?, ?)', [
+        (i, f'รปภ {i}', 'morning' if i % 2 else 'night', f'09{i:08d}', (i - 1) % GATES + 1) for i in range(1, GATES * 2 + 1)
+    ])
+    cnx.executemany('INSERT INTO AccessPermission VALUES (?, ?, ?, ?, ?, ?)', [
+        (i, i, rng.randint(1, residents), rng.randint(1, GATES), (date.today() - timedelta(days=30)).isoformat(), (date.today() + timedelta(days=365)).isoformat())
+        for i in range(1, vehicles + 1)
+    ])
+    start = now - timedelta(days=30)
+    log_rows = [
+        [i, rng.randint(1, vehicles), start + timedelta(seconds=i * 30 * 86400 // logs), None, rng.randint(1, GATES)]
+        for i in range(1, logs + 1)
+    ]
+    # ทุกการเข้ามีเวลาออกแล้ว ยกเว้นการเข้าครั้งล่าสุดของรถราว 30% ที่ยังจอดอยู่ในโครงการ
+    latest = {row[1]: row[0] for row in log_rows}
+    for row in log_rows:
+        if latest[row[1]] != row[0] or rng.random() >= 0.3:
+            row[3] = row[2] + timedelta(minutes=rng.randint(10, 600))
+    cnx.executemany('INSERT INTO EntryExitLog (log_id, vehicle_id, entry_time, exit_time, gate_id) VALUES (?, ?, ?, ?, ?)', [
+        (log_id, vehicle_id, entry_time.isoformat(' '), exit_time.isoformat(' ') if exit_time else None, gate_id)
+        for log_id, vehicle_id, entry_time, exit_time, gate_id in log_rows
+    ])
+    # เท่ากับผลของ rollups.py backfill บนข้อมูลชุดนี้
+    traffic = Counter()
+    for _, _, entry_time, exit_time, gate_id in log_rows:
+        traffic.update(rollups.log_deltas(gate_id, entry_time, exit_time))
+    cnx.executemany('INSERT INTO TrafficRollup VALUES (?, ?, ?, ?, ?)', [
+        (bucket, start.isoformat(' '), gate_id, direction, count) for (bucket, start, gate_id, direction), count in traffic.items()
+    ])
+    cnx.executemany('INSERT INTO IncidentReport VALUES (?, ?, ?, ?, ?, ?)', [
+        (i, f'เหตุการณ์ {i}', (start + timedelta(hours=i)).isoformat(' '), rng.randint(1, vehicles), rng.randint(1, GATES * 2), rng.randint(1, GATES))
+        for i in range(1, logs // 50 + 1)
+    ])
+    cnx.executemany('INSERT INTO Visitor VALUES (?, ?, ?, ?, ?, ?)', [
+        (i, f'ผู้มาติดต่อ {i}', f'06{i:08d}', 'ส่งของ', rng.randint(1, vehicles), rng.randint(1, residents))
+        for i in range(1, residents // 2 + 1)
+    ])
+    cnx.commit()
+    cnx.close()
+    return {
+        'users': residents, 'residents': residents, 'vehicles': vehicles, 'visitors': residents // 2,
+        'permissions': vehicles, 'incidents': logs // 50, 'staff': GATES * 2, 'logs': logs,
+        'plates': list(plates),
+    }
+
+
+class Traffic:
+    """Generates requests as ``(route, method, url, kwargs, created)`` against the seeded ids.
+
+    ``created`` names the entity whose id a successful response creates, so
+    later PUT/DELETE requests target rows the benchmark owns.
+    """
+
+    def __init__(self, rng, estate):
+        self.rng = rng
+        self.estate = estate
+        self.owned = {name: [] for name in ID_FIELDS}
+        self.pending_ids = []
+        self._serial = 0
+
+    def _id(self, name):
+        return self.rng.randint(1, self.estate[name])
+
+    def _owned(self, name, pop=False):
+        ids = self.owned[name]
+        if not ids:
+            return None
+        return ids.pop(self.rng.randrange(len(ids))) if pop else self.rng.choice(ids)
+
+    def _serial_number(self):
+        self._serial += 1
+        return self._serial
+
+    # --- gate traffic
+    def log_entry(self):
+        body = {'vehicle_id': self._id('vehicles'), 'gate_id': self.rng.randint(1, GATES)}
+        return 'POST /entryexitlog', 'POST', '/entryexitlog', {'json': body}, 'entryexitlog'
+
+    def authorize(self):
+        plate, province = self.rng.choice(self.estate['plates'])
+        params = {'plate': plate, 'province': province} if self.rng.random() < 0.7 else {'plate': plate}
+        return 'GET /gate/{gate_id}/authorize', 'GET', f'/gate/{self.rng.randint(1, GATES)}/authorize', {'params': params}, None
+
+    def checkin(self):
+        plate, province = self.rng.choice(self.estate['plates'])
+        body = {'plate': plate, 'province': province}
+        return 'POST /gate/{gate_id}/checkin', 'POST', f'/gate/{self.rng.randint(1, GATES)}/checkin', {'json': body}, None
+
+    def login(self):
+        body = {'username': BENCH_USERNAME, 'password': BENCH_PASSWORD}
+        return 'POST /auth/login', 'POST', '/auth/login', {'json': body}, None
+
+    def get_gate(self):
+        return 'GET /gate/{gate_id}', 'GET', f'/gate/{self.rng.randint(1, GATES)}', {}, None
+
+    def search_plate(self):
+        plate, _ = self.rng.choice(self.estate['plates'])
+        plate = plate.replace(' ', '')
+        query = plate[:self.rng.randint(2, len(plate))]
+        return 'GET /vehicle/search', 'GET', '/vehicle/search', {'params': {'plate': query}}, None
+
+    # --- admin reads
+    def list_page(self, path, **params):
+        return f'GET {path}', 'GET', path, {'params': {'limit': 20, **params}}, None
+
+    def get_one(self, name, seeded):
+        return f'GET /{name}/{{{ID_FIELDS[name]}}}', 'GET', f'/{name}/{self._id(seeded)}', {}, None
+
+    def list_logs(self):
+        return self.list_page('/entryexitlog', gate_id=self.rng.randint(1, GATES))
+
+    def expanded_logs(self):
+        # หน้า log ของ admin UI ที่เคยเรียก /vehicle/{id} และ /resident/{id} ทีละแถว
+        params = {'limit': 20, 'gate_id': self.rng.randint(1, GATES), 'expand': 'vehicle.resident,gate'}
+        return 'GET /entryexitlog?expand', 'GET', '/entryexitlog', {'params': params}, None
+
+    def vehicle_plates(self):
+        params = {'limit': 20, 'fields': 'vehicle_id,license_plate,province'}
+        return 'GET /vehicle?fields', 'GET', '/vehicle', {'params': params}, None
+
+    def vehicles_by_ids(self):
+        ids = ','.join(str(self._id('vehicles')) for _ in range(20))
+        return 'GET /vehicle?ids', 'GET', '/vehicle', {'params': {'ids': ids}}, None
+
+    def traffic_stats(self):
+        bucket = self.rng.choice(['hour', 'day'])
+        to_time = datetime.now() - timedelta(days=self.rng.randint(0, 20))
+        params = {'bucket': bucket, 'from': (to_time - timedelta(days=1 if bucket == 'hour' else 10)).isoformat(), 'to': to_time.isoformat()}
+        if self.rng.random() < 0.5:
+            params['gate_id'] = self.rng.randint(1, GATES)
+        return 'GET /stats/traffic', 'GET', '/stats/traffic', {'params': params}, None
+
+    def occupancy(self):
+        params = {'gate_id': self.rng.randint(1, GATES)} if self.rng.random() < 0.5 else {}
+        return 'GET /occupancy', 'GET', '/occupancy', {'params': params}, None
+
+    # --- writes
+    def vehicle_body(self):
+        plate = f'ทด {self._serial_number()}'
+        return {
+            'province': self.rng.choice(PROVINCES), 'license_plate_img': '/img/p.jpg', 'vehicle_img': '/img/v.jpg',
+            'resident_id': self._id('residents'), 'license_plate': plate, 'vehicle_type': 'car', 'color': 'red', 'brand': 'Honda',
+        }
+
+    def create(self, name):
+        if name == 'entryexitlog':
+            return self.log_entry()
+        n = self._serial_number()
+        bodies = {
+            'vehicle': self.vehicle_body,
+            'visitor': lambda: {'name': f'v{n}', 'phone': '0600000000', 'purpose': 'ส่งของ', 'vehicle_id': None, 'resident_id': self._id('residents')},
+            'resident': lambda: {'user_id': self._id('users'), 'name': f'r{n}', 'address': 'a', 'phone': '1', 'prefix': 'นาย', 'lastname': 'l', 'citizen_id': f'{n:013d}'},
+            'user': lambda: {'email': f'bench{n}@example.com', 'username': f'bench{n}-{self.rng.random()}', 'password': 'x', 'role': 'admin', 'created_at': datetime.now().isoformat()},
+            'accesspermission': lambda: {'vehicle_id': self._id('vehicles'), 'resident_id': self._id('residents'), 'allowed_gate_id': self.rng.randint(1, GATES), 'start_date': str(date.today()), 'end_date': str(date.today() + timedelta(days=30))},
+            'incidentreport': lambda: {'description': f'incident {n}', 'incident_time': datetime.now().isoformat(), 'vehicle_id': self._id('vehicles'), 'security_staff_id': 1, 'gate_id': 1},
+            'securitystaff': lambda: {'name': f's{n}', 'shift_time': 'night', 'phone': '1', 'gate_id': self.rng.randint(1, GATES)},
+            'gate': lambda: {'location': f'gate {n}', 'gate_type': 'เข้า'},
+        }
+        return f'POST /{name}', 'POST', f'/{name}', {'json': bodies[name]()}, name
+
+    def update(self, name):
+        object_id = self._owned(name)
+        if object_id is None:
+            return self.create(name)
+        _, _, _, kwargs, _ = self.create(name)
+        return f'PUT /{name}/{{{ID_FIELDS[name]}}}', 'PUT', f'/{name}/{object_id}', kwargs, None
+
+    def delete(self, name):
+        object_id = self._owned(name, pop=True)
+        if object_id is None:
+            return self.create(name)
+        return f'DELETE /{name}/{{{ID_FIELDS[name]}}}', 'DELETE', f'/{name}/{object_id}', {}, None
+
+    def pending(self):
+        if not self.pending_ids:
+            return self.log_entry()
+        provisional_id = self.rng.choice(self.pending_ids)
+        return 'GET /entryexitlog/pending/{provisional_id}', 'GET', f'/entryexitlog/pending/{provisional_id}', {}, None
+
+    def bulk_logs(self):
+        entries = [{'vehicle_id': self._id('vehicles'), 'gate_id': self.rng.randint(1, GATES)} for _ in range(50)]
+        return 'POST /entryexitlog/bulk', 'POST', '/entryexitlog/bulk', {'json': entries}, None
+
+    def export(self, name):
+        params = {'format': self.rng.choice(['ndjson', 'csv']), 'gate_id': self.rng.randint(1, GATES)}
+        return f'GET /{name}/export', 'GET', f'/{name}/export', {'params': params}, None
+
+
+ADMIN_READS = [
+    (3, lambda t: t.list_page('/vehicle')),
+    (2, lambda t: t.get_one('vehicle', 'vehicles')),
+    (2, lambda t: t.list_page('/resident')),
+    (1, lambda t: t.get_one('resident', 'residents')),
+    (1, lambda t: t.list_page('/user')),
+    (1, lambda t: t.get_one('user', 'users')),
+    (1, lambda t: t.list_page('/visitor')),
+    (1, lambda t: t.list_page('/accesspermission')),
+    (1, lambda t: t.list_page('/incidentreport')),
+    (1, lambda t: t.list_page('/securitystaff')),
+    (1, lambda t: t.list_page('/gate')),
+    (3, Traffic.list_logs),
+    (2, Traffic.expanded_logs),
+    (1, Traffic.vehicles_by_ids),
+    (1, Traffic.vehicle_plates),
+    (1, Traffic.search_plate),
+    (1, Traffic.occupancy),
+    (1, Traffic.traffic_stats),
+]
+
+MIXES = {
+    'gate': [
+        (30, Traffic.log_entry),
+        (20, Traffic.authorize),
+        (25, Traffic.checkin),
+        (5, Traffic.get_gate),
+    ] + [(weight * 20 / sum(w for w, _ in ADMIN_READS), make) for weight, make in ADMIN_READS],
+    'admin': ADMIN_READS + [
+        (1, lambda t: t.create('vehicle')),
+        (1, lambda t: t.update('vehicle')),
+        (1, lambda t: t.create('resident')),
+        (1, lambda t: t.update('resident')),
+    ],
+    'full': ADMIN_READS + [
+        (4, Traffic.log_entry),
+        (2, Traffic.authorize),
+        (2, Traffic.checkin),
+        (1, Traffic.get_gate),
+        (0.2, Traffic.bulk_logs),
+        (0.5, Traffic.pending),
+        (0.05, Traffic.login),
+        (0.1, lambda t: t.export('entryexitlog')),
+        (0.1, lambda t: t.export('incidentreport')),
+        (1, lambda t: t.get_one('visitor', 'visitors')),
+        (1, lambda t: t.get_one('accesspermission', 'permissions')),
+        (1, lambda t: t.get_one('incidentreport', 'incidents')),
+        (1, lambda t: t.get_one('securitystaff', 'staff')),
+        (1, lambda t: t.get_one('entryexitlog', 'logs')),
+    ] + [
+        (weight, (lambda action, name: lambda t: getattr(t, action)(name))(action, name))
+        for name in ID_FIELDS if name != 'entryexitlog'
+        for action, weight in (('create', 0.6), ('update', 0.3), ('delete', 0.2))
+    ] + [
+        (0.3, lambda t: t.update('entryexitlog')),
+        (0.2, lambda t: t.delete('entryexitlog')),
+    ],
+}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, round(q * (len(sorted_values) - 1)))]
+
+
+def summarize(samples, elapsed):
+    routes = {}
+    for route, entries in sorted(samples.items()):
+        latencies = sorted(latency for latency, _ in entries)
+        statuses = {}
+        for _, status in entries:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        routes[route] = {
+            'requests': len(entries),
+            'throughput_rps': round(len(entries) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+            'errors': sum(count for status, count in statuses.items() if int(status) >= 500),
+            'statuses': statuses,
+        }
+    total = sum(route['requests'] for route in routes.values())
+    return {'elapsed_seconds': round(elapsed, 3), 'requests': total, 'throughput_rps': round(total / elapsed, 1), 'routes': routes}
+
+
+async def run(args):
+    import app
+
+    rng = random.Random(args.seed)
+    db.DB_BACKEND = sqlite_backend.SqliteDatabase.name
+    # stand-in สร้างตารางเองใน seed, migration กับ EXPLAIN ของ schema.py เป็นของ MySQL
+    schema.SCHEMA_BOOTSTRAP = 'off'
+    database = await db.init_database()
+    estate = seed(database.path, rng, args.vehicles, args.logs)
+    for _ in range(args.replicas):
+        # replica อ่านไฟล์เดียวกันผ่าน pool ของตัวเอง วัด overhead ของการเลือก replica และ token
+        replica = sqlite_backend.SqliteDatabase.replica(database.path)
+        await replica.start()
+        db.replicas.append(replica)
+    traffic = Traffic(rng, estate)
+    mix = MIXES[args.mix]
+    weights = [weight for weight, _ in mix]
+    makers = [make for _, make in mix]
+    samples = {}
+
+    async def phase(client, count, record):
+        remaining = count
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                route, method, url, kwargs, created = rng.choices(makers, weights)[0](traffic)
+                start = time.perf_counter()
+                response = await client.request(method, url, **kwargs)
+                await response.aread()
+                latency = time.perf_counter() - start
+                if created and response.status_code == 200:
+                    traffic.owned[created].append(response.json()[ID_FIELDS[created]])
+                elif 'X-Provisional-Id' in response.headers:
+                    traffic.pending_ids.append(response.headers['X-Provisional-Id'])
+                if record:
+                    samples.setdefault(route, []).append((latency, response.status_code))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        return time.perf_counter() - started
+
+    async with app.app.router.lifespan_context(app.app):
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            response = await client.post('/auth/login', json={'username': BENCH_USERNAME, 'password': BENCH_PASSWORD})
+            response.raise_for_status()
+            client.headers['Authorization'] = f"Bearer {response.json()['access_token']}"
+            # warmup ไม่นับ: index โหลดเสร็จแล้ว, connection เปิดครบแล้ว
+            await phase(client, args.warmup, record=False)
+            elapsed = await phase(client, args.requests, record=True)
+        declared = sorted({
+            f'{method} {route.path}' for route in app.app.routes if isinstance(route, APIRoute) for method in route.methods
+        })
+    return summarize(samples, elapsed), declared
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result, baseline=None):
+    base_routes = (baseline or {}).get('routes', {})
+    print(f"{'route':42} {'reqs':>7} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'5xx':>5}" + ('   p99 vs baseline' if baseline else ''))
+    for route, stats in result['routes'].items():
+        line = f"{route:42} {stats['requests']:>7} {stats['throughput_rps']:>9.1f} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['errors']:>5}"
+        previous = base_routes.get(route)
+        if previous and previous['p99_ms']:
+            line += f"   {(stats['p99_ms'] / previous['p99_ms'] - 1) * 100:+7.1f}%"
+        print(line)
+    line = f"total: {result['requests']} requests in {result['elapsed_seconds']}s, {result['throughput_rps']} req/s"
+    if baseline:
+        line += f" (baseline {baseline['throughput_rps']} req/s, commit {baseline.get('meta', {}).get('commit')})"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0], formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--mix', choices=sorted(MIXES), default='gate')
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--warmup', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--vehicles', type=int, default=5000)
+    parser.add_argument('--logs', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--replicas', type=int, default=0, help="route GET requests through this many read replicas")
+    parser.add_argument('--output', help="write results as JSON to this path")
+    parser.add_argument('--compare', help="JSON from an earlier run to compare against")
+    args = parser.parse_args()
+
+    result, declared = asyncio.run(run(args))
+    result['meta'] = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'args': vars(args),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    missing = [route for route in declared if route not in result['routes'] and not route.split(' ', 1)[1].startswith('/debug')]
+    if missing and args.mix == 'full':
+        print("not exercised:", ', '.join(missing))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Build time, memory and query latency of the plate search index.
+
+    python benchmarks/plate_search_bench.py --vehicles 200000
+
+Runs without a database: plates are generated in the usual Thai format
+(digit prefix, two consonants, up to four digits) across all provinces.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plate_search  # noqa: E402
+
+
+CONSONANTS = 'กขคฆงจฉชซฌญฎฏฐฑฒณดตถทธนบปผฝพฟภมยรลวศษสหฬอฮ'
+PROVINCES = [f'จังหวัด{i}' for i in range(77)]
+
+
+def random_plate(rng):
+    prefix = str(rng.randint(1, 9)) if rng.random() < 0.4 else ''
+    return f'{prefix}{rng.choice(CONSONANTS)}{rng.choice(CONSONANTS)} {rng.randint(1, 9999)}'
+
+
+def ocr_noise(rng, plate):
+    chars = list(plate.replace(' ', ''))
+    position = rng.randrange(len(chars))
+    operation = rng.choice(('substitute', 'delete', 'insert', 'transpose'))
+    if operation == 'substitute':
+        chars[position] = rng.choice(CONSONANTS + '0123456789')
+    elif operation == 'delete' and len(chars) > 2:
+        del chars[position]
+    elif operation == 'insert':
+        chars.insert(position, rng.choice('0123456789'))
+    elif position + 1 < len(chars):
+        chars[position], chars[position + 1] = chars[position + 1], chars[position]
+    return ''.join(chars)
+
+
+def measure(index, queries, **kwargs):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, **kwargs)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'p50_us': round(timings[len(timings) // 2] * 1e6, 1),
+        'p99_us': round(timings[int(len(timings) * 0.99)] * 1e6, 1),
+        'mean_us': round(statistics.fmean(timings) * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vehicles', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--max-distance', type=int, default=plate_search.PLATE_SEARCH_MAX_DISTANCE)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vehicles = [(vehicle_id, random_plate(rng), rng.choice(PROVINCES)) for vehicle_id in range(1, args.vehicles + 1)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = plate_search.PlateSearchIndex(args.max_distance)
+    for vehicle_id, license_plate, province in vehicles:
+        index.upsert(vehicle_id, license_plate, province, keep_sorted=False)
+    index._sorted_keys.sort()
+    build_seconds = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    sample = [rng.choice(vehicles) for _ in range(args.queries)]
+    print(f"vehicles={args.vehicles} max_distance={args.max_distance}")
+    print(f"build: {build_seconds:.2f}s, {memory / 2**20:.1f} MiB, {index.stats()}")
+    print("exact:  ", measure(index, [plate for _, plate, _ in sample]))
+    print("prefix: ", measure(index, [plate.replace(' ', '')[:3] for _, plate, _ in sample]))
+    print("fuzzy:  ", measure(index, [ocr_noise(rng, plate) for _, plate, _ in sample]))
+    print("fuzzy+province:", measure(index, [ocr_noise(rng, plate) for _, plate, _ in sample], province=PROVINCES[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Rows/sec of turning a page of DB rows into a JSON response body.
+
+    python benchmarks/serialization_bench.py --rows 100 --pages 2000
+
+``before`` is the path the list endpoints used to take: build a dict per row
+by position (``strftime`` on datetimes), let FastAPI validate the list
+against ``response_model`` and encode it with ``json``. ``after`` is
+``serialization.rows_response``. A second table shows, per response
+format and ``Content-Encoding``, the bytes on the wire for one page and the
+time to encode and compress it. No database is needed.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import TypeAdapter  # noqa: E402
+
+import app  # noqa: E402
+import negotiation  # noqa: E402
+import serialization  # noqa: E402
+
+
+def entry_exit_log_rows(count):
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    return [
+        (i, i % 5000, start + timedelta(minutes=i), start + timedelta(minutes=i, hours=2) if i % 3 else None, i % 8)
+        for i in range(1, count + 1)
+    ]
+
+
+def vehicle_rows(count):
+    return [
+        (i, 'กรุงเทพมหานคร', f'/img/plate/{i}.jpg', f'/img/vehicle/{i}.jpg', i % 900, f'กข {i % 9999}', 'car', 'white', 'Toyota')
+        for i in range(1, count + 1)
+    ]
+
+
+def before_entry_exit_log(rows, adapter):
+    logs = []
+    for row in rows:
+        logs.append({
+            'log_id': row[0],
+            'vehicle_id': row[1],
+            'entry_time': row[2].strftime('%Y-%m-%d %H:%M:%S') if row[2] else None,
+            'exit_time': row[3].strftime('%Y-%m-%d %H:%M:%S') if row[3] else None,
+            'gate_id': row[4]
+        })
+    return json.dumps(adapter.dump_python(adapter.validate_python(logs), mode='json'), ensure_ascii=False).encode()
+
+
+def before_vehicle(rows, adapter):
+    vehicles = []
+    for row in rows:
+        vehicles.append({
+            'vehicle_id': row[0],
+            'province': row[1],
+            'license_plate_img': row[2],
+            'vehicle_img': row[3],
+            'resident_id': row[4],
+            'license_plate': row[5],
+            'vehicle_type': row[6],
+            'color': row[7],
+            'brand': row[8]
+        })
+    return json.dumps(adapter.dump_python(adapter.validate_python(vehicles), mode='json'), ensure_ascii=False).encode()
+
+
+def rows_per_second(render, rows, pages):
+    start = time.perf_counter()
+    for _ in range(pages):
+        render(rows)
+    return len(rows) * pages / (time.perf_counter() - start)
+
+
+def wire_format(columns, rows, fmt, encoding, pages):
+    """``(bytes, microseconds per page)`` for one format / Content-Encoding pair."""
+    token = serialization.response_format.set(fmt)
+    try:
+        start = time.perf_counter()
+        for _ in range(pages):
+            body = serialization.rows_response(columns, rows).body
+            if encoding:
+                body = negotiation.compress(body, encoding)
+        return len(body), (time.perf_counter() - start) / pages * 1e6
+    finally:
+        serialization.response_format.reset(token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100, help="rows per page")
+    parser.add_argument('--pages', type=int, default=2000)
+    args = parser.parse_args()
+
+    cases = [
+        ('entryexitlog', entry_exit_log_rows(args.rows), app.ENTRY_EXIT_LOG_PAGES, before_entry_exit_log, app.EntryExitLog),
+        ('vehicle', vehicle_rows(args.rows), app.VEHICLE_PAGES, before_vehicle, app.Vehicles),
+    ]
+    print(f"encoder: {'orjson' if serialization.orjson else 'json'}, {args.rows} rows/page")
+    for name, rows, keyset, before, model in cases:
+        adapter = TypeAdapter(List[model])
+        old = rows_per_second(lambda page: before(page, adapter), rows, args.pages)
+        new = rows_per_second(lambda page: serialization.rows_response(keyset.columns, page).body, rows, args.pages)
+        print(f"{name:14} before {old:12,.0f} rows/s   after {new:12,.0f} rows/s   x{new / old:.1f}")
+
+    formats = ['json'] + (['msgpack'] if serialization.msgpack else [])
+    encodings = [None, 'gzip'] + (['br'] if negotiation.brotli else [])
+    print(f"\nbytes on the wire and encode time per {args.rows}-row page")
+    for name, rows, keyset, _, _ in cases:
+        baseline = None
+        for fmt in formats:
+            for encoding in encodings:
+                size, micros = wire_format(keyset.columns, rows, fmt, encoding, max(args.pages // 10, 1))
+                baseline = baseline or size
+                print(f"{name:14} {fmt:8} {encoding or 'identity':9} {size:9,d} B  {size / baseline:6.1%}  {micros:9.1f} us")
+
+
+if __name__ == '__main__':
+    main()
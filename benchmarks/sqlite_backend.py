@@ -0,0 +1,198 @@
+"""SQLite stand-in for the MySQL backend, for benchmarks only.
+
+Registers ``db.BACKENDS['sqlite']``. It speaks the queries app.py sends (the
+few MySQL-only bits are rewritten on the fly) against a temporary SQLite
+file in WAL mode, with one connection per checkout like the real pools.
+SQLite allows a single writer, so writes and transactions take a shared
+lock; plain reads run concurrently. Numbers measured against it are useful
+for comparing commits, not as absolute MySQL figures.
+"""
+import asyncio
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import rollups  # noqa: E402
+import schema  # noqa: E402
+
+
+TABLE_KEYS = {'EntryExitLog': 'log_id'}
+
+SCHEMA = '''
+CREATE TABLE User (user_id INTEGER PRIMARY KEY, email TEXT, username TEXT, password TEXT, role TEXT, created_at TIMESTAMP);
+CREATE TABLE Resident (resident_id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT, address TEXT, phone TEXT, prefix TEXT, lastname TEXT, citizen_id TEXT);
+CREATE TABLE Vehicle (vehicle_id INTEGER PRIMARY KEY, province TEXT, license_plate_img TEXT, vehicle_img TEXT, resident_id INTEGER, license_plate TEXT, vehicle_type TEXT, color TEXT, brand TEXT);
+CREATE TABLE Visitor (visitor_id INTEGER PRIMARY KEY, name TEXT, phone TEXT, purpose TEXT, vehicle_id INTEGER, resident_id INTEGER);
+CREATE TABLE Gate (gate_id INTEGER PRIMARY KEY, location TEXT, gate_type TEXT);
+CREATE TABLE SecurityStaff (staff_id INTEGER PRIMARY KEY, name TEXT, shift_time TEXT, phone TEXT, gate_id INTEGER);
+CREATE TABLE AccessPermission (permission_id INTEGER PRIMARY KEY, vehicle_id INTEGER, resident_id INTEGER, allowed_gate_id INTEGER, start_date DATE, end_date DATE);
+CREATE TABLE IncidentReport (incident_id INTEGER PRIMARY KEY, description TEXT, incident_time TIMESTAMP, vehicle_id INTEGER, security_staff_id INTEGER, gate_id INTEGER);
+CREATE TABLE EntryExitLog (log_id INTEGER PRIMARY KEY, vehicle_id INTEGER, entry_time TIMESTAMP, exit_time TIMESTAMP, gate_id INTEGER, exit_gate_id INTEGER);
+'''
+SCHEMA += rollups.SCHEMA.strip() + ';\n'
+# index ชุดเดียวกับ schema.py ต่อ primary key ท้าย index ของ EntryExitLog ให้เห็นชัดแบบที่ InnoDB ทำให้เอง (keyset เรียงด้วย log_id)
+SCHEMA += ''.join(
+    f"CREATE INDEX {index.name} ON {index.table} ({', '.join(index.columns + ((TABLE_KEYS[index.table],) if index.table in TABLE_KEYS else ()))});\n"
+    for index in schema.INDEXES
+)
+
+_WRITE = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('TIMESTAMP', lambda raw: datetime.fromisoformat(raw.decode()))
+sqlite3.register_converter('DATETIME', lambda raw: datetime.fromisoformat(raw.decode()))
+sqlite3.register_converter('DATE', lambda raw: date.fromisoformat(raw.decode()))
+
+
+def translate(query):
+    query = query.replace('%s', '?').replace('NOW()', "datetime('now', 'localtime')")
+    query = re.sub(r'\bFOR UPDATE\b', '', query)
+    query = query.replace('ON DUPLICATE KEY UPDATE', 'ON CONFLICT DO UPDATE SET')
+    query = re.sub(r'\bVALUES\((\w+)\)', r'excluded.\1', query)
+    return query.replace('@@auto_increment_increment', '1')
+
+
+class _SqliteSession:
+    def __init__(self, database, cnx):
+        self._database = database
+        self._cnx = cnx
+        self._in_transaction = False
+
+    def _run(self, query, params):
+        try:
+            start = time.perf_counter()
+            cursor = self._cnx.execute(translate(query), tuple(params or ()))
+            db._observe('execute', time.perf_counter() - start, query, params)
+            return cursor
+        except sqlite3.Error as e:
+            raise db.DatabaseError(str(e)) from e
+
+    def _fetch(self, query, params, fetch):
+        cursor = self._run(query, params)
+        start = time.perf_counter()
+        result = cursor.fetchone() if fetch == 'one' else cursor.fetchall()
+        db._observe('fetch', time.perf_counter() - start, query, params, db._row_count(result, fetch))
+        return result
+
+    async def fetch_one(self, query, params=None):
+        return self._fetch(query, params, 'one')
+
+    async def fetch_all(self, query, params=None):
+        return self._fetch(query, params, 'all')
+
+    async def execute(self, query, params=None):
+        if self._in_transaction or not _WRITE.match(query):
+            cursor = self._run(query, params)
+        else:
+            async with self._database.write_lock:
+                cursor = self._run(query, params)
+        lastrowid = cursor.lastrowid
+        if query.lstrip().upper().startswith('INSERT') and cursor.rowcount > 1:
+            # MySQL รายงาน id ของแถวแรกใน multi-row INSERT, SQLite รายงานแถวสุดท้าย
+            lastrowid -= cursor.rowcount - 1
+        return db.ExecuteResult(cursor.rowcount, lastrowid)
+
+    async def stream(self, query, params=None, batch_size=1000):
+        cursor = self._run(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+    async def begin(self):
+        await self._database.write_lock.acquire()
+        self._in_transaction = True
+        self._cnx.execute('BEGIN IMMEDIATE')
+
+    async def commit(self):
+        self._finish('COMMIT')
+
+    async def rollback(self):
+        self._finish('ROLLBACK')
+
+    def _finish(self, statement):
+        if not self._in_transaction:
+            return
+        try:
+            self._cnx.execute(statement)
+        finally:
+            self._in_transaction = False
+            self._database.write_lock.release()
+
+
+class SqliteDatabase(db._Database):
+    name = 'sqlite'
+
+    @classmethod
+    def replica(cls, host):
+        # "host" ของ stand-in คือ path ของไฟล์ primary, อ่านไฟล์เดียวกันผ่าน pool แยก
+        return cls(host)
+
+    def __init__(self, path=None):
+        self.path = path
+        self._owns_file = path is None
+        self._idle = []
+        self._opened = 0
+        self._semaphore = None
+        self.write_lock = None
+
+    async def start(self):
+        if self.path is None:
+            handle, self.path = tempfile.mkstemp(prefix='bench-', suffix='.sqlite3')
+            os.close(handle)
+        self._semaphore = asyncio.Semaphore(db.POOL_SIZE + db.POOL_MAX_OVERFLOW)
+        self.write_lock = asyncio.Lock()
+        cnx = self._connect()
+        cnx.execute('PRAGMA journal_mode=WAL')
+        if not cnx.execute("SELECT 1 FROM sqlite_master WHERE name = 'Vehicle'").fetchone():
+            cnx.executescript(SCHEMA)
+        self._idle.append(cnx)
+
+    def _connect(self):
+        self._opened += 1
+        cnx = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None, check_same_thread=False)
+        cnx.execute('PRAGMA synchronous=NORMAL')
+        return cnx
+
+    async def close(self):
+        for cnx in self._idle:
+            cnx.close()
+        self._idle.clear()
+        if self._owns_file:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+
+    @asynccontextmanager
+    async def connection(self):
+        async with self._semaphore:
+            cnx = self._idle.pop() if self._idle else self._connect()
+            session = _SqliteSession(self, cnx)
+            try:
+                yield session
+            finally:
+                await session.rollback()
+                self._idle.append(cnx)
+
+    async def position(self):
+        return 'sqlite'
+
+    async def has_applied(self, position):
+        # replica ของ stand-in คือไฟล์เดียวกับ primary ไม่มีวันตามหลัง
+        return True
+
+    def stats(self):
+        return {'backend': self.name, 'path': self.path, 'opened': self._opened, 'idle': len(self._idle)}
+
+
+db.BACKENDS[SqliteDatabase.name] = SqliteDatabase
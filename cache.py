@@ -0,0 +1,100 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+import db
+
+
+# ตาราง reference แทบไม่เปลี่ยน TTL มีไว้กันกรณีมีคนแก้จาก worker อื่นหรือแก้ใน DB ตรงๆ
+REFERENCE_CACHE_TTL_SECONDS = float(os.getenv('REFERENCE_CACHE_TTL_SECONDS', '300'))
+REFERENCE_CACHE_MAX_ENTRIES = int(os.getenv('REFERENCE_CACHE_MAX_ENTRIES', '1000'))
+
+
+class ReadThroughCache:
+    """Query-result cache for one small, rarely written table.
+
+    Results are keyed by ``(query, params)`` and kept for ``ttl`` seconds or
+    until ``invalidate`` is called by the table's mutators. Concurrent misses
+    for the same key share one database round trip, and a load that was in
+    flight when the table was invalidated is returned but not stored.
+    """
+
+    def __init__(self, name, ttl=REFERENCE_CACHE_TTL_SECONDS, max_entries=REFERENCE_CACHE_MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    async def _get(self, key, load):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+        self._misses += 1
+        future = self._loading.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        generation = self._generation
+        try:
+            value = await load()
+        except Exception as e:
+            future.set_exception(e)
+            # ไม่มีใครรออยู่ก็ไม่ต้องให้ asyncio เตือนว่า exception ไม่ถูกอ่าน
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+            if not future.done():
+                future.cancel()
+        if generation == self._generation and self.ttl > 0:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    # โหลดจาก primary เสมอ: หลัง invalidate ถ้าอ่านจาก replica ที่ยังตามไม่ทันจะได้ค่าเก่าค้างใน cache ไปทั้ง TTL
+    async def fetch_one(self, query, params=None):
+        return await self._get(('one', query, params), lambda: db.database.fetch_one(query, params))
+
+    async def fetch_all(self, query, params=None):
+        return await self._get(('all', query, params), lambda: db.database.fetch_all(query, params))
+
+    def invalidate(self):
+        self._generation += 1
+        self._invalidations += 1
+        self._entries.clear()
+        # load ที่ค้างอยู่อาจอ่านค่าก่อนการแก้ไข ให้ request ถัดไปโหลดใหม่แทนการรอผลนั้น
+        self._loading.clear()
+
+    def stats(self):
+        lookups = self._hits + self._misses
+        return {
+            'entries': len(self._entries),
+            'ttl_seconds': self.ttl,
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_ratio': round(self._hits / lookups, 4) if lookups else 0.0,
+            'invalidations': self._invalidations,
+        }
+
+
+gates = ReadThroughCache('Gate')
+security_staff = ReadThroughCache('SecurityStaff')
+
+
+def stats():
+    return {cache.name: cache.stats() for cache in (gates, security_staff)}
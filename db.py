@@ -0,0 +1,643 @@
+import asyncio
+import itertools
+import os
+import queue
+import threading
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import NamedTuple, Optional
+
+import mysql.connector
+from starlette.concurrency import run_in_threadpool
+
+
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', '000.00.00.00'),
+    'user': os.getenv('DB_USER', '00'),
+    'password': os.getenv('DB_PASSWORD', '00000'),
+    'database': os.getenv('DB_NAME', '00'),
+}
+
+# replica สำหรับอ่าน คั่นด้วย comma เช่น "10.0.0.2,10.0.0.3:3307" ใช้ user/password/database เดียวกับ primary
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+
+# 'sync' = mysql-connector ผ่าน threadpool, 'async' = aiomysql บน event loop
+DB_BACKEND = os.getenv('DB_BACKEND', 'sync')
+
+# ขนาด pool: size คือจำนวน connection ที่เก็บค้างไว้, max_overflow คือจำนวนที่เปิดเพิ่มได้ชั่วคราวตอนคนใช้เยอะ
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', '5'))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# connection ที่ว่างนานกว่านี้ (วินาที) จะถูก ping ก่อนส่งให้ handler
+POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', '5'))
+
+
+# observer(event, seconds, query, params, rows) ถูกเรียกหลังแต่ละขั้นของการคุยกับ DB
+# event: 'pool_wait', 'connect', 'execute', 'fetch'; backend sync เรียกจาก thread ใน threadpool
+_observers = []
+
+
+def add_observer(observer):
+    """Register a callback for DB timings; it must be cheap and thread-safe."""
+    _observers.append(observer)
+
+
+def remove_observer(observer):
+    _observers.remove(observer)
+
+
+def _observe(event, seconds, query=None, params=None, rows=None):
+    for observer in _observers:
+        observer(event, seconds, query, params, rows)
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes free within the pool timeout."""
+
+
+class DatabaseError(Exception):
+    """Driver-independent wrapper for errors raised by either backend."""
+
+    def __init__(self, msg, errno=None):
+        super().__init__(msg)
+        self.errno = errno
+
+
+class ExecuteResult(NamedTuple):
+    rowcount: int
+    lastrowid: Optional[int]
+
+
+class ConnectionPool:
+    """MySQL connection pool with bounded overflow, shared by the event loop and the threadpool.
+
+    Up to ``size`` connections are kept open between requests; under load up
+    to ``max_overflow`` extra connections are opened and closed again as soon
+    as they are returned. Callers wait at most ``timeout`` seconds for a slot,
+    on the event loop, so a queue of waiting requests holds no worker threads;
+    only taking a connection out (ping/connect) and putting it back run in the
+    threadpool.
+    """
+
+    def __init__(self, size, max_overflow, timeout, ping_after, **connect_args):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._connect_args = connect_args
+        self._idle = queue.LifoQueue()
+        # slot ใช้จาก event loop เท่านั้น ส่วน counter ด้านล่าง thread ใน threadpool แก้ด้วย จึงต้องมี lock
+        self._slots = asyncio.Semaphore(size + max_overflow)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._opened = 0
+        self._checked_out = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    async def acquire(self):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeoutError(f"No database connection available after {self.timeout}s")
+        waited = time.perf_counter() - start
+        _observe('pool_wait', waited)
+        try:
+            # ได้ slot แล้ว thread ที่ใช้ตรงนี้ไม่ต้องรอใคร แค่ ping หรือเปิด connection
+            cnx = await run_in_threadpool(self._checkout)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._checked_out += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            if waited > self._wait_max:
+                self._wait_max = waited
+        return cnx
+
+    def _checkout(self):
+        while True:
+            try:
+                cnx, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - last_used < self.ping_after:
+                return cnx
+            try:
+                cnx.ping(reconnect=False)
+                return cnx
+            except mysql.connector.Error:
+                self._discard(cnx)
+
+    def _connect(self):
+        # autocommit: คำสั่งเดี่ยวไม่ต้องส่ง COMMIT แยก, transaction จริงเริ่มด้วย start_transaction()
+        start = time.perf_counter()
+        cnx = mysql.connector.connect(autocommit=True, **self._connect_args)
+        _observe('connect', time.perf_counter() - start)
+        with self._lock:
+            self._opened += 1
+        return cnx
+
+    def _discard(self, cnx):
+        try:
+            cnx.close()
+        except mysql.connector.Error:
+            pass
+        with self._lock:
+            self._opened -= 1
+            self._discarded += 1
+
+    async def release(self, cnx, discard=False):
+        try:
+            await run_in_threadpool(self._return, cnx, discard)
+        finally:
+            self._slots.release()
+
+    def _return(self, cnx, discard):
+        try:
+            if not discard:
+                try:
+                    # ปิด transaction ที่ค้างอยู่ ไม่ให้ snapshot เก่าติดไปกับ request ถัดไป
+                    if cnx.in_transaction:
+                        cnx.rollback()
+                except mysql.connector.Error:
+                    discard = True
+            if discard or self._closed or self._idle.qsize() >= self.size:
+                self._discard(cnx)
+            else:
+                self._idle.put((cnx, time.monotonic()))
+        finally:
+            with self._lock:
+                self._checked_out -= 1
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                cnx, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(cnx)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'timeout': self.timeout,
+                'opened': self._opened,
+                'idle': self._idle.qsize(),
+                'checked_out': self._checked_out,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'wait_seconds_total': round(self._wait_total, 6),
+                'wait_seconds_max': round(self._wait_max, 6),
+                'wait_seconds_avg': round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0,
+            }
+
+
+def _row_count(result, fetch):
+    if fetch == 'one':
+        return 0 if result is None else 1
+    return len(result)
+
+
+class _SyncSession:
+    """Runs statements on one mysql-connector connection in the threadpool."""
+
+    def __init__(self, cnx):
+        self._cnx = cnx
+        self.broken = False
+
+    def _run(self, query, params, fetch):
+        try:
+            cursor = self._cnx.cursor(buffered=True)
+            try:
+                start = time.perf_counter()
+                cursor.execute(query, params)
+                executed = time.perf_counter()
+                _observe('execute', executed - start, query, params)
+                if fetch is None:
+                    return ExecuteResult(cursor.rowcount, cursor.lastrowid)
+                result = cursor.fetchone() if fetch == 'one' else cursor.fetchall()
+                _observe('fetch', time.perf_counter() - executed, query, params, _row_count(result, fetch))
+                return result
+            finally:
+                cursor.close()
+        except mysql.connector.Error as e:
+            raise DatabaseError(str(e), e.errno) from e
+
+    async def fetch_one(self, query, params=None):
+        return await run_in_threadpool(self._run, query, params, 'one')
+
+    async def fetch_all(self, query, params=None):
+        return await run_in_threadpool(self._run, query, params, 'all')
+
+    async def execute(self, query, params=None):
+        return await run_in_threadpool(self._run, query, params, None)
+
+    def _open_stream(self, query, params):
+        try:
+            cursor = self._cnx.cursor(buffered=False)
+            start = time.perf_counter()
+            cursor.execute(query, params)
+            _observe('execute', time.perf_counter() - start, query, params)
+            return cursor
+        except mysql.connector.Error as e:
+            raise DatabaseError(str(e), e.errno) from e
+
+    def _fetch_batch(self, cursor, batch_size):
+        try:
+            return cursor.fetchmany(batch_size)
+        except mysql.connector.Error as e:
+            raise DatabaseError(str(e), e.errno) from e
+
+    async def stream(self, query, params=None, batch_size=1000):
+        # unbuffered cursor: แถวถูกอ่านจาก socket ทีละ batch ไม่โหลดทั้งผลลัพธ์เข้า memory
+        cursor = await run_in_threadpool(self._open_stream, query, params)
+        exhausted = False
+        fetched = 0
+        fetch_seconds = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                rows = await run_in_threadpool(self._fetch_batch, cursor, batch_size)
+                fetch_seconds += time.perf_counter() - start
+                if not rows:
+                    exhausted = True
+                    break
+                fetched += len(rows)
+                yield rows
+        finally:
+            _observe('fetch', fetch_seconds, query, params, fetched)
+            if exhausted:
+                await run_in_threadpool(cursor.close)
+            else:
+                # ยังมีแถวค้างใน socket, ทิ้ง connection ดีกว่าอ่านที่เหลือทิ้งทั้งหมด
+                self.broken = True
+
+    def _call(self, method):
+        try:
+            method()
+        except mysql.connector.Error as e:
+            raise DatabaseError(str(e), e.errno) from e
+
+    async def begin(self):
+        await run_in_threadpool(self._call, self._cnx.start_transaction)
+
+    async def commit(self):
+        await run_in_threadpool(self._call, self._cnx.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self._call, self._cnx.rollback)
+
+
+class _AsyncSession:
+    """Runs statements on one aiomysql connection."""
+
+    def __init__(self, conn, error_type, ss_cursor):
+        self._conn = conn
+        self._error_type = error_type
+        self._ss_cursor = ss_cursor
+
+    async def _run(self, query, params, fetch):
+        try:
+            async with self._conn.cursor() as cursor:
+                start = time.perf_counter()
+                await cursor.execute(query, params)
+                executed = time.perf_counter()
+                _observe('execute', executed - start, query, params)
+                if fetch is None:
+                    return ExecuteResult(cursor.rowcount, cursor.lastrowid)
+                result = await (cursor.fetchone() if fetch == 'one' else cursor.fetchall())
+                _observe('fetch', time.perf_counter() - executed, query, params, _row_count(result, fetch))
+                return result
+        except self._error_type as e:
+            raise DatabaseError(str(e), e.args[0] if e.args else None) from e
+
+    async def fetch_one(self, query, params=None):
+        return await self._run(query, params, 'one')
+
+    async def fetch_all(self, query, params=None):
+        return await self._run(query, params, 'all')
+
+    async def execute(self, query, params=None):
+        return await self._run(query, params, None)
+
+    async def stream(self, query, params=None, batch_size=1000):
+        exhausted = False
+        fetched = 0
+        fetch_seconds = 0.0
+        cursor = await self._conn.cursor(self._ss_cursor)
+        try:
+            start = time.perf_counter()
+            await cursor.execute(query, params)
+            _observe('execute', time.perf_counter() - start, query, params)
+            while True:
+                start = time.perf_counter()
+                rows = await cursor.fetchmany(batch_size)
+                fetch_seconds += time.perf_counter() - start
+                if not rows:
+                    exhausted = True
+                    break
+                fetched += len(rows)
+                yield rows
+        except self._error_type as e:
+            raise DatabaseError(str(e), e.args[0] if e.args else None) from e
+        finally:
+            _observe('fetch', fetch_seconds, query, params, fetched)
+            if exhausted:
+                await cursor.close()
+            else:
+                self._conn.close()
+
+    async def begin(self):
+        await self._conn.begin()
+
+    async def commit(self):
+        await self._conn.commit()
+
+    async def rollback(self):
+        await self._conn.rollback()
+
+
+class _Database:
+    name = None
+
+    @classmethod
+    def replica(cls, host):
+        """A database of this backend for the replica at ``host`` (``"host"`` or ``"host:port"``)."""
+        hostname, _, port = host.partition(':')
+        config = dict(DB_CONFIG, host=hostname)
+        if port:
+            config['port'] = int(port)
+        return cls(config)
+
+    async def start(self):
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    def connection(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def transaction(self):
+        async with self.connection() as session:
+            await session.begin()
+            try:
+                yield session
+            except BaseException:
+                await session.rollback()
+                raise
+            await session.commit()
+
+    async def fetch_one(self, query, params=None):
+        async with self.connection() as session:
+            return await session.fetch_one(query, params)
+
+    async def fetch_all(self, query, params=None):
+        async with self.connection() as session:
+            return await session.fetch_all(query, params)
+
+    async def execute(self, query, params=None):
+        async with self.connection() as session:
+            return await session.execute(query, params)
+
+    async def stream(self, query, params=None, batch_size=1000):
+        async with self.connection() as session:
+            async for rows in session.stream(query, params, batch_size):
+                yield rows
+
+    async def position(self):
+        """GTID set of everything committed so far, or ``None`` if GTIDs are off."""
+        row = await self.fetch_one('SELECT @@GLOBAL.gtid_executed')
+        if not row or not row[0]:
+            return None
+        # MySQL ขึ้นบรรทัดใหม่ระหว่าง UUID ตัด whitespace ออกให้ใส่ header ได้
+        return ''.join(row[0].split())
+
+    async def has_applied(self, position):
+        """Whether this server has applied every transaction in ``position``."""
+        row = await self.fetch_one('SELECT GTID_SUBSET(%s, @@GLOBAL.gtid_executed)', (position,))
+        return bool(row and row[0])
+
+
+class SyncDatabase(_Database):
+    """mysql-connector behind ConnectionPool; every call hops to the threadpool."""
+
+    name = 'sync'
+
+    def __init__(self, config=None):
+        self.config = config or DB_CONFIG
+        self.pool = None
+
+    async def start(self):
+        self.pool = ConnectionPool(POOL_SIZE, POOL_MAX_OVERFLOW, POOL_TIMEOUT, POOL_PING_AFTER, **self.config)
+
+    async def close(self):
+        self.pool.close()
+
+    @asynccontextmanager
+    async def connection(self):
+        cnx = await self.pool.acquire()
+        session = _SyncSession(cnx)
+        discard = False
+        try:
+            yield session
+        except DatabaseError:
+            discard = not await run_in_threadpool(cnx.is_connected)
+            raise
+        finally:
+            await self.pool.release(cnx, discard or session.broken)
+
+    def stats(self):
+        return {'backend': self.name, 'host': self.config['host'], **self.pool.stats()}
+
+
+class AsyncDatabase(_Database):
+    """aiomysql pool driven directly from the event loop."""
+
+    name = 'async'
+
+    def __init__(self, config=None):
+        self.config = config or DB_CONFIG
+        self.pool = None
+        self._aiomysql = None
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    async def start(self):
+        import aiomysql
+
+        self._aiomysql = aiomysql
+        config = dict(self.config)
+        config['db'] = config.pop('database')
+        self.pool = await aiomysql.create_pool(
+            minsize=0,
+            maxsize=POOL_SIZE + POOL_MAX_OVERFLOW,
+            autocommit=True,
+            **config
+        )
+
+    async def close(self):
+        self.pool.close()
+        await self.pool.wait_closed()
+
+    async def _acquire(self):
+        while True:
+            opened = self.pool.size
+            start = time.perf_counter()
+            conn = await self.pool.acquire()
+            if self.pool.size > opened:
+                # aiomysql เปิด connection ใหม่ใน acquire เอง นับเวลาช่วงนี้เป็น connect แทน pool wait
+                _observe('connect', time.perf_counter() - start)
+            if asyncio.get_running_loop().time() - conn.last_usage < POOL_PING_AFTER:
+                return conn
+            try:
+                await conn.ping(reconnect=False)
+                return conn
+            except self._aiomysql.MySQLError:
+                conn.close()
+                self.pool.release(conn)
+
+    @asynccontextmanager
+    async def connection(self):
+        start = time.perf_counter()
+        try:
+            conn = await asyncio.wait_for(self._acquire(), POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise PoolTimeoutError(f"No database connection available after {POOL_TIMEOUT}s")
+        waited = time.perf_counter() - start
+        _observe('pool_wait', waited)
+        self._checkouts += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        try:
+            yield _AsyncSession(conn, self._aiomysql.MySQLError, self._aiomysql.SSCursor)
+        finally:
+            if not conn.closed and conn.get_transaction_status():
+                await conn.rollback()
+            self.pool.release(conn)
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'host': self.config['host'],
+            'size': POOL_SIZE,
+            'max_overflow': POOL_MAX_OVERFLOW,
+            'timeout': POOL_TIMEOUT,
+            'opened': self.pool.size,
+            'idle': self.pool.freesize,
+            'checked_out': self.pool.size - self.pool.freesize,
+            'checkouts': self._checkouts,
+            'timeouts': self._timeouts,
+            'wait_seconds_total': round(self._wait_total, 6),
+            'wait_seconds_max': round(self._wait_max, 6),
+            'wait_seconds_avg': round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0,
+        }
+
+
+BACKENDS = {
+    SyncDatabase.name: SyncDatabase,
+    AsyncDatabase.name: AsyncDatabase,
+}
+
+database = None
+replicas = []
+_replica_turn = itertools.count()
+
+# replica ที่ request ปัจจุบันอ่านได้ (replication middleware ตั้งให้เฉพาะ GET/HEAD)
+# ค่า default None = อ่านจาก primary ทั้ง request ที่เขียนและงาน background ทั้งหมด
+read_from = ContextVar('db_read_from', default=None)
+# replication middleware ใส่ list ไว้ต่อ request ที่อาจเขียน การเขียนบน primary ที่สำเร็จเติมลงไป
+# response จึงได้ consistency token เฉพาะเมื่อ handler เขียนจริง (ไม่ใช่ 202 ของ write-behind ที่เขียนทีหลังใน task อื่น)
+primary_writes = ContextVar('db_primary_writes', default=None)
+
+
+async def init_database():
+    global database
+    if database is None:
+        if DB_BACKEND not in BACKENDS:
+            raise RuntimeError(f"Unknown DB_BACKEND {DB_BACKEND!r}, expected one of {sorted(BACKENDS)}")
+        database = BACKENDS[DB_BACKEND]()
+        await database.start()
+        for host in DB_REPLICA_HOSTS:
+            replica = BACKENDS[DB_BACKEND].replica(host)
+            await replica.start()
+            replicas.append(replica)
+    return database
+
+
+async def close_database():
+    global database
+    if database is not None:
+        for replica in replicas:
+            await replica.close()
+        replicas.clear()
+        await database.close()
+        database = None
+
+
+def next_replicas():
+    """All replicas, starting from the next one in round-robin order."""
+    start = next(_replica_turn) % len(replicas)
+    return replicas[start:] + replicas[:start]
+
+
+def reader():
+    return read_from.get() or database
+
+
+def _wrote():
+    writes = primary_writes.get()
+    if writes is not None:
+        writes.append(True)
+
+
+@asynccontextmanager
+async def transaction():
+    async with database.transaction() as tx:
+        yield tx
+    _wrote()
+
+
+async def fetch_one(query, params=None):
+    return await reader().fetch_one(query, params)
+
+
+async def fetch_all(query, params=None):
+    return await reader().fetch_all(query, params)
+
+
+async def execute(query, params=None):
+    result = await database.execute(query, params)
+    _wrote()
+    return result
+
+
+def stream(query, params=None, batch_size=1000):
+    return reader().stream(query, params, batch_size)
+
+
+def stats():
+    stats = database.stats()
+    if replicas:
+        stats['replicas'] = [replica.stats() for replica in replicas]
+    return stats
@@ -0,0 +1,51 @@
+import hashlib
+import json
+
+from fastapi import HTTPException, Response
+
+
+def row_etag(row, weak=False):
+    """ETag for a row tuple, a hash of its column values.
+
+    Strong for the full row. ``weak`` is for a ``?fields=`` projection: it still
+    revalidates GETs of the same projection but never satisfies ``If-Match``,
+    so nobody can update a row from a partial copy.
+    """
+    raw = json.dumps(list(row), default=str, ensure_ascii=False, separators=(',', ':'))
+    etag = '"' + hashlib.blake2b(raw.encode(), digest_size=16).hexdigest() + '"'
+    return 'W/' + etag if weak else etag
+
+
+def _tags(header):
+    return [tag.strip() for tag in header.split(',') if tag.strip()]
+
+
+def none_match(header, etag):
+    """True when ``If-None-Match`` matches ``etag`` (weak comparison, RFC 9110 13.1.2)."""
+    if not header:
+        return False
+    etag = etag.removeprefix('W/')
+    return any(tag == '*' or tag.removeprefix('W/') == etag for tag in _tags(header))
+
+
+def match(header, etag):
+    """True when ``If-Match`` matches ``etag`` (strong comparison, RFC 9110 13.1.1)."""
+    return any(tag == '*' or tag == etag for tag in _tags(header))
+
+
+def not_modified(etag):
+    return Response(status_code=304, headers={'ETag': etag})
+
+
+async def lock_and_check(tx, query, key, if_match, detail):
+    """Lock the row for the rest of ``tx`` and enforce ``If-Match`` against its current ETag.
+
+    Raises 404 if the row does not exist and 412 if the client's copy is stale,
+    so two editors cannot silently overwrite each other.
+    """
+    row = await tx.fetch_one(query + ' FOR UPDATE', (key,))
+    if not row:
+        raise HTTPException(status_code=404, detail=detail)
+    if if_match is not None and not match(if_match, row_etag(row)):
+        raise HTTPException(status_code=412, detail="Resource has been modified (If-Match failed)")
+    return row
@@ -0,0 +1,142 @@
+import asyncio
+import itertools
+import os
+from collections import deque
+
+import serialization
+
+
+# event ที่ค้างส่งได้ต่อ subscriber ถ้าเต็ม (จอช้าหรือเน็ตหลุด) ตัด subscriber นั้นทิ้ง ให้ต่อใหม่ด้วย Last-Event-ID
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', '100'))
+# event ล่าสุดที่เก็บไว้ส่งซ้ำให้ client ที่ต่อกลับมา
+EVENTS_HISTORY_SIZE = int(os.getenv('EVENTS_HISTORY_SIZE', '1000'))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv('EVENTS_HEARTBEAT_SECONDS', '15'))
+# frame ที่ WebSocket ส่งแทน keepalive comment ของ SSE (ASGI ส่ง ping control frame เองไม่ได้)
+WEBSOCKET_HEARTBEAT = '{"type":"heartbeat"}'
+
+
+class Event:
+    __slots__ = ('id', 'event_type', 'gate_id', 'data')
+
+    def __init__(self, id, event_type, gate_id, data):
+        self.id = id
+        self.event_type = event_type
+        self.gate_id = gate_id
+        # serialize ครั้งเดียวตอน publish ทุก subscriber ได้ bytes ชุดเดียวกัน
+        self.data = data
+
+    def sse(self):
+        return b'id: %d\nevent: %s\ndata: %s\n\n' % (self.id, self.event_type.encode(), self.data)
+
+    def message(self):
+        """The event as one JSON text frame for WebSocket clients."""
+        return b'{"id":%d,"type":"%s","data":%s}' % (self.id, self.event_type.encode(), self.data)
+
+
+class Subscriber:
+    def __init__(self, gate_ids, size):
+        self.gate_ids = frozenset(gate_ids or ())
+        self.queue = asyncio.Queue(maxsize=size)
+        self.dropped = False
+        self.closed = False
+
+    def wants(self, event):
+        return not self.gate_ids or event.gate_id is None or event.gate_id in self.gate_ids
+
+    async def get(self, timeout):
+        """Next event, ``None`` on heartbeat timeout; raises ``EOFError`` once the subscriber is closed or dropped."""
+        if self.closed:
+            raise EOFError
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if self.closed or event is None:
+            raise EOFError
+        return event
+
+
+class EventBroker:
+    """In-process fan-out of committed writes to live screens.
+
+    ``publish`` encodes an event once and hands the same bytes to every
+    matching subscriber with ``put_nowait``, so a write costs the same with
+    one screen or fifty. A subscriber whose queue is full is dropped rather
+    than allowed to slow down the writer or grow without bound; it can
+    reconnect with ``Last-Event-ID`` and catch up from the history.
+    """
+
+    def __init__(self, queue_size=EVENTS_QUEUE_SIZE, history_size=EVENTS_HISTORY_SIZE):
+        self.queue_size = queue_size
+        self._ids = itertools.count(1)
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._published = 0
+        self._dropped = 0
+
+    def publish(self, event_type, payload, gate_id=None):
+        event = Event(next(self._ids), event_type, gate_id, serialization.dumps(payload))
+        self._history.append(event)
+        self._published += 1
+        for subscriber in list(self._subscribers):
+            if not subscriber.wants(event):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+        return event
+
+    def _drop(self, subscriber):
+        subscriber.dropped = True
+        subscriber.closed = True
+        self._subscribers.discard(subscriber)
+        self._dropped += 1
+
+    def subscribe(self, gate_ids=None, last_event_id=None):
+        subscriber = Subscriber(gate_ids, self.queue_size)
+        if last_event_id is not None:
+            missed = [event for event in self._history if event.id > last_event_id and subscriber.wants(event)]
+            # ตามไม่ทันเกินกว่าคิวรับได้ ส่งเท่าที่ล่าสุดแทน
+            for event in missed[-self.queue_size:]:
+                subscriber.queue.put_nowait(event)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.closed = True
+        self._subscribers.discard(subscriber)
+
+    def close(self):
+        """End every subscription, e.g. on shutdown so open streams finish."""
+        for subscriber in list(self._subscribers):
+            self.unsubscribe(subscriber)
+            if not subscriber.queue.full():
+                subscriber.queue.put_nowait(None)
+
+    def stats(self):
+        return {
+            'subscribers': len(self._subscribers),
+            'published': self._published,
+            'dropped_subscribers': self._dropped,
+            'history': len(self._history),
+            'queue_size': self.queue_size,
+        }
+
+
+async def sse_stream(subscriber):
+    """Server-Sent Events body for ``subscriber``, with comment heartbeats to keep proxies from timing out."""
+    try:
+        # บอก EventSource ให้รอ 1 วินาทีก่อนต่อใหม่เมื่อถูกตัด
+        yield b'retry: 1000\n\n'
+        while True:
+            try:
+                event = await subscriber.get(EVENTS_HEARTBEAT_SECONDS)
+            except EOFError:
+                return
+            yield event.sse() if event is not None else b': keepalive\n\n'
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+broker = EventBroker()
@@ -0,0 +1,51 @@
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import date, datetime
+
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+async def encode_rows(columns, batches, fmt):
+    """Turn batches of row tuples into NDJSON or CSV bytes, one chunk per batch."""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        async for rows in batches:
+            writer.writerows(rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+    else:
+        async for rows in batches:
+            yield ''.join(
+                json.dumps(dict(zip(columns, row)), default=_json_default, ensure_ascii=False) + '\n'
+                for row in rows
+            ).encode()
+
+
+async def gzip_chunks(chunks):
+    # wbits=31 = gzip container, compress ทีละ chunk โดยไม่ต้องเก็บทั้งไฟล์
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
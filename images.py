@@ -0,0 +1,248 @@
+"""Content-addressed store for vehicle and plate images on local disk.
+
+Files are named by the SHA-256 of their bytes, so the same photo uploaded
+twice is stored once and a name never changes meaning; Vehicle rows keep
+only the 64-character hash. Images that older clients still send inline as
+``data:`` URIs are moved into the store on write, and rows written before
+the store existed are moved with::
+
+    python images.py migrate
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from functools import lru_cache
+
+import anyio
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+import db
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow เป็น optional ถ้าไม่มีก็ยังเก็บ/ส่งรูปได้ แค่ทำ thumbnail ไม่ได้
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images'))
+IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', str(10 * 1024 * 1024)))
+# จำกัดขนาด thumbnail ให้เลือกจากชุดนี้ ไม่ให้ cache บนดิสก์โตตามขนาดที่ client สุ่มขอมา
+THUMBNAIL_SIZES = (64, 128, 256, 512)
+# เนื้อหาของ hash หนึ่งไม่มีวันเปลี่ยน ให้ browser cache ได้ไม่จำกัด แต่ต้อง login ก่อนดู จึงไม่ให้ proxy ที่ใช้ร่วมกันเก็บ
+CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+# ลายเซ็นต้นไฟล์ของชนิดรูปที่รับ
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+_HASH = re.compile(r'^[0-9a-f]{64}$')
+_DATA_URI = re.compile(r'^data:image/[\w.+-]+;base64,', re.IGNORECASE)
+
+
+def is_hash(value):
+    return bool(value) and _HASH.match(value) is not None
+
+
+def sniff(head):
+    """Media type from the first bytes of a file, ``None`` if it is not an image we accept."""
+    for signature, media_type in _SIGNATURES:
+        if head.startswith(signature):
+            return media_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+class ImageStore:
+    """Hash-named image files under ``root``, with thumbnails cached next to them.
+
+    Uploads are streamed to a temporary file in the store while being hashed
+    and then renamed into place, so readers never see a partial file and two
+    uploads of the same image race harmlessly to the same name.
+    """
+
+    def __init__(self, root=IMAGE_STORE_DIR, max_bytes=IMAGE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._stored = 0
+        self._deduplicated = 0
+        self._thumbnails = 0
+
+    def path(self, digest):
+        if not is_hash(digest):
+            raise HTTPException(status_code=404, detail="Image not found")
+        # แยกโฟลเดอร์ตาม 2 ตัวแรกของ hash ไม่ให้ไฟล์หลายแสนไฟล์อยู่ในโฟลเดอร์เดียว
+        return os.path.join(self.root, digest[:2], digest)
+
+    def thumbnail_path(self, digest, size):
+        return os.path.join(self.root, 'thumbnails', str(size), digest[:2], digest + '.jpg')
+
+    async def save(self, chunks):
+        """Store the bytes of ``chunks`` (an async iterable) and return ``(digest, size, media_type)``."""
+        os.makedirs(self.root, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        os.close(handle)
+        digest = hashlib.sha256()
+        size = 0
+        head = b''
+        try:
+            async with await anyio.open_file(temp_path, 'wb') as f:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise HTTPException(status_code=413, detail=f"Image is larger than {self.max_bytes} bytes")
+                    if len(head) < 12:
+                        head += chunk[:12]
+                    digest.update(chunk)
+                    await f.write(chunk)
+            media_type = sniff(head)
+            if media_type is None:
+                raise HTTPException(status_code=415, detail="Only JPEG, PNG, GIF and WebP images are accepted")
+            digest = digest.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path):
+                self._deduplicated += 1
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+                self._stored += 1
+            return digest, size, media_type
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    async def save_bytes(self, data):
+        async def chunks():
+            yield data
+        return await self.save(chunks())
+
+    def media_type(self, digest):
+        """Media type of a stored image; raises 404 if it is not in the store."""
+        return _media_type(self.path(digest))
+
+    async def thumbnail(self, digest, size):
+        """Path of a JPEG thumbnail at most ``size`` pixels on its longer side, made on first request."""
+        if Image is None:
+            raise HTTPException(status_code=501, detail="Thumbnails need Pillow installed")
+        if size not in THUMBNAIL_SIZES:
+            raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(map(str, THUMBNAIL_SIZES))}")
+        self.media_type(digest)
+        path = self.thumbnail_path(digest, size)
+        if not os.path.exists(path):
+            # ย่อรูปกิน CPU ส่งไปทำใน threadpool ไม่ให้ event loop ค้าง
+            await run_in_threadpool(_render_thumbnail, self.path(digest), path, size)
+            self._thumbnails += 1
+        return path
+
+    def stats(self):
+        return {
+            'root': self.root,
+            'stored': self._stored,
+            'deduplicated': self._deduplicated,
+            'thumbnails_rendered': self._thumbnails,
+            'thumbnails_enabled': Image is not None,
+        }
+
+
+@lru_cache(maxsize=4096)
+def _media_type(path):
+    # ไฟล์ตั้งชื่อตามเนื้อหา เนื้อหาไม่เปลี่ยน cache ชนิดไฟล์ได้ตลอด
+    try:
+        with open(path, 'rb') as f:
+            return sniff(f.read(12))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+
+def _render_thumbnail(source, target, size):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with Image.open(source) as image:
+        image.thumbnail((size, size))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.thumb-')
+        os.close(handle)
+        try:
+            image.save(temp_path, 'JPEG', quality=80)
+            os.replace(temp_path, target)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+
+async def store_inline(value):
+    """Move a ``data:image/...;base64,`` value into the store and return its hash; other values pass through."""
+    if not value or not _DATA_URI.match(value):
+        return value
+    try:
+        data = base64.b64decode(value[value.index(',') + 1:], validate=True)
+    except binascii.Error:
+        raise HTTPException(status_code=400, detail="Invalid base64 image data")
+    digest, _, _ = await store.save_bytes(data)
+    return digest
+
+
+store = ImageStore()
+
+
+async def migrate(batch_size=100):
+    """Move inline images already in Vehicle rows into the store, a batch at a time."""
+    moved = 0
+    last_id = 0
+    while True:
+        rows = await db.fetch_all(
+            "SELECT vehicle_id, license_plate_img, vehicle_img FROM Vehicle WHERE vehicle_id > %s "
+            "AND (license_plate_img LIKE 'data:%%' OR vehicle_img LIKE 'data:%%') ORDER BY vehicle_id LIMIT %s",
+            (last_id, batch_size),
+        )
+        if not rows:
+            return moved
+        for vehicle_id, license_plate_img, vehicle_img in rows:
+            try:
+                new_plate_img = await store_inline(license_plate_img)
+                new_vehicle_img = await store_inline(vehicle_img)
+            except HTTPException as e:
+                logger.warning("Vehicle %s: image not moved: %s", vehicle_id, e.detail)
+                continue
+            # WHERE ค่าเดิม กันทับค่าที่มีคนแก้ระหว่างทาง
+            result = await db.execute(
+                'UPDATE Vehicle SET license_plate_img = %s, vehicle_img = %s WHERE vehicle_id = %s AND license_plate_img = %s AND vehicle_img = %s',
+                (new_plate_img, new_vehicle_img, vehicle_id, license_plate_img, vehicle_img),
+            )
+            moved += result.rowcount
+        last_id = rows[-1][0]
+        print(f"up to vehicle {last_id}: {moved} moved")
+
+
+async def _main(args):
+    await db.init_database()
+    try:
+        print(f"moved images of {await migrate(args.batch_size)} vehicle(s) to {store.root}")
+    finally:
+        await db.close_database()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the content-addressed image store.")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subcommands.add_parser('migrate', help="move inline data: URI images out of Vehicle rows")
+    migrate_parser.add_argument('--batch-size', type=int, default=100)
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
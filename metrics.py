@@ -0,0 +1,236 @@
+import bisect
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+import db
+
+
+# เปิดไว้ได้ตลอดแม้ช่วง peak: ต่อ request มีแค่ perf_counter กับ observe ไม่กี่ครั้ง (lock + bisect)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+DB_PHASES = ('pool_wait', 'connect', 'execute', 'fetch')
+UNMATCHED_ROUTE = 'unmatched'
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        # observer ของ backend sync ถูกเรียกจาก thread ใน threadpool
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            series = list(self._series.items())
+        return self._header() + [f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}' for labels, value in series]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._series[labels] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        # เก็บแบบไม่สะสมต่อ bucket (bisect หาตำแหน่งเดียว) แล้วค่อยสะสมตอน render
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        lines = self._header()
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+REQUESTS_TOTAL = Counter('http_requests_total', "HTTP requests by route template and status.", ('method', 'route', 'status'))
+REQUEST_DURATION = Histogram('http_request_duration_seconds', "Time from request start to the last response byte.", ('method', 'route'))
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', "Requests currently being handled.", ('method',))
+REQUEST_PHASE = Histogram(
+    'http_request_phase_seconds',
+    "Per-request time spent waiting for a pooled connection, connecting, executing, fetching, and everything else (handler code, serialization).",
+    ('method', 'route', 'phase'),
+)
+DB_POOL_WAIT = Histogram('db_pool_wait_seconds', "Time spent waiting for a free pooled connection.")
+DB_CONNECT = Histogram('db_connect_seconds', "Time spent opening new database connections.")
+DB_QUERY = Histogram('db_query_seconds', "Query time split into execute and fetch.", ('operation', 'table', 'phase'))
+DB_QUERY_ROWS = Histogram('db_query_rows', "Rows returned per query.", ('operation', 'table'), buckets=ROW_BUCKETS)
+GATE_CHECKINS = Histogram('gate_checkin_seconds', "Gate check-in handling time, from request to committed decision.", ('direction', 'decision'))
+GATE_CHECKINS_OVER_BUDGET = Counter('gate_checkins_over_budget_total', "Gate check-ins slower than CHECKIN_BUDGET_MS.", ('direction',))
+
+# เวลา DB แยกตาม phase ของ request ปัจจุบัน [pool_wait, connect, execute, fetch]
+# run_in_threadpool คัดลอก context ไปด้วย thread จึงบวกเข้า list เดียวกันได้
+_request_db = ContextVar('request_db', default=None)
+
+_STATEMENT = re.compile(r'^\s*\(?\s*(\w+)', re.ASCII)
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+`?(\w+)', re.IGNORECASE | re.ASCII)
+_query_labels = {}
+
+
+def query_labels(query):
+    """``(operation, table)`` for a query, e.g. ``('SELECT', 'Vehicle')``; used instead of the SQL text to keep label cardinality bounded."""
+    labels = _query_labels.get(query)
+    if labels is None:
+        statement = _STATEMENT.match(query)
+        table = _TABLE.search(query)
+        labels = (statement.group(1).upper() if statement else 'OTHER', table.group(1) if table else '')
+        # query ที่ต่อ placeholder ตามจำนวน id มีได้หลายแบบ จำกัดขนาดไว้ไม่ให้โตไม่รู้จบ
+        if len(_query_labels) < 2000:
+            _query_labels[query] = labels
+    return labels
+
+
+def observe_db(event, seconds, query=None, params=None, rows=None):
+    """``db`` observer: feeds the DB histograms and the current request's phase totals."""
+    if event == 'pool_wait':
+        DB_POOL_WAIT.observe(seconds)
+    elif event == 'connect':
+        DB_CONNECT.observe(seconds)
+    else:
+        operation, table = query_labels(query)
+        DB_QUERY.observe(seconds, operation, table, event)
+        if event == 'fetch':
+            DB_QUERY_ROWS.observe(rows, operation, table)
+    phases = _request_db.get()
+    if phases is not None:
+        phases[DB_PHASES.index(event)] += seconds
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route latency, status and in-flight counts.
+
+    The route label is the matched path template (``/vehicle/{vehicle_id}``),
+    read from the scope after routing, so ids never become label values.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        method = scope['method']
+        start = time.perf_counter()
+        phases = [0.0] * len(DB_PHASES)
+        token = _request_db.set(phases)
+        state = {'status': 500, 'end': None}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                state['status'] = message['status']
+            elif message['type'] == 'http.response.body' and not message.get('more_body', False):
+                state['end'] = time.perf_counter()
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec(method)
+            _request_db.reset(token)
+            # background task ทำงานหลังส่ง body ครบแล้ว ไม่นับรวมใน latency ที่ client เห็น
+            elapsed = (state['end'] or time.perf_counter()) - start
+            route = scope.get('route')
+            route = getattr(route, 'path', UNMATCHED_ROUTE)
+            REQUESTS_TOTAL.inc(method, route, str(state['status']))
+            REQUEST_DURATION.observe(elapsed, method, route)
+            for phase, seconds in zip(DB_PHASES, phases):
+                REQUEST_PHASE.observe(seconds, method, route, phase)
+            REQUEST_PHASE.observe(max(elapsed - sum(phases), 0.0), method, route, 'other')
+
+
+def _pool_lines():
+    if db.database is None:
+        return []
+    stats = db.stats()
+    lines = [
+        '# HELP db_pool_connections Pooled connections by state.',
+        '# TYPE db_pool_connections gauge',
+    ]
+    for state in ('idle', 'checked_out'):
+        if state in stats:
+            lines.append(f'db_pool_connections{{state="{state}"}} {stats[state]}')
+    if 'timeouts' in stats:
+        lines += [
+            '# HELP db_pool_timeouts_total Checkouts that gave up waiting for a connection.',
+            '# TYPE db_pool_timeouts_total counter',
+            f'db_pool_timeouts_total {stats["timeouts"]}',
+        ]
+    return lines
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    lines += _pool_lines()
+    return '\n'.join(lines) + '\n'
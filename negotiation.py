@@ -0,0 +1,323 @@
+import gzip
+import os
+import zlib
+
+import serialization
+
+try:
+    import brotli
+except ImportError:  # brotli เป็น optional ถ้าไม่มีก็บีบอัดด้วย gzip อย่างเดียว
+    brotli = None
+
+
+# body เล็กกว่านี้บีบแล้วแทบไม่ได้อะไร เสีย CPU เปล่า
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+# quality ต่ำ ๆ ของ brotli เร็วพอสำหรับ response ที่สร้างทุก request และยังเล็กกว่า gzip
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+# กัน request ที่บีบอัดมาแล้วขยายเป็นก้อนใหญ่เกินไป (zip bomb)
+REQUEST_BODY_MAX_BYTES = int(os.getenv('REQUEST_BODY_MAX_BYTES', str(32 * 1024 * 1024)))
+
+MSGPACK_MEDIA_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+_COMPRESSIBLE = ('application/json', 'application/msgpack', 'application/x-ndjson', 'text/')
+_ENCODINGS = ('br', 'gzip')
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+def parse_header(value):
+    """``Accept`` / ``Accept-Encoding`` to ``{token: q}``."""
+    preferences = {}
+    for part in value.split(','):
+        token, _, params = part.partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, number = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        preferences[token] = q
+    return preferences
+
+
+def response_format(accept):
+    """``'msgpack'`` when ``Accept`` prefers MessagePack over JSON, else ``'json'``."""
+    if not accept or serialization.msgpack is None:
+        return 'json'
+    preferences = parse_header(accept)
+    msgpack_q = max(preferences.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES)
+    json_q = max(preferences.get('application/json', 0.0), preferences.get('application/*', 0.0), preferences.get('*/*', 0.0))
+    return 'msgpack' if msgpack_q > 0 and msgpack_q >= json_q else 'json'
+
+
+def choose_encoding(accept_encoding):
+    """Best of ``br`` and ``gzip`` that the client accepts, ``None`` for identity."""
+    if not accept_encoding:
+        return None
+    preferences = parse_header(accept_encoding)
+    wildcard = preferences.get('*', 0.0)
+    candidates = (['br'] if brotli is not None else []) + ['gzip']
+    best = max(candidates, key=lambda encoding: preferences.get(encoding, wildcard))
+    return best if preferences.get(best, wildcard) > 0 else None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def decompress(body, encoding, limit=REQUEST_BODY_MAX_BYTES):
+    """Inflate a request body; raises ``BodyTooLarge`` past ``limit`` bytes, ``ValueError`` for a
+    truncated stream and ``LookupError`` for unknown encodings."""
+    if encoding == 'gzip':
+        data = _inflate_gzip(body, limit)
+    elif encoding == 'br' and brotli is not None:
+        data = _inflate_brotli(body, limit)
+    else:
+        raise LookupError(encoding)
+    if len(data) > limit:
+        raise BodyTooLarge(f"Request body is larger than {limit} bytes once decompressed")
+    return data
+
+
+def _inflate_gzip(body, limit):
+    chunks = []
+    total = 0
+    # gzip หลาย member ต่อกันถือเป็น body เดียว เหมือน gzip.decompress
+    while body:
+        decompressor = zlib.decompressobj(wbits=47)
+        chunk = decompressor.decompress(body, limit + 1 - total)
+        chunks.append(chunk)
+        total += len(chunk)
+        if total > limit:
+            raise BodyTooLarge(f"Request body is larger than {limit} bytes once decompressed")
+        if not decompressor.eof:
+            # ยังไม่ถึงท้าย stream ทั้งที่ใช้ input หมดแล้ว = body ถูกตัด
+            raise ValueError("Truncated gzip request body")
+        body = decompressor.unused_data
+    return b''.join(chunks)
+
+
+def _inflate_brotli(body, limit):
+    decompressor = brotli.Decompressor()
+    chunks = []
+    total = 0
+    while True:
+        # จำกัด output ของแต่ละรอบ ไม่ให้ body ไม่กี่ร้อย byte ขยายเต็ม memory ก่อนได้ตรวจขนาด
+        chunk = decompressor.process(body, output_buffer_limit=limit + 1 - total)
+        body = b''
+        chunks.append(chunk)
+        total += len(chunk)
+        if total > limit:
+            raise BodyTooLarge(f"Request body is larger than {limit} bytes once decompressed")
+        if decompressor.can_accept_more_data():
+            if not decompressor.is_finished():
+                raise ValueError("Truncated brotli request body")
+            return b''.join(chunks)
+
+
+def etag_for_encoding(etag, encoding):
+    """``"abc"`` -> ``"abc-gzip"``: each coding of a body is a different representation with its own ETag."""
+    if not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def strip_etag_encodings(value):
+    """``If-None-Match`` / ``If-Match`` with the coding suffixes removed, plus the coding that was found."""
+    found = None
+    tags = []
+    for tag in value.split(','):
+        tag = tag.strip()
+        for encoding in _ENCODINGS:
+            suffix = f'-{encoding}"'
+            if tag.endswith(suffix):
+                tag = tag[:-len(suffix)] + '"'
+                found = found or encoding
+                break
+        tags.append(tag)
+    return ', '.join(tags), found
+
+
+def _header(headers, name):
+    for key, value in headers:
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+
+def _strip_conditionals(headers):
+    """Request headers with coding suffixes taken off ETags in ``If-None-Match`` / ``If-Match``, and the coding found."""
+    found = None
+    stripped = []
+    for key, value in headers:
+        if key in (b'if-none-match', b'if-match'):
+            text, encoding = strip_etag_encodings(value.decode('latin-1'))
+            value = text.encode('latin-1')
+            found = found or encoding
+        stripped.append((key, value))
+    return stripped, found
+
+
+def _error(status, detail):
+    body = serialization.dumps({'detail': detail})
+    return [
+        {'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]},
+        {'type': 'http.response.body', 'body': body},
+    ]
+
+
+class NegotiationMiddleware:
+    """Pure ASGI middleware for MessagePack and gzip/brotli on both directions.
+
+    Requests: a ``Content-Encoding: gzip|br`` body is inflated and a
+    MessagePack body is re-encoded as JSON before FastAPI parses it, so every
+    create and bulk endpoint accepts both without changes.
+
+    Responses: ``Accept`` picks JSON or MessagePack through
+    ``serialization.response_format``; single-message bodies of a compressible
+    type at least ``COMPRESSION_MIN_BYTES`` long are compressed per
+    ``Accept-Encoding``. Streamed bodies (exports, SSE, files) pass through.
+    A compressed body's ETag gets the coding appended, and the suffix is
+    taken off conditional request headers again, so handlers only ever see
+    their own ETags.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        headers = scope['headers']
+        token = serialization.response_format.set(response_format(_header(headers, b'accept')))
+        headers, etag_encoding = _strip_conditionals(headers)
+        scope['headers'] = headers
+        try:
+            content_type = _header(headers, b'content-type').split(';')[0].strip().lower()
+            content_encoding = _header(headers, b'content-encoding').strip().lower()
+            if content_encoding not in ('', 'identity') or content_type in MSGPACK_MEDIA_TYPES:
+                receive = await self._decode_request(scope, receive, send, content_type, content_encoding)
+                if receive is None:
+                    return
+            await self.app(scope, receive, self._encoder(send, choose_encoding(_header(headers, b'accept-encoding')), etag_encoding))
+        finally:
+            serialization.response_format.reset(token)
+
+    async def _decode_request(self, scope, receive, send, content_type, content_encoding):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            size += len(chunks[-1])
+            if size > REQUEST_BODY_MAX_BYTES:
+                return await self._reject(send, 413, f"Request body is larger than {REQUEST_BODY_MAX_BYTES} bytes")
+            if not message.get('more_body', False):
+                break
+        body = b''.join(chunks)
+        if content_encoding not in ('', 'identity'):
+            try:
+                body = decompress(body, content_encoding)
+            except LookupError:
+                return await self._reject(send, 415, f"Unsupported Content-Encoding: {content_encoding}")
+            except BodyTooLarge as e:
+                return await self._reject(send, 413, str(e))
+            except Exception:
+                # zlib.error / brotli.error ของข้อมูลที่เสีย
+                return await self._reject(send, 400, f"Could not decode {content_encoding} request body")
+        if content_type in MSGPACK_MEDIA_TYPES:
+            if serialization.msgpack is None:
+                return await self._reject(send, 415, "MessagePack request bodies need msgpack installed")
+            try:
+                body = serialization.dumps(serialization.msgpack.unpackb(body))
+            except Exception:
+                return await self._reject(send, 400, "Invalid MessagePack request body")
+            content_type = 'application/json'
+        # แก้ header ใน scope เดิม (ไม่สร้าง dict ใหม่) middleware ชั้นนอกจะได้เห็น route ที่ router ใส่ไว้
+        scope['headers'] = [
+            (key, value) for key, value in scope['headers'] if key not in (b'content-encoding', b'content-length', b'content-type')
+        ] + ([(b'content-type', content_type.encode())] if content_type else []) + [(b'content-length', str(len(body)).encode())]
+        sent = False
+
+        async def decoded_receive():
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        return decoded_receive
+
+    async def _reject(self, send, status, detail):
+        for message in _error(status, detail):
+            await send(message)
+        return None
+
+    def _encoder(self, send, encoding, etag_encoding):
+        start = None
+
+        async def send_wrapper(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                # รอดู body ก้อนแรกก่อน ถึงจะรู้ว่าบีบอัดได้หรือไม่
+                start = message
+                return
+            if start is None:
+                await send(message)
+                return
+            pending, start = start, None
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                if pending['status'] == 304:
+                    self._not_modified(pending, etag_encoding)
+                else:
+                    message = self._compress(pending, message, encoding)
+            await send(pending)
+            await send(message)
+
+        return send_wrapper
+
+    def _not_modified(self, start, etag_encoding):
+        # client ถือ representation ที่บีบอัดอยู่ 304 ต้องตอบ ETag เดียวกับที่ client ส่งมา
+        if etag_encoding is None:
+            return
+        headers = start['headers'] = list(start.get('headers', []))
+        headers[:] = [
+            (key, etag_for_encoding(value.decode('latin-1'), etag_encoding).encode('latin-1') if key == b'etag' else value)
+            for key, value in headers
+        ]
+
+    def _compress(self, start, message, encoding):
+        headers = start['headers'] = list(start.get('headers', []))
+        content_type = _header(headers, b'content-type')
+        compressible = content_type.startswith(_COMPRESSIBLE)
+        # cache/proxy ต้องแยก response ตาม header ที่ใช้เลือก format และการบีบอัด
+        vary = (['Accept'] if content_type.startswith(('application/json', serialization.MSGPACK_MEDIA_TYPE)) else []) + (['Accept-Encoding'] if compressible else [])
+        if vary:
+            headers.append((b'vary', ', '.join(vary).encode()))
+        body = message.get('body', b'')
+        if (
+            encoding is None
+            or len(body) < COMPRESSION_MIN_BYTES
+            or not compressible
+            or _header(headers, b'content-encoding')
+        ):
+            return message
+        body = compress(body, encoding)
+        headers[:] = [
+            (key, etag_for_encoding(value.decode('latin-1'), encoding).encode('latin-1') if key == b'etag' else value)
+            for key, value in headers
+            if key != b'content-length'
+        ]
+        headers.append((b'content-encoding', encoding.encode()))
+        headers.append((b'content-length', str(len(body)).encode()))
+        return {**message, 'body': body}
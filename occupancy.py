@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+import time
+
+import access_index
+import db
+
+
+logger = logging.getLogger(__name__)
+
+# เทียบกับ DB เป็นระยะ เผื่อมีการแก้ EntryExitLog จาก worker อื่นหรือแก้ใน DB ตรงๆ (0 = ปิด)
+OCCUPANCY_RECONCILE_SECONDS = float(os.getenv('OCCUPANCY_RECONCILE_SECONDS', '300'))
+
+
+class OccupancyTracker:
+    """Vehicles currently inside the estate: EntryExitLog rows with no ``exit_time``.
+
+    Kept per open log and indexed by vehicle and by entry gate, so the total
+    and per-gate counts are O(1) and listing is O(vehicles inside, or inside
+    through that gate) instead of a scan of the whole log. All mutation happens on the event loop, so no
+    locking is needed.
+    """
+
+    def __init__(self):
+        self._open = {}
+        self._by_vehicle = {}
+        self._by_gate = {}
+        self.loaded = False
+        self.loaded_at = None
+
+    def upsert_log(self, log_id, vehicle_id, gate_id, entry_time, exit_time):
+        self.remove_log(log_id)
+        if exit_time is not None:
+            return
+        self._open[log_id] = (vehicle_id, gate_id, entry_time)
+        self._by_vehicle.setdefault(vehicle_id, set()).add(log_id)
+        self._by_gate.setdefault(gate_id, set()).add(log_id)
+
+    def remove_log(self, log_id):
+        entry = self._open.pop(log_id, None)
+        if entry is None:
+            return
+        vehicle_id, gate_id, _ = entry
+        log_ids = self._by_vehicle[vehicle_id]
+        log_ids.discard(log_id)
+        if not log_ids:
+            del self._by_vehicle[vehicle_id]
+        log_ids = self._by_gate[gate_id]
+        log_ids.discard(log_id)
+        if not log_ids:
+            del self._by_gate[gate_id]
+
+    def total(self):
+        return len(self._by_vehicle)
+
+    def vehicles(self, gate_id=None, resident_id=None):
+        """One entry per vehicle inside, from its most recent open log."""
+        vehicles = []
+        if gate_id is not None:
+            vehicle_ids = {self._open[log_id][0] for log_id in self._by_gate.get(gate_id, ())}
+        else:
+            vehicle_ids = self._by_vehicle.keys()
+        for vehicle_id in vehicle_ids:
+            log_ids = self._by_vehicle[vehicle_id]
+            # ปกติรถหนึ่งคันมี log ที่ยังไม่ออกแค่ log เดียว ถ้ามีหลายอันใช้อันล่าสุด
+            log_id = max(log_ids)
+            _, entry_gate_id, entry_time = self._open[log_id]
+            if gate_id is not None and entry_gate_id != gate_id:
+                continue
+            vehicle_resident_id = access_index.index.vehicle_resident(vehicle_id)
+            if resident_id is not None and vehicle_resident_id != resident_id:
+                continue
+            vehicles.append({
+                'vehicle_id': vehicle_id,
+                'resident_id': vehicle_resident_id,
+                'log_id': log_id,
+                'gate_id': entry_gate_id,
+                'entry_time': entry_time,
+                'open_logs': len(log_ids),
+            })
+        vehicles.sort(key=lambda vehicle: vehicle['log_id'])
+        return vehicles
+
+    def summary(self):
+        return {
+            'total': self.total(),
+            'open_logs': len(self._open),
+            'by_gate': [
+                {'gate_id': gate_id, 'open_logs': len(log_ids)}
+                for gate_id, log_ids in sorted(self._by_gate.items(), key=lambda item: (item[0] is None, item[0] or 0))
+            ],
+        }
+
+    def snapshot(self, gate_id=None, resident_id=None, include_vehicles=True):
+        """``summary`` plus per-resident counts and the vehicle list, narrowed by ``gate_id`` / ``resident_id``."""
+        vehicles = self.vehicles(gate_id, resident_id)
+        by_resident = {}
+        for vehicle in vehicles:
+            by_resident[vehicle['resident_id']] = by_resident.get(vehicle['resident_id'], 0) + 1
+        return {
+            **self.summary(),
+            'matched': len(vehicles),
+            'by_resident': [
+                {'resident_id': key, 'vehicles': count}
+                for key, count in sorted(by_resident.items(), key=lambda item: (item[0] is None, item[0] or 0))
+            ],
+            'vehicles': vehicles if include_vehicles else None,
+        }
+
+    def diff(self, other):
+        """Log ids whose vehicle or gate differs from ``other``, e.g. a tracker freshly built from the DB."""
+        # ไม่เทียบ entry_time: MySQL ปัดเศษวินาทีทิ้ง ค่าใน memory จึงไม่เท่ากับใน DB พอดี
+        return {
+            log_id for log_id in self._open.keys() | other._open.keys()
+            if self._open.get(log_id, ())[:2] != other._open.get(log_id, ())[:2]
+        }
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'loaded_at': self.loaded_at,
+            'vehicles': self.total(),
+            'open_logs': len(self._open),
+            'last_drift': last_drift,
+        }
+
+
+async def build_tracker():
+    tracker = OccupancyTracker()
+    async for rows in db.stream('SELECT log_id, vehicle_id, gate_id, entry_time FROM EntryExitLog WHERE exit_time IS NULL'):
+        for log_id, vehicle_id, gate_id, entry_time in rows:
+            tracker.upsert_log(log_id, vehicle_id, gate_id, entry_time, None)
+    tracker.loaded = True
+    tracker.loaded_at = time.time()
+    return tracker
+
+
+tracker = OccupancyTracker()
+_journal = None
+# จำนวน log ที่ไม่ตรงกับ DB ตอน reconcile ครั้งล่าสุด
+last_drift = None
+
+
+def apply(method, *args):
+    """Apply an incremental change, e.g. ``apply('upsert_log', ...)``, to the live tracker."""
+    getattr(tracker, method)(*args)
+    if _journal is not None:
+        _journal.append((method, args))
+
+
+async def reload():
+    """Rebuild from the DB and swap in, logging how far the live tracker had drifted."""
+    global tracker, _journal, last_drift
+    _journal = []
+    try:
+        new_tracker = await build_tracker()
+        for method, args in _journal:
+            getattr(new_tracker, method)(*args)
+        if tracker.loaded:
+            drift = tracker.diff(new_tracker)
+            last_drift = len(drift)
+            if drift:
+                logger.warning("Occupancy drifted from EntryExitLog on %d log(s), e.g. %s", len(drift), sorted(drift)[:10])
+        tracker = new_tracker
+    finally:
+        _journal = None
+    return tracker
+
+
+async def refresh_forever(interval):
+    while True:
+        if tracker.loaded and interval <= 0:
+            return
+        await asyncio.sleep(interval if tracker.loaded else 5)
+        try:
+            await reload()
+        except Exception:
+            logger.exception("Reconciling occupancy failed")
@@ -0,0 +1,86 @@
+import base64
+import binascii
+import json
+import os
+from datetime import date, datetime
+
+from fastapi import HTTPException
+
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '100'))
+
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, (date, datetime)) else v for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, parsers):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(parsers):
+            raise ValueError(cursor)
+        return [parse(value) for parse, value in zip(parsers, values)]
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class Keyset:
+    """Keyset (seek) pagination over ``keys``, which must be unique together.
+
+    Instead of OFFSET the query continues from the last row of the previous
+    page (``WHERE key > last``), so every page is an index range scan of
+    ``limit`` rows regardless of how deep the client has paged.
+    """
+
+    def __init__(self, table, columns, keys, descending=False, parsers=None, where=()):
+        self.table = table
+        self.columns = columns
+        self.keys = keys
+        self.descending = descending
+        self.where = where
+        self.parsers = parsers or (int,) * len(keys)
+        self._positions = [columns.index(key) for key in keys]
+
+    def project(self, columns):
+        """The same pagination selecting only ``columns``, which must include the keys."""
+        return Keyset(self.table, tuple(columns), self.keys, self.descending, self.parsers, self.where)
+
+    def query(self, cursor=None, limit=DEFAULT_PAGE_SIZE, filters=()):
+        """Return ``(sql, params)`` for one page; ``filters`` is ``[(sql, value), ...]``, ``None`` values skipped."""
+        where = list(self.where)
+        params = []
+        for clause, value in filters:
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        if cursor:
+            where.append(self._seek(params, decode_cursor(cursor, self.parsers)))
+        direction = 'DESC' if self.descending else 'ASC'
+        sql = f"SELECT {', '.join(self.columns)} FROM {self.table}"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY ' + ', '.join(f'{key} {direction}' for key in self.keys)
+        # ขอเกินมา 1 แถวเพื่อรู้ว่ายังมีหน้าถัดไปหรือไม่
+        sql += ' LIMIT %s'
+        params.append(limit + 1)
+        return sql, tuple(params)
+
+    def _seek(self, params, last):
+        # (a, b) > (x, y) เขียนแบบกระจายเป็น OR เพื่อให้ MySQL ใช้ index range ได้
+        op = '<' if self.descending else '>'
+        terms = []
+        for i, key in enumerate(self.keys):
+            parts = [f'{prev} = %s' for prev in self.keys[:i]] + [f'{key} {op} %s']
+            params.extend(last[:i + 1])
+            terms.append('(' + ' AND '.join(parts) + ')')
+        return '(' + ' OR '.join(terms) + ')'
+
+    def page(self, rows, limit):
+        """Trim the look-ahead row and return ``(rows, next_cursor)``."""
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        last = rows[-1]
+        return rows, encode_cursor([last[position] for position in self._positions])
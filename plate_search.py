@@ -0,0 +1,249 @@
+import asyncio
+import bisect
+import logging
+import os
+
+from starlette.concurrency import run_in_threadpool
+
+import db
+from access_index import normalize_plate, normalize_province
+
+
+logger = logging.getLogger(__name__)
+
+# ระยะแก้ไขสูงสุดที่ยอมรับ (ตัวอักษรหาย/เกิน/ผิด), index ใหญ่ขึ้นตามค่านี้
+PLATE_SEARCH_MAX_DISTANCE = int(os.getenv('PLATE_SEARCH_MAX_DISTANCE', '1'))
+# rebuild ทั้งก้อนใช้ memory เท่า index อีกชุดระหว่างสร้าง (ราว 120 MiB ที่ 100k คัน) ค่า default จึงโหลดครั้งเดียวตอน start
+# แล้วตามการแก้ไขผ่าน apply() ตั้งเป็นหลายชั่วโมงเมื่อมีหลาย worker ที่ต้องเห็นรถที่ worker อื่นเพิ่ม
+PLATE_INDEX_REFRESH_SECONDS = float(os.getenv('PLATE_INDEX_REFRESH_SECONDS', '0'))
+
+# ตัวอักษรที่ OCR มักอ่านสลับกัน ถูกพับให้เป็นตัวแทนเดียวกันก่อนเทียบ
+CONFUSABLE_GROUPS = (
+    'ขฃชซ', 'คฅดตศ', 'บปษ', 'ผฝ', 'พฟ', 'ถภ', 'ฎฏฐ', 'ทฑฒ', 'ฉณ', 'อฮ', 'ลส', 'รว',
+    '0ODQ', '1IL7', '2Z', '5S', '6G', '8B',
+)
+_FOLD = {ord(char): group[0] for group in CONFUSABLE_GROUPS for char in group[1:]}
+# ย้ายอักษรไทย (U+0E00-U+0E7F) ลงช่วง 0x80-0xFF ให้ key เป็น string 1 byte ต่อตัว ประหยัด memory
+_COMPACT = {code: chr(0x80 + code - 0x0E00) for code in range(0x0E00, 0x0E80)}
+
+
+def fold_plate(plate):
+    return normalize_plate(plate).translate(_FOLD).translate(_COMPACT)
+
+
+def _deletes(key, distance):
+    variants = {key}
+    frontier = {key}
+    for _ in range(distance):
+        frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+        variants |= frontier
+    variants.discard(key)
+    return variants
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance, or ``limit + 1`` once it exceeds ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # ตัดส่วนหัว/ท้ายที่เหมือนกันออกก่อน คู่ที่ต่างกันตัวเดียวจะเหลือตารางเล็กมาก
+    while a and b and a[-1] == b[-1]:
+        a, b = a[:-1], b[:-1]
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    a, b = a[start:], b[start:]
+    if not a or not b:
+        return len(a) + len(b)
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class PlateSearchIndex:
+    """Prefix and OCR-tolerant lookup over Vehicle.license_plate.
+
+    Plates are folded (normalized, confusable glyphs merged) into short keys.
+    Prefix queries bisect a sorted list of keys; fuzzy queries use the
+    symmetric-delete scheme: every key is indexed under all its variants with
+    up to ``max_distance`` characters deleted, so candidates for a query are
+    found by looking up the query's own delete variants, then verified with
+    a bounded edit distance. No query scans the whole table.
+    """
+
+    def __init__(self, max_distance=PLATE_SEARCH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._vehicles = {}
+        self._keys = {}
+        self._sorted_keys = []
+        self._deletes = {}
+        self.loaded = False
+
+    def upsert(self, vehicle_id, license_plate, province, keep_sorted=True):
+        self.remove(vehicle_id)
+        key = fold_plate(license_plate)
+        self._vehicles[vehicle_id] = (license_plate, province, normalize_plate(license_plate), key)
+        ids = self._keys.get(key)
+        if ids is not None:
+            ids.add(vehicle_id)
+            return
+        self._keys[key] = {vehicle_id}
+        if keep_sorted:
+            bisect.insort(self._sorted_keys, key)
+        else:
+            self._sorted_keys.append(key)
+        for variant in _deletes(key, self.max_distance):
+            # ส่วนใหญ่ variant หนึ่งชี้ไป key เดียว เก็บเป็น str ตรงๆ ใช้ set เฉพาะตอนชนกัน
+            existing = self._deletes.get(variant)
+            if existing is None:
+                self._deletes[variant] = key
+            elif isinstance(existing, set):
+                existing.add(key)
+            elif existing != key:
+                self._deletes[variant] = {existing, key}
+
+    def remove(self, vehicle_id):
+        entry = self._vehicles.pop(vehicle_id, None)
+        if entry is None:
+            return
+        key = entry[3]
+        ids = self._keys[key]
+        ids.discard(vehicle_id)
+        if ids:
+            return
+        del self._keys[key]
+        del self._sorted_keys[bisect.bisect_left(self._sorted_keys, key)]
+        for variant in _deletes(key, self.max_distance):
+            existing = self._deletes.get(variant)
+            if isinstance(existing, set):
+                existing.discard(key)
+                if len(existing) == 1:
+                    self._deletes[variant] = next(iter(existing))
+            elif existing == key:
+                del self._deletes[variant]
+
+    def _fuzzy_keys(self, key, max_distance):
+        candidates = set()
+        for variant in _deletes(key, max_distance) | {key}:
+            if variant in self._keys:
+                candidates.add(variant)
+            hit = self._deletes.get(variant)
+            if isinstance(hit, set):
+                candidates |= hit
+            elif hit is not None:
+                candidates.add(hit)
+        return candidates
+
+    def search(self, plate, province=None, limit=10, max_distance=None):
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        normalized = normalize_plate(plate)
+        key = fold_plate(plate)
+        if not key:
+            return []
+        province = normalize_province(province) if province else None
+
+        # (distance, ลำดับประเภทการ match, ทะเบียน) ยิ่งน้อยยิ่งตรง
+        matches = {}
+
+        def consider(candidate_key, distance, kind):
+            for vehicle_id in self._keys.get(candidate_key, ()):
+                license_plate, vehicle_province, vehicle_normalized, _ = self._vehicles[vehicle_id]
+                if province and normalize_province(vehicle_province) != province:
+                    continue
+                match = 'exact' if distance == 0 and vehicle_normalized == normalized else kind
+                rank = (distance, _KIND_ORDER[match], license_plate)
+                if vehicle_id not in matches or rank < matches[vehicle_id][0]:
+                    matches[vehicle_id] = (rank, {
+                        'vehicle_id': vehicle_id,
+                        'license_plate': license_plate,
+                        'province': vehicle_province,
+                        'match': match,
+                        'distance': distance,
+                    })
+
+        consider(key, 0, 'confusable')
+        start = bisect.bisect_left(self._sorted_keys, key)
+        for candidate_key in self._sorted_keys[start:start + limit * 4]:
+            if not candidate_key.startswith(key):
+                break
+            if candidate_key != key:
+                consider(candidate_key, 0, 'prefix')
+        if max_distance:
+            for candidate_key in self._fuzzy_keys(key, max_distance):
+                distance = edit_distance(key, candidate_key, max_distance)
+                if 0 < distance <= max_distance:
+                    consider(candidate_key, distance, 'fuzzy')
+
+        return [candidate for _, candidate in sorted(matches.values(), key=lambda match: match[0])[:limit]]
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'vehicles': len(self._vehicles),
+            'keys': len(self._keys),
+            'delete_variants': len(self._deletes),
+            'max_distance': self.max_distance,
+        }
+
+
+_KIND_ORDER = {'exact': 0, 'confusable': 1, 'prefix': 2, 'fuzzy': 3}
+
+
+def _add_rows(index, rows):
+    for vehicle_id, license_plate, province in rows:
+        # ตอนโหลดทั้งตาราง append แล้ว sort ครั้งเดียว ถูกกว่า insort ทีละแถว
+        index.upsert(vehicle_id, license_plate, province, keep_sorted=False)
+
+
+async def build_index():
+    # สร้าง deletion variant ใน threadpool ทีละ batch ที่ stream มา ไม่ให้ event loop ค้างหลายวินาที
+    # index ใหม่ยังไม่มีใครเห็นจนกว่า reload จะสลับ จึงแก้จาก thread ได้
+    index = PlateSearchIndex()
+    async for rows in db.stream('SELECT vehicle_id, license_plate, province FROM Vehicle'):
+        await run_in_threadpool(_add_rows, index, rows)
+    await run_in_threadpool(index._sorted_keys.sort)
+    index.loaded = True
+    return index
+
+
+index = PlateSearchIndex()
+_journal = None
+
+
+def apply(method, *args):
+    getattr(index, method)(*args)
+    if _journal is not None:
+        _journal.append((method, args))
+
+
+async def reload():
+    global index, _journal
+    _journal = []
+    try:
+        new_index = await build_index()
+        for method, args in _journal:
+            getattr(new_index, method)(*args)
+        index = new_index
+    finally:
+        _journal = None
+    return index
+
+
+async def refresh_forever(interval):
+    while True:
+        if index.loaded and interval <= 0:
+            return
+        await asyncio.sleep(interval if index.loaded else 5)
+        try:
+            await reload()
+        except Exception:
+            logger.exception("Loading the plate search index failed")
@@ -0,0 +1,153 @@
+"""Read routing between the primary and the read replicas in ``DB_REPLICA_HOSTS``.
+
+GET and HEAD requests read from a replica, taken in turn. Writes, reads made
+while handling a write, and all background work use the primary.
+
+A successful request that wrote on the primary answers with
+``X-Consistency-Token``, the primary's GTID set once the write has committed. A client that sends the token back on its
+next requests reads from a replica only once that replica has applied the
+set, and from the primary until then, so it always sees its own writes.
+"""
+import logging
+import os
+from collections import OrderedDict
+
+import db
+
+
+logger = logging.getLogger(__name__)
+
+CONSISTENCY_HEADER = 'X-Consistency-Token'
+# จำว่า replica ไหนตามทัน token ไหนแล้ว client ส่ง token เดิมซ้ำทุก request จนกว่าจะเขียนใหม่ ไม่ต้องถาม replica ซ้ำ
+REPLICA_TOKEN_CACHE_SIZE = int(os.getenv('DB_REPLICA_TOKEN_CACHE_SIZE', '10000'))
+# GTID set ยาวตามจำนวน server ที่เคยเป็น primary token ยาวกว่านี้ไม่ใช่ของเรา ไม่ส่งไปถาม replica (อ่านจาก primary)
+MAX_TOKEN_LENGTH = 4096
+
+READ_METHODS = ('GET', 'HEAD')
+
+_HEADER = CONSISTENCY_HEADER.lower().encode()
+
+
+class ReplicaRouter:
+    """Picks the replica for a read request and issues tokens for writes."""
+
+    def __init__(self, cache_size=REPLICA_TOKEN_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._applied = OrderedDict()
+        self._replica_reads = 0
+        self._primary_reads = 0
+        self._checks = 0
+        self._check_errors = 0
+        self._cache_hits = 0
+        self._tokens = 0
+        self._token_errors = 0
+
+    async def choose(self, token):
+        """Replica to read from for a request carrying ``token`` (may be ``None``), ``None`` for the primary."""
+        for replica in db.next_replicas():
+            if token is None or await self._has_applied(replica, token):
+                self._replica_reads += 1
+                return replica
+        # ยังไม่มี replica ไหนตามทันการเขียนล่าสุดของ client นี้
+        self._primary_reads += 1
+        return None
+
+    async def _has_applied(self, replica, token):
+        if len(token) > MAX_TOKEN_LENGTH:
+            return False
+        key = (id(replica), token)
+        if key in self._applied:
+            self._applied.move_to_end(key)
+            self._cache_hits += 1
+            return True
+        self._checks += 1
+        try:
+            applied = await replica.has_applied(token)
+        except (db.DatabaseError, db.PoolTimeoutError) as e:
+            # token เสียหรือ replica มีปัญหา อ่านจาก primary ไปก่อนปลอดภัยกว่า
+            self._check_errors += 1
+            logger.warning("Checking consistency token on a replica failed: %s", e)
+            return False
+        if applied:
+            self._applied[key] = True
+            while len(self._applied) > self.cache_size:
+                self._applied.popitem(last=False)
+        return applied
+
+    async def token(self):
+        """Token covering every write committed on the primary so far, ``None`` if it cannot be read."""
+        try:
+            position = await db.database.position()
+        except (db.DatabaseError, db.PoolTimeoutError) as e:
+            # การเขียน commit ไปแล้ว อย่าให้ request ล้มเพราะอ่านตำแหน่งไม่ได้
+            self._token_errors += 1
+            logger.warning("Reading the primary's GTID position failed: %s", e)
+            return None
+        if position is not None:
+            self._tokens += 1
+        return position
+
+    def stats(self):
+        return {
+            'replicas': len(db.replicas),
+            'replica_reads': self._replica_reads,
+            'primary_reads_lagging': self._primary_reads,
+            'token_checks': self._checks,
+            'token_check_errors': self._check_errors,
+            'token_cache_hits': self._cache_hits,
+            'token_cache_entries': len(self._applied),
+            'tokens_issued': self._tokens,
+            'token_errors': self._token_errors,
+        }
+
+
+class ReplicationMiddleware:
+    """Pure ASGI middleware that sets ``db.read_from`` per request and adds tokens to write responses.
+
+    Does nothing while no replicas are configured, so a single-server setup
+    pays no extra queries.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not db.replicas:
+            await self.app(scope, receive, send)
+            return
+        if scope['method'] not in READ_METHODS:
+            writes = []
+            token = db.primary_writes.set(writes)
+            try:
+                await self.app(scope, receive, self._tagger(send, writes))
+            finally:
+                db.primary_writes.reset(token)
+            return
+        replica = await router.choose(_token(scope['headers']))
+        token = db.read_from.set(replica)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            db.read_from.reset(token)
+
+    def _tagger(self, send, writes):
+        async def send_wrapper(message):
+            # อ่านตำแหน่งหลัง handler จบ transaction แล้ว token จึงครอบการเขียนของ request นี้
+            # request ที่ไม่ได้เขียนบน primary (เช่น 202 ของ write-behind, login ที่ไม่ rehash) ไม่ต้องถาม primary
+            if message['type'] == 'http.response.start' and message['status'] < 400 and writes:
+                position = await router.token()
+                if position is not None:
+                    message = {**message, 'headers': list(message.get('headers', [])) + [(_HEADER, position.encode())]}
+            await send(message)
+
+        return send_wrapper
+
+
+def _token(headers):
+    for key, value in headers:
+        if key == _HEADER:
+            return value.decode('latin-1').strip() or None
+    return None
+
+
+router = ReplicaRouter()
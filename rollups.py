@@ -0,0 +1,148 @@
+"""Hourly and daily entry/exit counts per gate, kept next to EntryExitLog.
+
+Every write to EntryExitLog adds its +1/-1 deltas to ``TrafficRollup`` in
+the same transaction, so ``GET /stats/traffic`` reads a handful of rollup
+rows instead of grouping the whole log. The table is created by schema
+migration 3; existing data is loaded with::
+
+    python rollups.py backfill [--from 2024-01-01] [--to 2024-02-01]
+"""
+import argparse
+import asyncio
+import os
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+
+import db
+
+
+TRAFFIC_ROLLUPS_ENABLED = os.getenv('TRAFFIC_ROLLUPS_ENABLED', '1') == '1'
+
+BUCKETS = ('hour', 'day')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS TrafficRollup (
+    bucket VARCHAR(4) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    gate_id INT NOT NULL,
+    direction VARCHAR(5) NOT NULL,
+    count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, bucket_start, gate_id, direction)
+)
+'''
+
+
+def bucket_start(bucket, moment):
+    if bucket == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return datetime.combine(moment.date(), time.min)
+
+
+def log_deltas(gate_id, entry_time, exit_time, exit_gate_id=None, sign=1):
+    """Rollup deltas for one log row; ``sign=-1`` takes a row's old values back out.
+
+    The exit counts at ``exit_gate_id``, the gate the vehicle left by, falling
+    back to ``gate_id`` for logs that never recorded one.
+    """
+    deltas = Counter()
+    for direction, moment, counted_gate_id in (('entry', entry_time, gate_id), ('exit', exit_time, exit_gate_id or gate_id)):
+        if moment is None:
+            continue
+        for bucket in BUCKETS:
+            deltas[(bucket, bucket_start(bucket, moment), counted_gate_id, direction)] += sign
+    return deltas
+
+
+async def record(tx, deltas):
+    """Add ``deltas`` to TrafficRollup inside ``tx`` with one multi-row upsert."""
+    if not TRAFFIC_ROLLUPS_ENABLED:
+        return
+    # เรียง key ให้ทุก transaction ล็อกแถว rollup ตามลำดับเดียวกัน กัน deadlock
+    rows = [key + (count,) for key, count in sorted(deltas.items()) if count]
+    if not rows:
+        return
+    query = (
+        'INSERT INTO TrafficRollup (bucket, bucket_start, gate_id, direction, count) VALUES '
+        + ', '.join(['(%s, %s, %s, %s, %s)'] * len(rows))
+        + ' ON DUPLICATE KEY UPDATE count = count + VALUES(count)'
+    )
+    await tx.execute(query, tuple(value for row in rows for value in row))
+
+
+async def fetch(bucket, from_time, to_time, gate_id=None):
+    """Rollup rows in ``[from_time, to_time)`` pivoted to one dict per (bucket_start, gate_id)."""
+    query = 'SELECT bucket_start, gate_id, direction, count FROM TrafficRollup WHERE bucket = %s AND bucket_start >= %s AND bucket_start < %s'
+    params = [bucket, bucket_start(bucket, from_time), to_time]
+    if gate_id is not None:
+        query += ' AND gate_id = %s'
+        params.append(gate_id)
+    query += ' ORDER BY bucket_start, gate_id'
+    series = {}
+    for start, row_gate_id, direction, count in await db.fetch_all(query, tuple(params)):
+        point = series.get((start, row_gate_id))
+        if point is None:
+            point = series[(start, row_gate_id)] = {'bucket_start': start, 'gate_id': row_gate_id, 'entries': 0, 'exits': 0}
+        point['entries' if direction == 'entry' else 'exits'] += count
+    # แถวที่ถูกลบ/แก้จนเหลือ 0 ยังอยู่ในตาราง ไม่ต้องส่งออกไป
+    return [point for point in series.values() if point['entries'] or point['exits']]
+
+
+async def backfill_day(day):
+    """Recompute both bucket sizes for one day from EntryExitLog, replacing what was there."""
+    start = datetime.combine(day, time.min)
+    end = start + timedelta(days=1)
+    deltas = Counter()
+    async with db.transaction() as tx:
+        for bucket in BUCKETS:
+            # ลบช่วง primary key ของวันนั้น แถว rollup ที่ request อื่นกำลังบวกอยู่จะรอจน backfill commit แล้วค่อยบวกต่อ
+            await tx.execute('DELETE FROM TrafficRollup WHERE bucket = %s AND bucket_start >= %s AND bucket_start < %s', (bucket, start, end))
+        # ขาออกนับที่ประตูที่ออกจริง log เก่าที่ไม่มี exit_gate_id นับที่ประตูขาเข้า เหมือน log_deltas
+        for gate_column, column, direction in (('gate_id', 'entry_time', 'entry'), ('COALESCE(exit_gate_id, gate_id)', 'exit_time', 'exit')):
+            rows = await tx.fetch_all(
+                f'SELECT {gate_column}, {column} FROM EntryExitLog WHERE {column} >= %s AND {column} < %s',
+                (start, end),
+            )
+            for gate_id, moment in rows:
+                for bucket in BUCKETS:
+                    deltas[(bucket, bucket_start(bucket, moment), gate_id, direction)] += 1
+        await record(tx, deltas)
+    return sum(count for (bucket, _, _, _), count in deltas.items() if bucket == 'day')
+
+
+async def backfill(from_day=None, to_day=None):
+    if from_day is None:
+        first = await db.fetch_one('SELECT MIN(entry_time) FROM EntryExitLog')
+        if not first or first[0] is None:
+            return 0
+        from_day = first[0].date()
+    to_day = to_day or date.today() + timedelta(days=1)
+    total = 0
+    day = from_day
+    while day < to_day:
+        counted = await backfill_day(day)
+        total += counted
+        print(f"{day}: {counted} entries/exits")
+        day += timedelta(days=1)
+    return total
+
+
+async def _main(args):
+    await db.init_database()
+    try:
+        total = await backfill(args.from_day, args.to_day)
+        print(f"backfilled {total} entries/exits")
+    finally:
+        await db.close_database()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild TrafficRollup from EntryExitLog.")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subcommands.add_parser('backfill', help="recompute rollups day by day (default: all of EntryExitLog)")
+    backfill_parser.add_argument('--from', dest='from_day', type=date.fromisoformat, help="first day, inclusive")
+    backfill_parser.add_argument('--to', dest='to_day', type=date.fromisoformat, help="last day, exclusive (default: tomorrow)")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
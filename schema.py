@@ -0,0 +1,342 @@
+"""Versioned schema for the app's MySQL tables, plus a check of hot query plans.
+
+    python schema.py status     # applied version and pending migrations
+    python schema.py migrate    # apply pending migrations, then verify
+    python schema.py verify     # fail if behind, an index is missing, or a hot query scans a table
+
+The app runs the same bootstrap at startup according to ``SCHEMA_BOOTSTRAP``.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from typing import NamedTuple, Tuple
+
+import db
+from slow_queries import EXPLAIN_COLUMNS
+
+
+logger = logging.getLogger(__name__)
+
+# off = ไม่แตะ schema, warn = ตรวจแล้ว log ปัญหาแต่ start ต่อ, verify = ตรวจแล้วไม่ยอม start ถ้ามีปัญหา (ค่า default),
+# migrate = สร้าง/อัปเดตแล้วตรวจ
+SCHEMA_BOOTSTRAP = os.getenv('SCHEMA_BOOTSTRAP', 'verify')
+BOOTSTRAP_MODES = ('off', 'warn', 'verify', 'migrate')
+# EXPLAIN ที่เป็น type=ALL ถือว่าผิดถ้าไม่มี index ให้เลือกเลย หรือ optimizer คาดว่าต้องอ่านเกินจำนวนนี้
+SCHEMA_SCAN_MAX_ROWS = int(os.getenv('SCHEMA_SCAN_MAX_ROWS', '1000'))
+
+
+class SchemaError(Exception):
+    """The database schema is behind, missing indexes, or a hot query would scan a whole table."""
+
+
+class Index(NamedTuple):
+    table: str
+    name: str
+    columns: Tuple[str, ...]
+
+
+class Column(NamedTuple):
+    table: str
+    name: str
+    definition: str
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    steps: tuple
+
+
+# เพิ่ม migration ใหม่ต่อท้ายเสมอ ห้ามแก้ของเดิมที่ deploy ไปแล้ว ทุก step ต้องรันซ้ำได้
+# step เขียนเป็นค่าตรง ๆ ไม่อ้างตัวแปรที่แก้ทีหลังได้ ตาราง/index ใหม่ให้เพิ่มเป็น migration ใหม่เท่านั้น
+MIGRATIONS = (
+    Migration(1, "base tables", (
+        '''CREATE TABLE IF NOT EXISTS User (
+            user_id INT AUTO_INCREMENT PRIMARY KEY,
+            email VARCHAR(255) NOT NULL,
+            username VARCHAR(100) NOT NULL,
+            password VARCHAR(255) NULL,
+            role VARCHAR(50) NOT NULL,
+            created_at DATETIME NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+        '''CREATE TABLE IF NOT EXISTS Resident (
+            resident_id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            address VARCHAR(500) NULL,
+            phone VARCHAR(50) NULL,
+            prefix VARCHAR(50) NULL,
+            lastname VARCHAR(255) NULL,
+            citizen_id VARCHAR(20) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+        '''CREATE TABLE IF NOT EXISTS Vehicle (
+            vehicle_id INT AUTO_INCREMENT PRIMARY KEY,
+            province VARCHAR(100) NOT NULL,
+            license_plate_img VARCHAR(500) NOT NULL,
+            vehicle_img VARCHAR(500) NOT NULL,
+            resident_id INT NOT NULL,
+            license_plate VARCHAR(50) NOT NULL,
+            vehicle_type VARCHAR(50) NOT NULL,
+            color VARCHAR(50) NOT NULL,
+            brand VARCHAR(100) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+        '''CREATE TABLE IF NOT EXISTS Visitor (
+            visitor_id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            phone VARCHAR(50) NOT NULL,
+            purpose VARCHAR(500) NOT NULL,
+            vehicle_id INT NULL,
+            resident_id INT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+        '''CREATE TABLE IF NOT EXISTS Gate (
+            gate_id INT AUTO_INCREMENT PRIMARY KEY,
+            location VARCHAR(255) NOT NULL,
+            gate_type VARCHAR(50) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+        '''CREATE TABLE IF NOT EXISTS SecurityStaff (
+            staff_id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            shift_time VARCHAR(50) NOT NULL,
+            phone VARCHAR(50) NOT NULL,
+            gate_id INT NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+        '''CREATE TABLE IF NOT EXISTS AccessPermission (
+            permission_id INT AUTO_INCREMENT PRIMARY KEY,
+            vehicle_id INT NOT NULL,
+            resident_id INT NOT NULL,
+            allowed_gate_id INT NOT NULL,
+            start_date DATE NOT NULL,
+            end_date DATE NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+        '''CREATE TABLE IF NOT EXISTS IncidentReport (
+            incident_id INT AUTO_INCREMENT PRIMARY KEY,
+            description TEXT NOT NULL,
+            incident_time DATETIME NULL,
+            vehicle_id INT NULL,
+            security_staff_id INT NULL,
+            gate_id INT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+        '''CREATE TABLE IF NOT EXISTS EntryExitLog (
+            log_id INT AUTO_INCREMENT PRIMARY KEY,
+            vehicle_id INT NOT NULL,
+            entry_time DATETIME NULL,
+            exit_time DATETIME NULL,
+            gate_id INT NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+    )),
+    # InnoDB ต่อ primary key ท้าย secondary index ให้เอง (gate_id, entry_time) จึงรองรับ keyset (entry_time, log_id) ได้
+    Migration(2, "indexes for hot queries", (
+        Index('Vehicle', 'idx_vehicle_plate', ('license_plate', 'province')),
+        Index('Vehicle', 'idx_vehicle_resident', ('resident_id',)),
+        Index('Visitor', 'idx_visitor_resident', ('resident_id',)),
+        Index('Visitor', 'idx_visitor_vehicle', ('vehicle_id',)),
+        Index('Resident', 'idx_resident_user', ('user_id',)),
+        Index('User', 'idx_user_username', ('username',)),
+        Index('AccessPermission', 'idx_permission_vehicle', ('vehicle_id', 'allowed_gate_id', 'end_date')),
+        Index('AccessPermission', 'idx_permission_resident', ('resident_id',)),
+        Index('AccessPermission', 'idx_permission_end_date', ('end_date',)),
+        Index('IncidentReport', 'idx_incident_time', ('incident_time',)),
+        Index('IncidentReport', 'idx_incident_gate', ('gate_id',)),
+        Index('IncidentReport', 'idx_incident_vehicle', ('vehicle_id',)),
+        Index('SecurityStaff', 'idx_staff_gate', ('gate_id',)),
+        Index('EntryExitLog', 'idx_log_entry_time', ('entry_time',)),
+        Index('EntryExitLog', 'idx_log_gate_time', ('gate_id', 'entry_time')),
+        Index('EntryExitLog', 'idx_log_vehicle_time', ('vehicle_id', 'entry_time')),
+        Index('EntryExitLog', 'idx_log_vehicle_exit', ('vehicle_id', 'exit_time')),
+        Index('EntryExitLog', 'idx_log_exit_time', ('exit_time',)),
+    )),
+    Migration(3, "traffic rollups", (
+        '''CREATE TABLE IF NOT EXISTS TrafficRollup (
+            bucket VARCHAR(4) NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            gate_id INT NOT NULL,
+            direction VARCHAR(5) NOT NULL,
+            count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, bucket_start, gate_id, direction)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+    )),
+    # ไม้กั้นที่รถออก ให้ rollup นับขาออกที่ประตูเดียวกันทั้งตอน check-in แก้ ลบ และ backfill (NULL = log เก่า นับที่ gate_id)
+    Migration(4, "exit gate on entry/exit logs", (
+        Column('EntryExitLog', 'exit_gate_id', 'INT NULL'),
+    )),
+)
+# index ที่ verify ตรวจ คือทุก index ที่ migration สร้าง
+INDEXES = tuple(step for migration in MIGRATIONS for step in migration.steps if isinstance(step, Index))
+LATEST_VERSION = MIGRATIONS[-1].version
+
+VERSION_TABLE = '''CREATE TABLE IF NOT EXISTS SchemaVersion (
+    version INT PRIMARY KEY,
+    description VARCHAR(255) NOT NULL,
+    applied_at DATETIME NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4'''
+
+
+async def current_version():
+    row = await db.fetch_one(
+        "SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'SchemaVersion'"
+    )
+    if not row[0]:
+        return 0
+    row = await db.fetch_one('SELECT MAX(version) FROM SchemaVersion')
+    return row[0] or 0
+
+
+async def has_tables():
+    """Whether the app's tables exist, e.g. a database created before versioning."""
+    row = await db.fetch_one(
+        "SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'EntryExitLog'"
+    )
+    return bool(row[0])
+
+
+async def existing_indexes():
+    rows = await db.fetch_all(
+        'SELECT DISTINCT TABLE_NAME, INDEX_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE()'
+    )
+    return {(table, name) for table, name in rows}
+
+
+async def existing_columns(table):
+    rows = await db.fetch_all(
+        'SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+        (table,),
+    )
+    return {name for name, in rows}
+
+
+async def _run_step(step, indexes):
+    if isinstance(step, Column):
+        # ADD COLUMN IF NOT EXISTS มีแค่ใน MariaDB ต้องเช็กจาก information_schema เหมือน index
+        if step.name in await existing_columns(step.table):
+            return
+        logger.info("Adding column %s.%s", step.table, step.name)
+        await db.execute(f"ALTER TABLE {step.table} ADD COLUMN {step.name} {step.definition}")
+    elif isinstance(step, Index):
+        # MySQL ไม่มี CREATE INDEX IF NOT EXISTS ต้องเช็กจาก information_schema เอง
+        if (step.table, step.name) in indexes:
+            return
+        logger.info("Creating index %s on %s (%s)", step.name, step.table, ', '.join(step.columns))
+        await db.execute(f"CREATE INDEX {step.name} ON {step.table} ({', '.join(step.columns)})")
+    else:
+        await db.execute(step)
+
+
+async def migrate():
+    """Apply pending migrations in order; returns the versions applied.
+
+    DDL commits implicitly in MySQL, so a migration is not atomic; its steps
+    are idempotent instead and a failed migration is simply run again.
+    """
+    await db.execute(VERSION_TABLE)
+    version = await current_version()
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        logger.info("Applying schema migration %d: %s", migration.version, migration.description)
+        indexes = await existing_indexes()
+        for step in migration.steps:
+            await _run_step(step, indexes)
+        await db.execute(
+            'INSERT INTO SchemaVersion (version, description, applied_at) VALUES (%s, %s, NOW())',
+            (migration.version, migration.description),
+        )
+        applied.append(migration.version)
+    return applied
+
+
+def _scan_problems(name, plan):
+    problems = []
+    for row in plan:
+        step = dict(zip(EXPLAIN_COLUMNS, row))
+        if step['type'] != 'ALL':
+            continue
+        if step['possible_keys'] is None or (step['rows'] or 0) > SCHEMA_SCAN_MAX_ROWS:
+            problems.append(f"{name}: full scan of {step['table']} (~{step['rows']} rows, possible keys: {step['possible_keys']})")
+    return problems
+
+
+async def explain_problems(hot_queries):
+    """EXPLAIN each ``name -> (query, params)`` and describe any full table scans."""
+    problems = []
+    for name, (query, params) in hot_queries.items():
+        plan = await db.fetch_all('EXPLAIN ' + query, params)
+        problems += _scan_problems(name, plan)
+    return problems
+
+
+async def verify(hot_queries):
+    version = await current_version()
+    if version == 0 and await has_tables():
+        # database ที่สร้างก่อนมี SchemaVersion ทุก step รันซ้ำได้ migrate จึงแค่เติมส่วนที่ขาดแล้วบันทึก version
+        raise SchemaError("Tables exist but no schema version is recorded: run `python schema.py migrate` once to adopt them")
+    if version < LATEST_VERSION:
+        raise SchemaError(f"Schema is at version {version}, app needs {LATEST_VERSION}: run `python schema.py migrate`")
+    indexes = await existing_indexes()
+    missing = [f'{index.table}.{index.name}' for index in INDEXES if (index.table, index.name) not in indexes]
+    if missing:
+        raise SchemaError(f"Missing indexes: {', '.join(missing)}")
+    problems = await explain_problems(hot_queries)
+    if problems:
+        raise SchemaError("Hot queries would scan whole tables:\n  " + '\n  '.join(problems))
+
+
+async def bootstrap(hot_queries, mode=None):
+    """Migrate and/or verify as ``mode`` says.
+
+    ``warn`` logs any failure, a schema problem or an unreachable database,
+    and lets the app start; ``verify`` and ``migrate`` raise it.
+    """
+    mode = mode or SCHEMA_BOOTSTRAP
+    if mode not in BOOTSTRAP_MODES:
+        raise SchemaError(f"Unknown SCHEMA_BOOTSTRAP {mode!r}, expected one of {', '.join(BOOTSTRAP_MODES)}")
+    if mode == 'off':
+        return
+    try:
+        if mode == 'migrate':
+            applied = await migrate()
+            if applied:
+                logger.info("Applied schema migrations %s", applied)
+        await verify(hot_queries)
+    except SchemaError as e:
+        if mode != 'warn':
+            raise
+        logger.warning("Database schema check failed, starting anyway (SCHEMA_BOOTSTRAP=warn): %s", e)
+    except Exception:
+        if mode != 'warn':
+            raise
+        # DB ยังไม่พร้อมไม่ใช่ปัญหาของ schema ให้ start ต่อไปได้
+        logger.exception("Checking the database schema at startup failed")
+
+
+async def _main(args):
+    await db.init_database()
+    try:
+        if args.command == 'status':
+            version = await current_version()
+            print(f"schema version {version} (latest {LATEST_VERSION})")
+            for migration in MIGRATIONS:
+                if migration.version > version:
+                    print(f"  pending {migration.version}: {migration.description}")
+            return
+        # import ตรงนี้เพื่อเอา HOT_QUERIES ของ app โดยไม่ให้ app กับ schema import กันเป็นวง
+        from app import HOT_QUERIES
+        await bootstrap(HOT_QUERIES, args.command)
+        print(f"schema version {await current_version()}: ok")
+    finally:
+        await db.close_database()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Create, migrate and verify the database schema.")
+    parser.add_argument('command', choices=['status', 'migrate', 'verify'])
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except SchemaError as e:
+        raise SystemExit(f"error: {e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import json
+from contextvars import ContextVar
+from datetime import date, datetime
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson เป็น optional ถ้าไม่มีใช้ json ของ stdlib แทน (ช้ากว่าแต่ผลเหมือนกัน)
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # ไม่มี msgpack ก็ตอบ JSON อย่างเดียว
+    msgpack = None
+
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+# format ที่ client ของ request ปัจจุบันขอผ่าน Accept ตั้งโดย negotiation.NegotiationMiddleware
+response_format = ContextVar('response_format', default='json')
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        # ให้ตรงกับ orjson OPT_OMIT_MICROSECONDS และกับที่ pydantic เคยส่งออก
+        return value.replace(microsecond=0).isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_OMIT_MICROSECONDS)
+    return json.dumps(content, default=_json_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def packb(content):
+    # วันที่เป็น ISO 8601 string เหมือนใน JSON ทั้งสอง format จะ decode ได้โครงสร้างเดียวกัน
+    if orjson is not None:
+        # แปลงวันที่ผ่าน orjson ทั้งก้อนเร็วกว่าให้ msgpack เรียก default ทีละค่าหลายเท่า
+        content = orjson.loads(dumps(content))
+        return msgpack.packb(content, use_bin_type=True)
+    return msgpack.packb(content, default=_json_default, use_bin_type=True)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoded with orjson; dates and datetimes become ISO 8601 strings.
+
+    When the request asked for MessagePack (see ``response_format``) the same
+    content is encoded with msgpack instead, so every endpoint returning this
+    class or a plain dict serves both formats.
+    """
+
+    def __init__(self, content, status_code=200, headers=None, media_type=None, background=None):
+        if media_type is None and msgpack is not None and response_format.get() == 'msgpack':
+            media_type = MSGPACK_MEDIA_TYPE
+        super().__init__(content, status_code, headers, media_type, background)
+
+    def render(self, content):
+        if self.media_type == MSGPACK_MEDIA_TYPE:
+            return packb(content)
+        return dumps(content)
+
+
+def _headers(response):
+    # header ที่ handler ตั้งไว้บน Response ที่ inject มา (X-Next-Cursor, ETag) ต้องติดไปด้วย
+    if response is None:
+        return None
+    return {name: value for name, value in response.headers.items() if name != 'content-length'}
+
+
+def rows_response(columns, rows, response=None):
+    """Serialize DB row tuples straight to JSON, named by ``columns``.
+
+    Returning a Response makes FastAPI skip ``response_model`` validation and
+    its own encoding pass; rows read from our tables are already the right
+    types, and the model stays on the route for the OpenAPI schema.
+    """
+    return json_response([dict(zip(columns, row)) for row in rows], response)
+
+
+def row_response(columns, row, response=None):
+    return json_response(dict(zip(columns, row)), response)
+
+
+def json_response(content, response=None):
+    return FastJSONResponse(content, headers=_headers(response))
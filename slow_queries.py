@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+from collections import deque
+from datetime import datetime
+
+import db
+
+
+logger = logging.getLogger(__name__)
+
+# เทียบกับเวลา execute ของแต่ละคำสั่ง (0 = ปิด)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '100'))
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', '200'))
+SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', '1') == '1'
+SLOW_QUERY_MAX_STATEMENTS = 500
+
+# คอลัมน์ของ EXPLAIN แบบ traditional ใน MySQL 8
+EXPLAIN_COLUMNS = ('id', 'select_type', 'table', 'partitions', 'type', 'possible_keys', 'key', 'key_len', 'ref', 'rows', 'filtered', 'Extra')
+
+_EXPLAINABLE = re.compile(r'^\s*\(?\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+\b")
+_PLACEHOLDERS = re.compile(r'%s(?:\s*,\s*%s)+')
+_ROW_GROUPS = re.compile(r'\(%s, \.\.\.\)(?:\s*,\s*\(%s, \.\.\.\))+')
+
+
+def normalize(query):
+    """Statement shape used as the grouping key: one line, literals as ``?``, placeholder lists collapsed.
+
+    ``IN (%s, %s, %s)`` and multi-row ``VALUES`` of any length map to the same
+    shape, so a bulk insert of 10 rows and one of 500 are counted together.
+    """
+    shape = ' '.join(query.split())
+    shape = _LITERAL.sub('?', shape)
+    shape = _PLACEHOLDERS.sub('%s, ...', shape)
+    return _ROW_GROUPS.sub('(%s, ...), ...', shape)
+
+
+class SlowQueryLog:
+    """Per-shape totals and a ring buffer of recent statements slower than the threshold.
+
+    ``EXPLAIN`` is captured once per shape, using the parameters of the first
+    slow occurrence, by a background task so the request that hit the slow
+    query does not wait for it.
+    """
+
+    def __init__(self, threshold_ms=SLOW_QUERY_THRESHOLD_MS, size=SLOW_QUERY_LOG_SIZE, explain=SLOW_QUERY_EXPLAIN):
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self._recent = deque(maxlen=size)
+        self._statements = {}
+        # observer ของ backend sync ถูกเรียกจาก thread ใน threadpool
+        self._lock = threading.Lock()
+        self._loop = None
+        self._explain_queue = None
+        self._worker = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._explain_queue = asyncio.Queue(maxsize=100)
+        if self.explain:
+            self._worker = asyncio.create_task(self._explain_forever())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        self._loop = None
+
+    def observe(self, event, seconds, query=None, params=None, rows=None):
+        """``db`` observer; only ``execute`` events are compared with the threshold."""
+        if event != 'execute' or seconds < self.threshold or query.lstrip()[:7].upper() == 'EXPLAIN':
+            return
+        shape = normalize(query)
+        now = datetime.now().replace(microsecond=0)
+        with self._lock:
+            stats = self._statements.get(shape)
+            first = stats is None
+            if first:
+                if len(self._statements) >= SLOW_QUERY_MAX_STATEMENTS:
+                    return
+                stats = self._statements[shape] = {
+                    'statement': shape, 'count': 0, 'total_seconds': 0.0, 'worst_seconds': 0.0,
+                    'last_seen': None, 'explain': None,
+                }
+            stats['count'] += 1
+            stats['total_seconds'] += seconds
+            stats['worst_seconds'] = max(stats['worst_seconds'], seconds)
+            stats['last_seen'] = now
+            self._recent.append({'at': now, 'statement': shape, 'seconds': round(seconds, 6)})
+        logger.warning("Slow query (%.1f ms): %s", seconds * 1000, shape)
+        if first and self._loop is not None and self._worker is not None and _EXPLAINABLE.match(query):
+            try:
+                self._loop.call_soon_threadsafe(self._enqueue, shape, query, params)
+            except RuntimeError:
+                # loop ปิดไปแล้ว (กำลัง shutdown)
+                pass
+
+    def _enqueue(self, shape, query, params):
+        try:
+            self._explain_queue.put_nowait((shape, query, params))
+        except asyncio.QueueFull:
+            pass
+
+    async def _explain_forever(self):
+        while True:
+            shape, query, params = await self._explain_queue.get()
+            try:
+                rows = await db.fetch_all('EXPLAIN ' + query, params)
+                plan = [dict(zip(EXPLAIN_COLUMNS, row)) if len(row) == len(EXPLAIN_COLUMNS) else list(row) for row in rows]
+            except Exception as e:
+                logger.warning("EXPLAIN failed for %s: %s", shape, e)
+                plan = {'error': str(e)}
+            with self._lock:
+                if shape in self._statements:
+                    self._statements[shape]['explain'] = plan
+
+    def clear(self):
+        with self._lock:
+            self._statements.clear()
+            self._recent.clear()
+
+    def stats(self):
+        with self._lock:
+            statements = [dict(stats) for stats in self._statements.values()]
+            recent = list(self._recent)
+        for stats in statements:
+            stats['avg_seconds'] = round(stats['total_seconds'] / stats['count'], 6)
+            stats['total_seconds'] = round(stats['total_seconds'], 6)
+            stats['worst_seconds'] = round(stats['worst_seconds'], 6)
+        statements.sort(key=lambda stats: stats['total_seconds'], reverse=True)
+        return {
+            'threshold_ms': self.threshold * 1000,
+            'statements': statements,
+            'recent': recent[::-1],
+        }
+
+
+log = SlowQueryLog()
@@ -0,0 +1,208 @@
+import asyncio
+import itertools
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = os.getenv('ENTRYEXITLOG_WRITE_BEHIND', '0') == '1'
+# flush เมื่อครบ WRITE_BEHIND_BATCH_SIZE แถว หรือครบ WRITE_BEHIND_INTERVAL_MS นับจาก event แรกของ batch
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '200'))
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv('WRITE_BEHIND_INTERVAL_MS', '50'))
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', '5000'))
+WRITE_BEHIND_PUT_TIMEOUT = float(os.getenv('WRITE_BEHIND_PUT_TIMEOUT', '0.5'))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv('WRITE_BEHIND_MAX_RETRIES', '5'))
+WRITE_BEHIND_RESULT_CACHE = int(os.getenv('WRITE_BEHIND_RESULT_CACHE', '10000'))
+
+_STOP = object()
+
+
+class QueueFullError(Exception):
+    """Raised when the buffer stays full for longer than the put timeout."""
+
+
+class WriteBehindBuffer:
+    """Bounded in-process queue flushed to the database in group commits.
+
+    ``flush`` is an async callable taking a list of items and returning
+    ``(ids, errors)`` aligned with it, as ``insert_entry_exit_logs`` does.
+    Each submitted item gets a provisional id that can later be resolved to
+    the real row id (or the error that rejected it) through ``resolve``.
+    ``after_commit(items, ids)`` runs once per successful flush, outside the
+    retries, for side effects that must not repeat the insert if they fail.
+    """
+
+    def __init__(self, flush, batch_size, interval, queue_size, put_timeout, max_retries, result_cache, after_commit=None):
+        self._flush = flush
+        self._after_commit = after_commit
+        self.batch_size = batch_size
+        self.interval = interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self._queue = asyncio.Queue(queue_size)
+        self._results = OrderedDict()
+        self._result_cache = result_cache
+        self._prefix = secrets.token_hex(4)
+        self._sequence = itertools.count(1)
+        self._task = None
+        self._accepting = False
+        self._submitted = 0
+        self._rejected = 0
+        self._committed = 0
+        self._failed = 0
+        self._flushes = 0
+        self._flush_seconds = 0.0
+        self._max_depth = 0
+        self._restarts = 0
+
+    async def start(self):
+        self._accepting = True
+        self._spawn()
+
+    def _spawn(self):
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._on_done)
+
+    def _on_done(self, task):
+        if task.cancelled() or task.exception() is None:
+            return
+        if not self._accepting:
+            logger.error("Write-behind flush task died while stopping", exc_info=task.exception())
+            return
+        # task ตายไป event ที่เข้าคิวจะค้างโดยไม่มีใครเขียน เริ่มใหม่ทันที (batch ที่กำลังเขียนอยู่ตอนนั้นหายไป)
+        logger.error("Write-behind flush task died, restarting it", exc_info=task.exception())
+        self._restarts += 1
+        self._spawn()
+
+    async def stop(self):
+        # ไม่รับ event ใหม่ แล้วรอ flush ของที่ค้างในคิวให้หมดก่อนปิด
+        self._accepting = False
+        if self._task is not None:
+            await self._queue.put(_STOP)
+            await self._task
+            self._task = None
+
+    async def submit(self, item):
+        if not self._accepting:
+            raise QueueFullError("Write-behind buffer is shutting down")
+        provisional_id = f'{self._prefix}-{next(self._sequence)}'
+        try:
+            # ทางปกติคิวยังไม่เต็ม ไม่ต้องผ่าน wait_for ที่ต้องรอ event loop อีกหลายรอบ
+            self._queue.put_nowait((provisional_id, item))
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put((provisional_id, item)), self.put_timeout)
+            except asyncio.TimeoutError:
+                self._rejected += 1
+                raise QueueFullError(f"Write-behind queue is full ({self._queue.maxsize} pending events)")
+        self._submitted += 1
+        self._max_depth = max(self._max_depth, self._queue.qsize())
+        return provisional_id
+
+    def resolve(self, provisional_id):
+        """Return ``(log_id, error)`` once flushed, ``None`` while pending or unknown."""
+        return self._results.get(provisional_id)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.interval
+            while len(batch) < self.batch_size:
+                # เก็บของที่รออยู่ในคิวแล้วทันที รอด้วย wait_for เฉพาะตอนคิวว่าง
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._write(batch)
+
+        # drain: event ที่เข้าคิวก่อน stop ต้องถูกเขียนให้หมด
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.batch_size):
+            await self._write(remaining[start:start + self.batch_size])
+
+    async def _write(self, batch):
+        items = [item for _, item in batch]
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                ids, errors = await self._flush(items)
+                break
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.max_retries:
+                    logger.exception("Write-behind flush of %d events failed, giving up", len(batch))
+                    ids, errors = [None] * len(batch), {index: str(e) for index in range(len(batch))}
+                    break
+                logger.warning("Write-behind flush of %d events failed (attempt %d): %s", len(batch), attempt, e)
+                await asyncio.sleep(min(0.1 * 2 ** attempt, 5))
+        self._flushes += 1
+        self._flush_seconds += time.perf_counter() - start
+        if self._after_commit is not None and any(log_id is not None for log_id in ids):
+            try:
+                self._after_commit(items, ids)
+            except Exception:
+                # แถว commit ไปแล้ว ห้าม retry ไม่อย่างนั้น insert ซ้ำ
+                logger.exception("Write-behind after-commit hook failed for %d events", len(batch))
+        for index, (provisional_id, _) in enumerate(batch):
+            error = errors.get(index)
+            if error is None:
+                self._committed += 1
+            else:
+                self._failed += 1
+            self._results[provisional_id] = (ids[index], error)
+        while len(self._results) > self._result_cache:
+            self._results.popitem(last=False)
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'queue_max_depth': self._max_depth,
+            'queue_size': self._queue.maxsize,
+            'batch_size': self.batch_size,
+            'interval_seconds': self.interval,
+            'submitted': self._submitted,
+            'rejected': self._rejected,
+            'committed': self._committed,
+            'failed': self._failed,
+            'flushes': self._flushes,
+            'rows_per_commit': round((self._committed + self._failed) / self._flushes, 2) if self._flushes else 0.0,
+            'flush_seconds_avg': round(self._flush_seconds / self._flushes, 6) if self._flushes else 0.0,
+            'task_restarts': self._restarts,
+        }
+
+
+def create_buffer(flush, after_commit=None):
+    return WriteBehindBuffer(
+        flush,
+        batch_size=WRITE_BEHIND_BATCH_SIZE,
+        interval=WRITE_BEHIND_INTERVAL_MS / 1000,
+        queue_size=WRITE_BEHIND_QUEUE_SIZE,
+        put_timeout=WRITE_BEHIND_PUT_TIMEOUT,
+        max_retries=WRITE_BEHIND_MAX_RETRIES,
+        result_cache=WRITE_BEHIND_RESULT_CACHE,
+        after_commit=after_commit,
+    )